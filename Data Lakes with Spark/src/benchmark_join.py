@@ -0,0 +1,47 @@
+import time
+import argparse
+import tempfile
+from pyspark.sql import functions as F
+from etl import create_spark_session, read_song_data, build_songplays
+from schemas import log_schema
+from metrics import stage_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shuffle bytes and stage durations of the songplays build, '
+                                                 'shuffle join vs. broadcast join.')
+    parser.add_argument('--input', default='../../Data Modeling with Postgres/data')
+    parser.add_argument('--output', default=None, help='scratch directory, a temporary one by default')
+    parser.add_argument('--master', default='local[*]')
+    args = parser.parse_args()
+    output = args.output or tempfile.mkdtemp()
+
+    spark = create_spark_session(args.master)
+    song_data = read_song_data(spark, args.input)
+    df = spark.read.json(f'{args.input}/log_data/*/*/*.json', schema=log_schema) \
+              .filter(F.col('page') == 'NextSong') \
+              .withColumn('start_time', (F.col('ts') / 1000).cast('timestamp'))
+
+    summary = []
+    for join in ['shuffle', 'broadcast']:
+        # without the hint, also keep Spark from broadcasting the small song side by itself
+        threshold = '-1' if join == 'shuffle' else '10485760'
+        spark.conf.set('spark.sql.autoBroadcastJoinThreshold', threshold)
+
+        spark.sparkContext.setJobGroup(join, 'songplays with a {} join'.format(join))
+        start = time.perf_counter()
+        build_songplays(df, song_data, broadcast=(join == 'broadcast')) \
+            .write.parquet(f'{output}/songplays_{join}', mode='overwrite', partitionBy=['year', 'month'])
+        elapsed = time.perf_counter() - start
+
+        stages = stage_report(spark, join)
+        summary.append((join, elapsed, len(stages), sum(stage['shuffle_write_bytes'] for stage in stages)))
+
+    print('{:<10}{:>10}{:>8}{:>16}'.format('join', 'seconds', 'stages', 'shuffle bytes'))
+    for join, elapsed, stages, shuffled in summary:
+        print('{:<10}{:>10.2f}{:>8}{:>16}'.format(join, elapsed, stages, shuffled))
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import time
+import argparse
+from etl import create_spark_session
+from schemas import song_schema, log_schema
+
+
+def timed_read(spark, path, schema=None, repeat=3):
+    """
+    This function is to time reading a JSON dataset and counting its rows,
+    with schema inference or with a declared schema.
+
+    Args:
+    ----------------------------------------
+        spark:   the spark session
+        path:    the glob of the JSON files
+        schema:  declared StructType, or None to infer
+        repeat:  number of runs; the fastest is kept
+
+    Return:
+        (best seconds, rows)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        reader = spark.read.schema(schema) if schema is not None else spark.read
+        rows = reader.json(path).count()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time inferred vs. declared schema reads of the raw datasets.')
+    parser.add_argument('--input', default='../../Data Modeling with Postgres/data')
+    parser.add_argument('--master', default='local[*]')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    spark = create_spark_session(args.master)
+    print('{:<6}{:>10}{:>14}{:>14}{:>10}'.format('data', 'rows', 'inferred s', 'declared s', 'speedup'))
+    for name, path, schema in [('song', f'{args.input}/song_data/*/*/*/*.json', song_schema),
+                               ('log', f'{args.input}/log_data/*/*/*.json', log_schema)]:
+        inferred, rows = timed_read(spark, path, None, args.repeat)
+        declared, _ = timed_read(spark, path, schema, args.repeat)
+        print('{:<6}{:>10}{:>14.3f}{:>14.3f}{:>9.1f}x'.format(name, rows, inferred, declared, inferred / declared))
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
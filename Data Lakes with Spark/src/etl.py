@@ -1,57 +1,298 @@
 import configparser
-from datetime import datetime
+from datetime import datetime, date, timedelta, timezone
 import os
-from pyspark.sql import SparkSession, functions as F
+import sys
+import math
+import argparse
+from pyspark.sql import SparkSession, Window, functions as F
 from pyspark.sql.functions import udf, col
 from pyspark.sql.functions import year, month, dayofmonth, hour, weekofyear, date_format
+from schemas import song_schema, log_schema, check_schema_drift
+from metrics import stage_report
+
+# instrumentation is shared with the other projects in common/ at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'common'))
+import instrumentation
+from instrumentation import stage
 
 
 config = configparser.ConfigParser()
 config.read('dl.cfg')
 
-os.environ['AWS_ACCESS_KEY_ID']=config['AWS_ACCESS_KEY_ID']
-os.environ['AWS_SECRET_ACCESS_KEY']=config['AWS_SECRET_ACCESS_KEY']
+# credentials are only needed for s3a:// paths; local runs leave dl.cfg empty
+if config.has_section('AWS') and config['AWS'].get('AWS_ACCESS_KEY_ID'):
+    os.environ['AWS_ACCESS_KEY_ID']=config['AWS']['AWS_ACCESS_KEY_ID']
+    os.environ['AWS_SECRET_ACCESS_KEY']=config['AWS']['AWS_SECRET_ACCESS_KEY']
 
 
-def create_spark_session():
-    spark = SparkSession \
+def create_spark_session(master=None):
+    builder = SparkSession \
         .builder \
-        .config("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0") \
-        .getOrCreate()
-    return spark
+        .config("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0")
+    if master:
+        builder = builder.master(master)
+    return builder.getOrCreate()
+
+
+# target size of the Parquet files written by write_table and compact_table
+TARGET_FILE_BYTES = 128 * 1024 * 1024
 
+# most files write_table splits a table into, whatever the size estimate
+MAX_WRITE_FILES = 10000
 
-def process_song_data(spark, input_data, output_data):
+# log files of an incremental run whose records the schema drift check samples
+DRIFT_SAMPLE_FILES = 10
+
+
+def choose_partitions(df, candidates, max_partitions=1000):
     """
-    This function is to read the song data in the filepath (bucket/song_data)
-    to get the song and artist info. 
+    This function is to pick the partition columns of a table: the longest
+    prefix of candidates whose combined cardinality stays under
+    max_partitions, so partitioning never produces a directory per artist.
     
     Args:
     ----------------------------------------
-        spark:        the cursor object
-        input_data:   the path of the bucket containing song data
-        output_data:  the path where the parquet files stored
+        df:              the table to write
+        candidates:      partition columns in order of preference
+        max_partitions:  maximum number of partition directories
+    
+    Return:
+        list of partition columns, possibly empty
+    """
+    if not candidates:
+        return []
+    counts = df.agg(*[F.approx_count_distinct(F.concat_ws('|', *candidates[:i + 1])).alias(str(i))
+                      for i in range(len(candidates))]).first()
+    chosen = []
+    for i, column in enumerate(candidates):
+        if counts[str(i)] > max_partitions:
+            break
+        chosen.append(column)
+    print('Partition columns {} chosen from {} (distinct values {})'.format(chosen, candidates, list(counts)))
+    return chosen
+
+
+def estimate_bytes(df):
+    """
+    This function is to estimate the size of a DataFrame from its inputs:
+    the bytes of the files (or local rows) its plan reads, or the optimizer's
+    estimate when that is smaller. Without cost-based optimization a join is
+    estimated as the product of its sides, far above what it returns, so the
+    optimizer's estimate alone would split songplays_table into a huge number
+    of files.
+    
+    Return:
+        estimated bytes, or None when the plan has no statistics
+    """
+    try:
+        plan = df._jdf.queryExecution().optimizedPlan()
+        leaves = plan.collectLeaves()
+        inputs = sum(int(leaves.apply(i).stats().sizeInBytes().toString()) for i in range(leaves.size()))
+        return min(inputs, int(plan.stats().sizeInBytes().toString()))
+    except Exception:
+        return None
+
+
+def write_table(df, path, partition_cols=None, max_records_per_file=5000000, dynamic=False):
+    """
+    This function is to write a table as Parquet files close to the target
+    size. Rows are repartitioned by the partition columns, so each partition
+    directory gets one file per max_records_per_file rows instead of one small
+    file per task, and the plan of df keeps its parallelism up to the shuffle.
+    
+    Args:
+    ----------------------------------------
+        df:                    the table to write
+        path:                  the output directory
+        partition_cols:        list of partition columns, or None
+        max_records_per_file:  upper bound on rows per file
+        dynamic:               True only replaces the partitions present in
+                               df, the whole directory is replaced otherwise
     
     Return:
         None
     """
-    # get filepath to song data file
-    song_data = f'{input_data}/song_data/*/*/*/*.json'
+    size = estimate_bytes(df)
+    if size is not None:
+        files = math.ceil(size / TARGET_FILE_BYTES)
+    else:
+        files = df.rdd.getNumPartitions()
+    files = min(max(1, files), MAX_WRITE_FILES)
+
+    # coalesce would run the whole plan of df in as few tasks as there are files
+    df = df.repartition(files, *(partition_cols or []))
+
+    # the write runs the whole plan of df; only the driver's CPU time is counted
+    with stage('write {}'.format(path.rstrip('/').rsplit('/', 1)[-1])):
+        df.write.option('maxRecordsPerFile', max_records_per_file) \
+                .option('partitionOverwriteMode', 'dynamic' if dynamic else 'static') \
+                .parquet(path, mode='overwrite', partitionBy=partition_cols or None)
+
+
+def hadoop_path(spark, path):
+    """
+    This function is to get the Hadoop FileSystem and Path of a location, so
+    local, HDFS and s3a outputs are handled alike.
+    
+    Return:
+        (FileSystem, Path)
+    """
+    hpath = spark.sparkContext._jvm.org.apache.hadoop.fs.Path(path)
+    return hpath.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration()), hpath
+
+
+def replace_dir(spark, src, dst):
+    """
+    This function is to swap a freshly written directory in place of another.
+    
+    Args:
+    ----------------------------------------
+        spark:  the spark session
+        src:    the directory to move
+        dst:    the directory it replaces
     
-    # read song data file    
-    song_data = spark.read.json(song_data, sep=";", inferSchema=True, header=True)
+    Return:
+        None
+    """
+    fs, dst_path = hadoop_path(spark, dst)
+    src_path = hadoop_path(spark, src)[1]
+    if fs.exists(dst_path):
+        fs.delete(dst_path, True)
+    fs.rename(src_path, dst_path)
+
+
+def compact_table(spark, path):
+    """
+    This function is to merge the small files of every partition directory
+    of an existing table. Each directory with more files than its size needs
+    is rewritten next to it and swapped in.
+    
+    Args:
+    ----------------------------------------
+        spark:              the spark session
+        path:               the table directory
+    
+    Return:
+        number of partition directories compacted
+    """
+    fs, root = hadoop_path(spark, path)
+    if not fs.exists(root):
+        return 0
+
+    # leaf directories with their data files
+    leaves = []
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        files = []
+        for status in fs.listStatus(directory):
+            name = status.getPath().getName()
+            if name.startswith('_') or name.startswith('.'):
+                continue
+            if status.isDirectory():
+                pending.append(status.getPath())
+            else:
+                files.append(status.getLen())
+        if files:
+            leaves.append((directory, files))
+
+    compacted = 0
+    for directory, files in leaves:
+        wanted = max(1, math.ceil(sum(files) / TARGET_FILE_BYTES))
+        if len(files) <= wanted:
+            continue
+        tmp = directory.toString() + '.compacting'
+        spark.read.parquet(directory.toString()).coalesce(wanted) \
+             .write.parquet(tmp, mode='overwrite')
+        replace_dir(spark, tmp, directory.toString())
+        print('Compacted {}: {} files into {}'.format(directory.toString(), len(files), wanted))
+        compacted += 1
+    return compacted
+
+
+def read_cache(spark, cache, dataset, schema):
+    """
+    This function is to read a dataset from the Parquet staging cache of
+    common/staging_cache.py instead of the raw JSON. Columns are cast to the
+    declared schema, and the year/month partitions of log_data are kept, so
+    filters on them only list the matching directories.
+    
+    Args:
+    ----------------------------------------
+        spark:    the spark session
+        cache:    the path of the cache
+        dataset:  song_data or log_data
+        schema:   song_schema or log_schema
+    
+    Return:
+        DataFrame
+    """
+    df = spark.read.parquet(f'{cache}/{dataset}')
+    extra = [name for name in df.columns if name in ('year', 'month') and name not in schema.fieldNames()]
+    return df.select([F.col(field.name).cast(field.dataType) for field in schema.fields] + extra)
+
+
+def read_song_data(spark, input_data, cache=None):
+    """
+    This function is to read the song data once and keep the projected
+    song/artist columns used by every table built from it in memory.
+    
+    Args:
+    ----------------------------------------
+        spark:        the cursor object
+        input_data:   the path of the bucket containing song data
+        cache:        the path of the staging cache to read instead, or None
+    
+    Return:
+        persisted DataFrame of the song dataset
+    """
+    if cache is not None:
+        song_data = read_cache(spark, cache, 'song_data', song_schema)
+    else:
+        # get filepath to song data file
+        song_data = f'{input_data}/song_data/*/*/*/*.json'
+
+        # read song data file with the declared schema (no inference pass)
+        check_schema_drift(spark, song_data, song_schema)
+        song_data = spark.read.json(song_data, schema=song_schema)
+    song_data = song_data.select('song_id', 'title', 'artist_id', 'year', 'duration', 'artist_name',
+                             'artist_location', 'artist_latitude', 'artist_longitude') \
+                     .persist()
     
     # song_data.printSchema()
     print('Success of reading song_data from S3.')
+    return song_data
+
+
+def process_song_data(spark, input_data, output_data, song_data=None, cache=None):
+    """
+    This function is to read the song data in the filepath (bucket/song_data)
+    to get the song and artist info. 
+    
+    Args:
+    ----------------------------------------
+        spark:        the cursor object
+        input_data:   the path of the bucket containing song data
+        output_data:  the path where the parquet files stored
+        song_data:    song dataset from read_song_data(), read here if None
+        cache:        the path of the staging cache to read instead, or None
+    
+    Return:
+        the song dataset, for process_log_data to reuse
+    """
+    if song_data is None:
+        song_data = read_song_data(spark, input_data, cache)
 
     # extract columns to create songs table
     # songs table: song_id, title, artist_id, year, duration
     songs_table = song_data.select('song_id', 'title', 'artist_id', 'year',
                                   'duration').dropDuplicates()
     
-    # write songs table to parquet files partitioned by year and artist
-    songs_table.write.parquet(f'{output_data}/songs_table', mode='overwrite',
-                             partitionBy=['year', 'artist_id'])
+    # write songs table to parquet files partitioned by year, if there are few
+    # enough years; a directory per artist would only hold tiny files
+    songs_table.persist()
+    write_table(songs_table, f'{output_data}/songs_table', choose_partitions(songs_table, ['year']))
+    songs_table.unpersist()
     
     # check on songs_table
     print("Success of writing sons_table to parquet")
@@ -62,12 +303,219 @@ def process_song_data(spark, input_data, output_data):
                                     'artist_latitude', 'artist_longitude').dropDuplicates()
     
     # write artists table to parquet files
-    artists_table.write.parquet(f'{output_data}/artists_table', mode='overwrite')
+    write_table(artists_table, f'{output_data}/artists_table')
     
     # check on artists_table
     print("Success of writing artists_table to parquet")
 
-def process_log_data(spark, input_data, output_data):
+    return song_data
+
+
+def read_song_lookup(spark, output_data):
+    """
+    This function is to rebuild the columns build_songplays needs from the
+    songs and artists tables already in the lake, so incremental runs do not
+    reread the raw song JSON.
+    
+    Return:
+        DataFrame with title, artist_name, duration, song_id and artist_id
+    """
+    artists = spark.read.parquet(f'{output_data}/artists_table').select('artist_id', 'artist_name') \
+                   .dropDuplicates(['artist_id'])
+    return spark.read.parquet(f'{output_data}/songs_table') \
+                .select('song_id', 'title', 'artist_id', 'duration') \
+                .join(F.broadcast(artists), on='artist_id')
+
+
+def build_songplays(df, song_data, broadcast=True):
+    """
+    This function is to match NextSong events to songs on title, artist name
+    and duration. The song side is small, so it is broadcast to every task and
+    the log data is joined where it was read, without a shuffle. year and month
+    are derived from start_time instead of joining time_table.
+    
+    Args:
+    ------------------------------
+        df:         NextSong events with start_time
+        song_data:  song dataset from read_song_data()
+        broadcast:  False joins without the broadcast hint (for comparison)
+        
+    Returns:
+        songplays DataFrame; events without a matching song keep null ids
+    """
+    songs = song_data.select(F.col('title').alias('song'), F.col('artist_name').alias('artist'),
+                             F.col('duration').alias('length'), 'song_id', 'artist_id') \
+                     .dropDuplicates(['song', 'artist', 'length'])
+    if broadcast:
+        songs = F.broadcast(songs)
+
+    return df.join(songs, on=['song', 'artist', 'length'], how='left') \
+             .select('start_time',
+                     F.year('start_time').alias('year'),
+                     F.month('start_time').alias('month'),
+                     F.col('userId').alias('user_id'), 'level',
+                     'song_id', 'artist_id',
+                     F.col('sessionId').alias('session_id'),
+                     'location', F.col('userAgent').alias('user_agent'),
+                     songplay_key().alias('songplay_id'))
+
+
+def songplay_key():
+    """
+    This function is to derive songplay_id from the natural key of an event,
+    its position in its session, so a songplay gets the same id in every run
+    and ids of runs over different days cannot collide.
+    
+    Return:
+        Column of 64-bit ids
+    """
+    return F.xxhash64('ts', 'userId', 'sessionId', 'itemInSession')
+
+def daily_log_paths(spark, input_data, start, end):
+    """
+    This function is to list the log files of a date range. Logs are stored
+    as log_data/YYYY/MM/YYYY-MM-DD-events.json, so only those days are read.
+    
+    Args:
+    ----------------------------------------
+        spark:       the spark session
+        input_data:  the path of the bucket containing log data
+        start:       first date, included
+        end:         last date, included
+    
+    Return:
+        list of existing log file paths
+    """
+    fs = hadoop_path(spark, input_data)[0]
+    paths = []
+    day = start
+    with stage('discover') as timed:
+        while day <= end:
+            pattern = f'{input_data}/log_data/{day:%Y}/{day:%m}/{day:%Y-%m-%d}*.json'
+            for status in fs.globStatus(hadoop_path(spark, pattern)[1]) or []:
+                paths.append(status.getPath().toString())
+                timed.add(bytes_read=status.getLen())
+            day += timedelta(days=1)
+        timed.add(rows_out=len(paths))
+    return paths
+
+
+def replace_days(spark, df, path, first, last):
+    """
+    This function is to write the rows of a range of days into a table
+    partitioned by year and month, replacing the rows of those days written
+    before, so processing the same days again does not duplicate them. The
+    other days of the months touched are kept: the months are rebuilt next
+    to the table and written over their partitions.
+    
+    Args:
+    ----------------------------------------
+        spark:  the spark session
+        df:     rows of the days, with start_time, year and month
+        path:   the table directory
+        first:  first date, included
+        last:   last date, included
+    
+    Return:
+        None
+    """
+    months = []
+    day = first.replace(day=1)
+    while day <= last:
+        months.append((day.year, day.month))
+        day = (day + timedelta(days=31)).replace(day=1)
+
+    fs, root = hadoop_path(spark, path)
+    if fs.exists(root):
+        month = F.col('year') * 100 + F.col('month')
+        kept = spark.read.parquet(path) \
+                    .filter(month.isin([year * 100 + number for year, number in months])
+                            & ~F.to_date('start_time').between(first, last))
+        df = df.unionByName(kept.select(*df.columns))
+
+    # the table is read while the months are rebuilt, so they are written apart
+    # first, replacing whatever an interrupted run left there
+    staging = path.rstrip('/') + '.replacing'
+    write_table(df, staging, ['year', 'month'])
+    write_table(spark.read.schema(df.schema).parquet(staging), path, ['year', 'month'], dynamic=True)
+
+    # months left without rows are not in the output, so they are removed here
+    for year, number in months:
+        partition = hadoop_path(spark, f'{staging}/year={year}/month={number}')[1]
+        target = hadoop_path(spark, f'{path}/year={year}/month={number}')[1]
+        if not fs.exists(partition) and fs.exists(target):
+            fs.delete(target, True)
+    fs.delete(hadoop_path(spark, staging)[1], True)
+
+
+def read_watermark(spark, output_data):
+    """
+    This function is to read the last log date loaded into the output.
+    
+    Return:
+        date, or None before the first incremental run
+    """
+    fs, path = hadoop_path(spark, f'{output_data}/_watermark')
+    if not fs.exists(path):
+        return None
+    return datetime.strptime(spark.read.text(f'{output_data}/_watermark').first().value, '%Y-%m-%d').date()
+
+
+def write_watermark(spark, output_data, day):
+    """
+    This function is to store the last log date loaded next to the tables.
+    
+    Return:
+        None
+    """
+    spark.createDataFrame([(day.isoformat(),)], ['value']).coalesce(1) \
+         .write.text(f'{output_data}/_watermark', mode='overwrite')
+
+
+def latest_users(df):
+    """
+    This function is to keep one row per user, from their latest event, so
+    the latest level wins.
+    
+    Args:
+    ----------------------------------------
+        df:  events with userId, firstName, lastName, gender, level and ts
+    
+    Return:
+        users DataFrame
+    """
+    latest = Window.partitionBy('userId').orderBy(F.col('ts').desc())
+    return df.select('userId', 'firstName', 'lastName', 'gender', 'level', 'ts') \
+             .withColumn('n', F.row_number().over(latest)) \
+             .filter(F.col('n') == 1).drop('n', 'ts')
+
+
+def merge_users(spark, users, output_data):
+    """
+    This function is to merge the users of new events into user_table: users
+    seen again are replaced by their latest row, the others are kept. The
+    merged table is written next to user_table and swapped in.
+    
+    Args:
+    ----------------------------------------
+        spark:        the spark session
+        users:        latest_users() of the new events
+        output_data:  the path where the parquet files stored
+    
+    Return:
+        None
+    """
+    path = f'{output_data}/user_table'
+    fs, hpath = hadoop_path(spark, path)
+    if fs.exists(hpath):
+        existing = spark.read.parquet(path)
+        users = existing.join(users.select('userId'), on='userId', how='left_anti') \
+                        .unionByName(users.select(*existing.columns))
+    write_table(users, path + '.merging')
+    replace_dir(spark, path + '.merging', path)
+
+
+def process_log_data(spark, input_data, output_data, song_data=None, log_paths=None, cache=None, days=None):
     """
     This function is to read the log data in the filepath (bucket/log_data)
     to get the info. to populate the users, time and song tables.
@@ -77,33 +525,58 @@ def process_log_data(spark, input_data, output_data):
         spark:       the cursor object
         input_data:  the path to the bucket containing song data
         output_data: the path where the parquet files stored
+        song_data:   song dataset from read_song_data(), read here if None
+        log_paths:   only read these log files, the logs of days
+        cache:       the path of the staging cache to read instead of the JSON
+        days:        (first, last) date of the events to process: their rows
+                     of time_table and songplays_table are replaced and
+                     user_table is merged; all logs are read and every table
+                     rewritten if None
         
     Returns:
-        None
+        date of the latest event read, to be stored as the watermark
     
     """
-    
-    # get filepath to log data file
-    log_data = f'{input_data}/log_data/*/*/*.json'
+    incremental = days is not None
+
+    if cache is not None:
+        df = read_cache(spark, cache, 'log_data', log_schema)
+        if days is not None:
+            # the year/month filter prunes partitions, the ts filter row groups
+            first, last = days
+            month = F.col('year') * 100 + F.col('month')
+            start_ms, end_ms = [int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+                                for day in (first, last + timedelta(days=1))]
+            df = df.filter((month >= first.year * 100 + first.month) & (month <= last.year * 100 + last.month)
+                           & (F.col('ts') >= start_ms) & (F.col('ts') < end_ms))
+        print("Success of reading log_data from the staging cache")
+    else:
+        # get filepath to log data file
+        log_data = log_paths if log_paths is not None else f'{input_data}/log_data/*/*/*.json'
 
-    # read log data file
-    df = spark.read.json(log_data)
-    print("Success of reading log_data from S3")
+        # read log data file with the declared schema (no inference pass); the
+        # drift check samples records of files spread over the range read
+        sample = log_data if log_paths is None else log_paths[::max(1, len(log_paths) // DRIFT_SAMPLE_FILES)]
+        check_schema_drift(spark, sample, log_schema)
+        df = spark.read.json(log_data, schema=log_schema)
+        print("Success of reading log_data from S3")
     
     # filter by actions for song plays
     df = df.filter(df['page'] == 'NextSong')
 
-    # extract columns for users table  
+    # extract columns for users table, one row per user with their latest level
     # users table: user_id, first_name, last_name, gender, level
-    user_table = df.select('userId', 'firstName', 'lastName',
-                             'gender', 'level').dropDuplicates()
+    user_table = latest_users(df)
     
     # write users table to parquet files
-    user_table.write.parquet(f'{output_data}/user_table', mode='overwrite')
+    if incremental:
+        merge_users(spark, user_table, output_data)
+    else:
+        write_table(user_table, f'{output_data}/user_table')
     print('Success of writing user_table to parquet')
     
     # convert ts column to timestamp
-    df = df.withColumn('start_time', F.from_unixtime(F.cols('ts')/1000))
+    df = df.withColumn('start_time', (F.col('ts') / 1000).cast('timestamp'))
 
     # extract columns to create time table
     # time table: start_time, hour, day, week, month, year, weekday
@@ -117,44 +590,99 @@ def process_log_data(spark, input_data, output_data):
     print('Success of extracting time column')
     
     # write time table to parquet files partitioned by year and month
-    time_table.write.parquet(f'{output_table}/time_table', mode='overwrite',
-                             partitionBy=['year', 'month']
-                            )
+    if incremental:
+        replace_days(spark, time_table, f'{output_data}/time_table', *days)
+    else:
+        write_table(time_table, f'{output_data}/time_table', ['year', 'month'])
     print('Success of writing time_table to parquet')
     
-    # read in song data to use for songplays table
-    song_data = f'{input_data}/song_data/A/A/A/*.json'
-    song_dataset = spark.read.json(song_data)
-    print('Success of reading song_dataset from S3')
-    
-    # create temporary view of song_dataset, time_table and log_dataset 
-    song_dataset.createOrReplaceTempView('song_dataset')
-    time_table.createOrReplaceTempView('time_table')
-    df.createOrReplaceTempView('log_dataset')
-
-    # extract columns from joined song and log datasets to create songplays table 
-    songplays_table = spark.sql("""SELECT DISTINCT
-                                   FROM song_dataset s
-                                   JOIN log_dataset l
-                                   ON s.title = l.song
-                                       AND s.duration = l.length
-                                       AND s.artist_name  = l.artist
-                                       JOIN time_table t
-                                   ON t.ts = l.ts"""
-                                ).dropDuplicates()
+    # reuse the song dataset read for the songs and artists tables
+    if song_data is None and incremental:
+        song_data = read_song_lookup(spark, output_data)
+    elif song_data is None:
+        song_data = read_song_data(spark, input_data)
+
+    # extract columns from logs joined to the broadcast songs to create songplays table
+    songplays_table = build_songplays(df, song_data)
 
     # write songplays table to parquet files partitioned by year and month
-    songplays_table.write.parquet(f'{output_data}/songplays_table', mode='overwrite',
-                                 partitionBy=['year', 'month'])
+    spark.sparkContext.setJobGroup('songplays', 'build and write songplays_table')
+    if incremental:
+        replace_days(spark, songplays_table, f'{output_data}/songplays_table', *days)
+    else:
+        write_table(songplays_table, f'{output_data}/songplays_table', ['year', 'month'])
+    print('Success of writing songplays_table to parquet')
+    stage_report(spark, 'songplays')
+
+    latest = time_table.agg(F.max('start_time')).first()[0]
+    return latest.date() if latest is not None else None
 
     
 def main():
-    spark = create_spark_session()
-    input_data = "s3a://udacity-dend"
-    output_data = "s3a://spark-bucket"
+    global TARGET_FILE_BYTES
+    parser = argparse.ArgumentParser(description='Build the Sparkify data lake tables.')
+    parser.add_argument('--input', default='s3a://udacity-dend',
+                        help='directory with song_data and log_data, e.g. "../../Data Modeling with Postgres/data"')
+    parser.add_argument('--output', default='s3a://spark-bucket')
+    parser.add_argument('--master', default=None, help='e.g. local[*] to run without a cluster')
+    parser.add_argument('--compact', action='store_true',
+                        help='merge the small files of the existing output tables instead of running the ETL')
+    parser.add_argument('--target-file-mb', type=int, default=TARGET_FILE_BYTES // (1024 * 1024))
+    parser.add_argument('--start-date', type=date.fromisoformat, default=None,
+                        help='only process the logs from this date (YYYY-MM-DD); the day after the '
+                             'stored watermark by default')
+    parser.add_argument('--end-date', type=date.fromisoformat, default=None,
+                        help='last log date to process; yesterday by default')
+    parser.add_argument('--incremental', action='store_true',
+                        help='process only the logs after the watermark stored with the output')
+    parser.add_argument('--cache', default=None,
+                        help='read song_data and log_data from this Parquet staging cache (common/staging_cache.py) '
+                             'instead of the JSON')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args('spark_etl', args)
+
+    TARGET_FILE_BYTES = args.target_file_mb * 1024 * 1024
+
+    spark = create_spark_session(args.master)
+    input_data = args.input
+    output_data = args.output
+
+    if args.compact:
+        for table in ['songs_table', 'artists_table', 'user_table', 'time_table', 'songplays_table']:
+            compact_table(spark, f'{output_data}/{table}')
+        return
     
-    process_song_data(spark, input_data, output_data)    
-    process_log_data(spark, input_data, output_data)
+    if args.incremental or args.start_date:
+        start = args.start_date or read_watermark(spark, output_data)
+        if start is None:
+            print('No watermark in {}; run a full load or pass --start-date'.format(output_data))
+            return
+        if not args.start_date:
+            start += timedelta(days=1)
+        end = args.end_date or date.today() - timedelta(days=1)
+
+        latest = None
+        if args.cache:
+            latest = process_log_data(spark, input_data, output_data, cache=args.cache, days=(start, end))
+        else:
+            log_paths = daily_log_paths(spark, input_data, start, end)
+            print('{} log files between {} and {}'.format(len(log_paths), start, end))
+            if log_paths:
+                latest = process_log_data(spark, input_data, output_data, log_paths=log_paths, days=(start, end))
+
+        # the watermark only moves to the latest event loaded, so days whose logs
+        # arrive late are read by the next run, and reprocessing an older range
+        # does not move it back
+        stored = read_watermark(spark, output_data)
+        if latest is not None and (stored is None or latest > stored):
+            write_watermark(spark, output_data, latest)
+        return
+
+    song_data = process_song_data(spark, input_data, output_data, cache=args.cache)
+    latest = process_log_data(spark, input_data, output_data, song_data, cache=args.cache)
+    if latest is not None:
+        write_watermark(spark, output_data, latest)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+# shuffle bytes and durations of the stages run for a job group, read from the
+# Spark UI REST API of the running application
+
+import json
+from datetime import datetime
+from urllib.request import urlopen
+
+
+def _get(spark, endpoint):
+    url = '{}/api/v1/applications/{}/{}'.format(spark.sparkContext.uiWebUrl,
+                                                spark.sparkContext.applicationId, endpoint)
+    with urlopen(url) as response:
+        return json.loads(response.read().decode('utf8'))
+
+
+def _seconds(stage):
+    if not stage.get('submissionTime') or not stage.get('completionTime'):
+        return 0.0
+    parse = lambda value: datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f%Z')
+    return (parse(stage['completionTime']) - parse(stage['submissionTime'])).total_seconds()
+
+
+def stage_report(spark, job_group):
+    """
+    This function is to collect and print the stages of the jobs started
+    under a job group (set with sparkContext.setJobGroup before the action).
+
+    Args:
+    ----------------------------------------
+        spark:      the spark session
+        job_group:  the job group id
+
+    Return:
+        list of dicts with stage id, name, seconds, input, shuffle read and
+        shuffle write bytes
+    """
+    stage_ids = set()
+    for job in _get(spark, 'jobs'):
+        if job.get('jobGroup') == job_group:
+            stage_ids.update(job['stageIds'])
+
+    stages = []
+    for stage in _get(spark, 'stages'):
+        if stage['stageId'] in stage_ids and stage['status'] == 'COMPLETE':
+            stages.append({'stage': stage['stageId'],
+                           'name': stage['name'].split(' at ')[0],
+                           'seconds': _seconds(stage),
+                           'input_bytes': stage.get('inputBytes', 0),
+                           'shuffle_read_bytes': stage.get('shuffleReadBytes', 0),
+                           'shuffle_write_bytes': stage.get('shuffleWriteBytes', 0)})
+    stages.sort(key=lambda stage: stage['stage'])
+
+    print('{}: {:<6}{:<22}{:>10}{:>14}{:>16}{:>16}'.format(job_group, 'stage', 'name', 'seconds', 'input bytes',
+                                                           'shuffle read', 'shuffle write'))
+    for stage in stages:
+        print('{}: {:<6}{:<22}{:>10.2f}{:>14}{:>16}{:>16}'.format(
+            job_group, stage['stage'], stage['name'][:21], stage['seconds'], stage['input_bytes'],
+            stage['shuffle_read_bytes'], stage['shuffle_write_bytes']))
+    print('{}: {} stages, {:.2f} s, {} shuffle bytes written'.format(
+        job_group, len(stages), sum(stage['seconds'] for stage in stages),
+        sum(stage['shuffle_write_bytes'] for stage in stages)))
+    return stages
@@ -0,0 +1,75 @@
+# declared schemas of the raw song and log datasets, so spark.read.json does
+# not need an extra pass over every file to infer them
+
+import json
+from pyspark.sql.types import StructType, StructField, StringType, DoubleType, LongType
+
+
+song_schema = StructType([
+    StructField('num_songs', LongType()),
+    StructField('artist_id', StringType()),
+    StructField('artist_latitude', DoubleType()),
+    StructField('artist_longitude', DoubleType()),
+    StructField('artist_location', StringType()),
+    StructField('artist_name', StringType()),
+    StructField('song_id', StringType()),
+    StructField('title', StringType()),
+    StructField('duration', DoubleType()),
+    StructField('year', LongType()),
+])
+
+log_schema = StructType([
+    StructField('artist', StringType()),
+    StructField('auth', StringType()),
+    StructField('firstName', StringType()),
+    StructField('gender', StringType()),
+    StructField('itemInSession', LongType()),
+    StructField('lastName', StringType()),
+    StructField('length', DoubleType()),
+    StructField('level', StringType()),
+    StructField('location', StringType()),
+    StructField('method', StringType()),
+    StructField('page', StringType()),
+    StructField('registration', DoubleType()),
+    StructField('sessionId', LongType()),
+    StructField('song', StringType()),
+    StructField('status', LongType()),
+    StructField('ts', LongType()),
+    StructField('userAgent', StringType()),
+    StructField('userId', StringType()),
+])
+
+
+def check_schema_drift(spark, path, schema, sample_rows=1000):
+    """
+    This function is to compare the fields of a sample of raw JSON records
+    with a declared schema. Reading with a schema silently drops unknown
+    fields, so new fields upstream are only noticed here.
+
+    Args:
+    ----------------------------------------
+        spark:        the spark session
+        path:         the glob of the JSON files, or a list of files
+        schema:       the declared StructType
+        sample_rows:  number of records to look at; only the first files of a
+                      glob are read, and a list gets an equal share per file
+
+    Return:
+        (unknown fields, declared fields missing from every sampled record)
+    """
+    seen = set()
+    paths = path if isinstance(path, (list, tuple)) else [path]
+    for part in paths:
+        for row in spark.read.text(part).limit(max(1, sample_rows // len(paths))).collect():
+            line = row.value.strip()
+            if line:
+                seen.update(json.loads(line).keys())
+
+    declared = set(schema.fieldNames())
+    unknown = sorted(seen - declared)
+    missing = sorted(declared - seen)
+    if unknown:
+        print('Schema drift in {}: unknown fields {}'.format(path, unknown))
+    if missing:
+        print('Schema drift in {}: fields never seen {}'.format(path, missing))
+    return unknown, missing
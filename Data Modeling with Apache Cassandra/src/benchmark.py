@@ -0,0 +1,100 @@
+# rows/s and p99 write latency of the Cassandra loader, against a local
+# single-node cluster or a stub session that simulates request latency
+
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from cql_queries import tables
+from cassandra_loader import load_table
+
+
+class StubFuture:
+    """
+    ResponseFuture stand-in: runs the callbacks once the simulated request
+    has completed.
+    """
+
+    def __init__(self, pool, latency):
+        self.pool = pool
+        self.latency = latency
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=()):
+        def run():
+            time.sleep(self.latency)
+            callback(None, *callback_args)
+        self.pool.submit(run)
+
+
+class StubSession:
+    """
+    Session stand-in with a fixed mean latency per request (jittered), so the
+    effect of concurrency and batching can be measured without a cluster.
+    """
+
+    def __init__(self, latency=0.002, threads=512):
+        self.latency = latency
+        self.pool = ThreadPoolExecutor(threads)
+
+    def prepare(self, query):
+        # BatchStatement.add binds plain query strings itself
+        return query.replace('?', '%s')
+
+    def execute(self, query, parameters=None):
+        time.sleep(random.expovariate(1 / self.latency))
+        return []
+
+    def execute_async(self, statement, parameters=None):
+        return StubFuture(self.pool, random.expovariate(1 / self.latency))
+
+    def set_keyspace(self, keyspace):
+        pass
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+def percentile(values, q):
+    """
+    Function that returns the q-th percentile of a list of values.
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Cassandra loader.')
+    parser.add_argument('--stub', action='store_true', help='use a stub session instead of a cluster')
+    parser.add_argument('--stub-latency', type=float, default=0.002, help='mean stub request latency in seconds')
+    parser.add_argument('--hosts', nargs='+', default=None, help='HOSTS of cassandra.cfg by default')
+    parser.add_argument('--file', default='event_datafile_new.csv')
+    parser.add_argument('--tables', nargs='+', choices=sorted(tables), default=sorted(tables))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 32, 128])
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[1, 20])
+    args = parser.parse_args()
+
+    if args.stub:
+        session = StubSession(args.stub_latency)
+    else:
+        from settings import sparkify_session
+        session = sparkify_session(args.hosts, create=True)
+
+    print('{:<16}{:>12}{:>8}{:>8}{:>10}{:>12}{:>12}'.format('table', 'concurrency', 'batch', 'rows', 'rows/s',
+                                                            'p50 ms', 'p99 ms'))
+    for table in args.tables:
+        session.execute(tables[table][0])
+        for concurrency in args.concurrency:
+            for batch_size in args.batch_size:
+                start = time.perf_counter()
+                rows, latencies = load_table(session, table, args.file, concurrency, batch_size)
+                elapsed = time.perf_counter() - start
+                print('{:<16}{:>12}{:>8}{:>8}{:>10.0f}{:>12.2f}{:>12.2f}'.format(
+                    table, concurrency, batch_size, rows, rows / elapsed,
+                    percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000))
+
+    if args.stub:
+        session.shutdown()
+
+
+if __name__ == "__main__":
+    main()
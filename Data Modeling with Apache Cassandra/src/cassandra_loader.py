@@ -0,0 +1,205 @@
+# load event_datafile_new.csv into the query-driven tables with prepared
+# statements, a bounded number of in-flight requests and per-partition batches
+
+import os
+import csv
+import time
+import argparse
+import threading
+from cql_queries import tables
+from settings import sparkify_session
+import instrumentation
+from instrumentation import stage
+
+
+# CSV columns that are not strings; userId is written as a float (e.g. 97.0)
+CONVERTERS = {'itemInSession': int,
+              'sessionId': int,
+              'userId': lambda value: int(float(value)),
+              'length': float}
+
+
+def read_rows(filename, columns):
+    """
+    Function that streams the rows of the event CSV as typed tuples.
+
+    Args:
+    ------------------------------------
+        filename:  the event csv file
+        columns:   CSV columns to keep, in insert order
+
+    Returns:
+        generator of tuples; empty values become None
+    """
+    converters = [CONVERTERS.get(column, str) for column in columns]
+    with open(filename, newline='') as f:
+        for record in csv.DictReader(f):
+            yield tuple(convert(record[column]) if record[column] != '' else None
+                        for column, convert in zip(columns, converters))
+
+
+def partition_batches(rows, key_columns, batch_size, max_pending=10000):
+    """
+    Function that groups rows by partition key, so every batch is written to
+    a single partition (and replica set). At most max_pending rows are held:
+    beyond that the group that has waited longest is sent as it is, so the
+    small partitions of a long file are written while it is read, not at
+    its end.
+
+    Args:
+    ------------------------------------
+        rows:         iterable of tuples
+        key_columns:  number of leading columns forming the partition key
+        batch_size:   maximum rows per batch
+        max_pending:  maximum rows held in unfinished batches
+
+    Returns:
+        generator of lists of rows sharing a partition key
+    """
+    pending = {}
+    held = 0
+    for row in rows:
+        key = row[:key_columns]
+        group = pending.setdefault(key, [])
+        group.append(row)
+        held += 1
+        if len(group) >= batch_size:
+            held -= len(group)
+            yield pending.pop(key)
+        elif held > max_pending:
+            # dicts keep insertion order, so the first key is the oldest group
+            oldest = pending.pop(next(iter(pending)))
+            held -= len(oldest)
+            yield oldest
+    yield from pending.values()
+
+
+class ConcurrentWriter:
+    """
+    Pipelines execute_async calls with at most `concurrency` requests in
+    flight and records the latency of each request. Like
+    execute_concurrent_with_args, but streaming and measurable.
+    """
+
+    def __init__(self, session, concurrency=128):
+        self.session = session
+        self.concurrency = concurrency
+        self.slots = threading.Semaphore(concurrency)
+        self.latencies = []
+        self.errors = []
+
+    def submit(self, statement, parameters=None):
+        """
+        Function that sends a statement, waiting while the window is full.
+
+        Args:
+        ------------------------------------
+            statement:   prepared, bound or batch statement
+            parameters:  values for a prepared statement
+
+        Returns:
+        """
+        self.slots.acquire()
+        if self.errors:
+            self.slots.release()
+            raise self.errors[0]
+        start = time.perf_counter()
+        try:
+            future = self.session.execute_async(statement, parameters)
+        except Exception:
+            # no callback will free the slot of a request that was never sent
+            self.slots.release()
+            raise
+        future.add_callbacks(self._done, self._failed, callback_args=(start,), errback_args=(start,))
+
+    def _done(self, result, start):
+        self.latencies.append(time.perf_counter() - start)
+        self.slots.release()
+
+    def _failed(self, error, start):
+        self.errors.append(error)
+        self.slots.release()
+
+    def join(self):
+        """
+        Function that waits for every request in flight and raises the first
+        error, if any.
+
+        Returns:
+        """
+        for _ in range(self.concurrency):
+            self.slots.acquire()
+        for _ in range(self.concurrency):
+            self.slots.release()
+        if self.errors:
+            raise self.errors[0]
+
+
+def load_table(session, table, filename, concurrency=128, batch_size=1):
+    """
+    Function that loads the event CSV into one of the query-driven tables.
+
+    Args:
+    ------------------------------------
+        session:      Cassandra session with the keyspace set
+        table:        session_library, song_playlist or user_song
+        filename:     the event csv file
+        concurrency:  maximum requests in flight
+        batch_size:   rows per unlogged single-partition batch; 1 sends
+                      one prepared INSERT per row
+
+    Returns:
+        (rows written, list of request latencies in seconds)
+    """
+    create, insert, columns, key_columns = tables[table]
+    prepared = session.prepare(insert)
+    writer = ConcurrentWriter(session, concurrency)
+
+    rows = 0
+    parsed = instrumentation.timed_iter('parse', read_rows(filename, columns), counts=lambda row: {'rows_out': 1})
+    with stage('insert {}'.format(table), bytes_read=os.path.getsize(filename)) as timed:
+        if batch_size > 1:
+            from cassandra.query import BatchStatement, BatchType
+            for group in partition_batches(parsed, key_columns, batch_size):
+                batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                for row in group:
+                    batch.add(prepared, row)
+                writer.submit(batch)
+                rows += len(group)
+        else:
+            for row in parsed:
+                writer.submit(prepared, row)
+                rows += 1
+
+        writer.join()
+        timed.add(rows_in=rows, rows_out=rows)
+    return rows, writer.latencies
+
+
+def main():
+    """
+    Main function creates the keyspace and tables and loads the event CSV
+    into the selected tables.
+    """
+    parser = argparse.ArgumentParser(description='Load event_datafile_new.csv into the Cassandra tables.')
+    parser.add_argument('--hosts', nargs='+', default=None, help='HOSTS of cassandra.cfg by default')
+    parser.add_argument('--file', default='event_datafile_new.csv')
+    parser.add_argument('--tables', nargs='+', choices=sorted(tables), default=sorted(tables))
+    parser.add_argument('--concurrency', type=int, default=128, help='maximum requests in flight')
+    parser.add_argument('--batch-size', type=int, default=1, help='rows per single-partition unlogged batch')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args('cassandra_loader', args)
+
+    session = sparkify_session(args.hosts, create=True)
+
+    for table in args.tables:
+        session.execute(tables[table][0])
+        start = time.perf_counter()
+        rows, latencies = load_table(session, table, args.file, args.concurrency, args.batch_size)
+        elapsed = time.perf_counter() - start
+        print('{}: {} rows in {:.2f} s ({:.0f} rows/s)'.format(table, rows, elapsed, rows / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# build event_datafile_new.csv from the per-day files in event_data in one
+# streaming pass: files are projected and filtered in parallel into part files,
+# which are appended to the output in file order
+
+import os
+import csv
+import glob
+import shutil
+import argparse
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import settings  # puts common/ on the path
+import instrumentation
+from instrumentation import stage
+
+
+COLUMNS = ['artist', 'firstName', 'gender', 'itemInSession', 'lastName', 'length',
+           'level', 'location', 'sessionId', 'song', 'userId']
+
+
+def parquet_schema():
+    """
+    Function that returns the Parquet schema of the consolidated file.
+    """
+    import pyarrow as pa
+    types = {'itemInSession': pa.int32(), 'length': pa.float64(), 'sessionId': pa.int32(), 'userId': pa.int32()}
+    return pa.schema([(column, types.get(column, pa.string())) for column in COLUMNS])
+
+
+def project_rows(filename):
+    """
+    Function that streams the rows of one event file with a non-empty artist,
+    projected onto COLUMNS.
+
+    Args:
+    ------------------------------------
+        filename:  a per-day event csv file
+
+    Returns:
+        generator of lists of strings; userId is written as a float, like the
+        original pandas consolidation
+    """
+    user = COLUMNS.index('userId')
+    with open(filename, newline='', encoding='utf8') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        positions = [header.index(column) for column in COLUMNS]
+        artist = positions[0]
+        for record in reader:
+            if not record or record[artist] == '':
+                continue
+            row = [record[i] for i in positions]
+            if row[user] != '':
+                row[user] = str(float(row[user]))
+            yield row
+
+
+def write_part(filename, part, fmt, chunk_rows):
+    """
+    Function that writes the projected rows of one event file to a part file,
+    chunk_rows at a time.
+
+    Args:
+    ------------------------------------
+        filename:    a per-day event csv file
+        part:        the part file to write
+        fmt:         'csv' or 'parquet'
+        chunk_rows:  rows held in memory at a time
+
+    Returns:
+        number of rows written
+    """
+    rows = 0
+    if fmt == 'csv':
+        with open(part, 'w', newline='', encoding='utf8') as out:
+            writer = csv.writer(out, lineterminator='\n')
+            for row in project_rows(filename):
+                writer.writerow(row)
+                rows += 1
+        return rows
+
+    import pyarrow.parquet as pq
+    schema = parquet_schema()
+    with pq.ParquetWriter(part, schema) as writer:
+        chunk = []
+        for row in project_rows(filename):
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                writer.write_table(to_table(chunk, schema))
+                rows += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write_table(to_table(chunk, schema))
+            rows += len(chunk)
+    return rows
+
+
+def to_table(chunk, schema):
+    """
+    Function that converts a chunk of string rows into a typed Arrow table.
+    """
+    import pyarrow as pa
+    columns = []
+    for i, field in enumerate(schema):
+        values = [row[i] if row[i] != '' else None for row in chunk]
+        if pa.types.is_integer(field.type):
+            values = [int(float(v)) if v is not None else None for v in values]
+        elif pa.types.is_floating(field.type):
+            values = [float(v) if v is not None else None for v in values]
+        columns.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def append_part(part, fmt, out):
+    """
+    Function that appends a part file to the consolidated output.
+
+    Args:
+    ------------------------------------
+        part:  the part file
+        fmt:   'csv' or 'parquet'
+        out:   open binary file (csv) or ParquetWriter (parquet)
+
+    Returns:
+    """
+    if fmt == 'csv':
+        with open(part, 'rb') as f:
+            shutil.copyfileobj(f, out)
+        return
+
+    import pyarrow.parquet as pq
+    parquet = pq.ParquetFile(part)
+    for i in range(parquet.num_row_groups):
+        out.write_table(parquet.read_row_group(i))
+
+
+def consolidate(files, output, fmt='csv', workers=None, chunk_rows=50000):
+    """
+    Function that consolidates event files into one file. At most two part
+    files per worker exist at a time, so memory and temporary disk stay
+    constant however many files there are.
+
+    Args:
+    ------------------------------------
+        files:       per-day event csv files, in output order
+        output:      the consolidated file
+        fmt:         'csv' or 'parquet'
+        workers:     number of processes; defaults to the number of CPUs
+        chunk_rows:  rows per Parquet row group
+
+    Returns:
+        number of rows written
+    """
+    workers = workers or os.cpu_count()
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output)))
+    rows = 0
+    try:
+        if fmt == 'csv':
+            out = open(output, 'wb')
+            out.write((','.join(COLUMNS) + '\n').encode('utf8'))
+        else:
+            import pyarrow.parquet as pq
+            out = pq.ParquetWriter(output, parquet_schema())
+
+        with ProcessPoolExecutor(workers) as pool, out:
+            pending = deque()
+            files = iter(enumerate(files))
+            for n, filename in files:
+                part = os.path.join(tmp, '{:08d}.{}'.format(n, fmt))
+                pending.append((part, pool.submit(write_part, filename, part, fmt, chunk_rows)))
+                if len(pending) >= 2 * workers:
+                    break
+            while pending:
+                part, future = pending.popleft()
+                part_rows = future.result()
+                rows += part_rows
+                with stage('append', rows_in=part_rows, rows_out=part_rows, bytes_read=os.path.getsize(part)):
+                    append_part(part, fmt, out)
+                os.remove(part)
+                for n, filename in files:
+                    part = os.path.join(tmp, '{:08d}.{}'.format(n, fmt))
+                    pending.append((part, pool.submit(write_part, filename, part, fmt, chunk_rows)))
+                    break
+    finally:
+        shutil.rmtree(tmp)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Consolidate the event_data csv files into event_datafile_new.csv.')
+    parser.add_argument('--input', default='event_data', help='directory of per-day event csv files')
+    parser.add_argument('--output', default='event_datafile_new.csv')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-rows', type=int, default=50000, help='rows per Parquet row group')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args('consolidate_events', args)
+
+    with stage('discover') as timed:
+        files = sorted(glob.glob(os.path.join(args.input, '**', '*.csv'), recursive=True))
+        timed.add(rows_out=len(files))
+    print('{} files found in {}'.format(len(files), args.input))
+    with stage('consolidate', rows_in=len(files)) as timed:
+        rows = consolidate(files, args.output, args.format, args.workers, args.chunk_rows)
+        timed.add(rows_out=rows)
+    print('{} rows written to {}'.format(rows, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# CQL statements for the three query-driven tables of the notebook, shared by
+# the loader, the query API and the benchmarks
+
+# KEYSPACE
+
+# formatted with the KEYSPACE of cassandra.cfg
+keyspace_create = ("""CREATE KEYSPACE IF NOT EXISTS {}
+                    WITH REPLICATION =
+                    {'class': 'SimpleStrategy',
+                     'replication_factor': 1
+                    }""")
+
+# DROP TABLES
+
+session_library_drop = "DROP TABLE IF EXISTS session_library"
+song_playlist_drop = "DROP TABLE IF EXISTS song_playlist"
+user_song_drop = "DROP TABLE IF EXISTS user_song"
+
+# CREATE TABLES
+
+# Query 1: artist, song and length heard in a session at an item
+session_library_create = ("""CREATE TABLE IF NOT EXISTS session_library (sessionId int, itemInSession int, \
+                           artist varchar, song varchar, \
+                           length float, \
+                           PRIMARY KEY (sessionId, itemInSession))""")
+
+# Query 2: artist, song (sorted by itemInSession) and user name for a user and session
+song_playlist_create = ("""CREATE TABLE IF NOT EXISTS song_playlist (userId int, sessionId int, itemInSession int, \
+                         firstName varchar, lastName varchar, \
+                         artist varchar, song varchar, \
+                         PRIMARY KEY (userId, sessionId, itemInSession))""")
+
+# Query 3: users who listened to a song
+user_song_create = ("""CREATE TABLE IF NOT EXISTS user_song (song varchar, userId int, \
+                     firstName varchar, lastName varchar, \
+                     PRIMARY KEY (song, userId))""")
+
+# INSERT RECORDS (prepared, hence ? placeholders)
+
+session_library_insert = ("""INSERT INTO session_library (sessionId, itemInSession, artist, song, length) \
+                           VALUES (?, ?, ?, ?, ?)""")
+
+song_playlist_insert = ("""INSERT INTO song_playlist (userId, sessionId, itemInSession, firstName, lastName, artist, song) \
+                         VALUES (?, ?, ?, ?, ?, ?, ?)""")
+
+user_song_insert = ("""INSERT INTO user_song (song, userId, firstName, lastName) \
+                     VALUES (?, ?, ?, ?)""")
+
+# SELECT RECORDS
+# one statement per question, plus one reading the whole partition for the cache
+
+session_library_select = ("""SELECT artist, song, length FROM session_library \
+                           WHERE sessionId = ? AND itemInSession = ?""")
+
+session_library_partition_select = ("""SELECT itemInSession, artist, song, length FROM session_library \
+                                     WHERE sessionId = ?""")
+
+song_playlist_select = ("""SELECT artist, song, firstName, lastName FROM song_playlist \
+                         WHERE userId = ? AND sessionId = ?""")
+
+song_playlist_partition_select = ("""SELECT sessionId, artist, song, firstName, lastName FROM song_playlist \
+                                   WHERE userId = ?""")
+
+user_song_select = ("""SELECT firstName, lastName FROM user_song WHERE song = ?""")
+
+# QUERY LISTS
+
+# table: (create, insert, CSV columns in insert order, number of leading columns forming the partition key)
+tables = {'session_library': (session_library_create, session_library_insert,
+                              ['sessionId', 'itemInSession', 'artist', 'song', 'length'], 1),
+          'song_playlist': (song_playlist_create, song_playlist_insert,
+                            ['userId', 'sessionId', 'itemInSession', 'firstName', 'lastName', 'artist', 'song'], 1),
+          'user_song': (user_song_create, user_song_insert,
+                        ['song', 'userId', 'firstName', 'lastName'], 1)}
+
+create_table_queries = [session_library_create, song_playlist_create, user_song_create]
+drop_table_queries = [session_library_drop, song_playlist_drop, user_song_drop]
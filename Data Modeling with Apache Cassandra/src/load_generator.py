@@ -0,0 +1,112 @@
+# QPS and latency of the query API with and without the partition cache,
+# with keys drawn from event_datafile_new.csv with a Zipf-like skew
+
+import time
+import random
+import itertools
+import argparse
+import threading
+from cassandra_loader import read_rows
+from query_api import PartitionCache, SparkifyQueries
+from benchmark import StubSession, percentile
+
+
+def sample_keys(filename):
+    """
+    Function that collects the distinct keys of the three questions.
+
+    Args:
+    ------------------------------------
+        filename:  the event csv file
+
+    Returns:
+        dict of question name to list of parameter tuples
+    """
+    keys = {'session_songs': set(), 'user_playlist': set(), 'song_listeners': set()}
+    for session_id, item, user_id, song in read_rows(filename, ['sessionId', 'itemInSession', 'userId', 'song']):
+        keys['session_songs'].add((session_id, item))
+        keys['user_playlist'].add((user_id, session_id))
+        keys['song_listeners'].add((song,))
+    return {name: sorted(values, key=str) for name, values in keys.items()}
+
+
+def run(api, keys, threads, duration, skew, seed=0):
+    """
+    Function that issues queries from several threads for a fixed time.
+
+    Args:
+    ------------------------------------
+        api:       SparkifyQueries
+        keys:      dict returned by sample_keys()
+        threads:   number of client threads
+        duration:  seconds to run
+        skew:      Zipf exponent of the key popularity; 0 is uniform
+
+    Returns:
+        (queries, seconds, list of latencies in seconds)
+    """
+    weights = {name: list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(len(values))))
+               for name, values in keys.items()}
+    names = sorted(keys)
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(n):
+        rnd = random.Random(seed + n)
+        local = []
+        while time.perf_counter() < deadline:
+            name = rnd.choice(names)
+            key = rnd.choices(keys[name], cum_weights=weights[name])[0]
+            start = time.perf_counter()
+            getattr(api, name)(*key)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=client, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(latencies), time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the Cassandra query API with and without cache.')
+    parser.add_argument('--stub', action='store_true', help='use a stub session instead of a cluster')
+    parser.add_argument('--stub-latency', type=float, default=0.002, help='mean stub request latency in seconds')
+    parser.add_argument('--hosts', nargs='+', default=None, help='HOSTS of cassandra.cfg by default')
+    parser.add_argument('--file', default='event_datafile_new.csv')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--skew', type=float, default=1.1)
+    parser.add_argument('--cache-size', type=int, default=1024)
+    parser.add_argument('--ttl', type=float, default=60.0)
+    args = parser.parse_args()
+
+    if args.stub:
+        session = StubSession(args.stub_latency)
+    else:
+        from settings import sparkify_session
+        session = sparkify_session(args.hosts)
+
+    keys = sample_keys(args.file)
+
+    print('{:<8}{:>10}{:>10}{:>10}{:>10}{:>12}'.format('cache', 'queries', 'qps', 'p50 ms', 'p99 ms', 'hit ratio'))
+    for cached in [False, True]:
+        cache = PartitionCache(args.cache_size, args.ttl) if cached else None
+        api = SparkifyQueries(session, cache)
+        queries, elapsed, latencies = run(api, keys, args.threads, args.duration, args.skew)
+        hit_ratio = cache.stats()['hit_ratio'] if cache else 0.0
+        print('{:<8}{:>10}{:>10.0f}{:>10.2f}{:>10.2f}{:>12.2f}'.format(
+            'on' if cached else 'off', queries, queries / elapsed, percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000, hit_ratio))
+
+    if args.stub:
+        session.shutdown()
+
+
+if __name__ == "__main__":
+    main()
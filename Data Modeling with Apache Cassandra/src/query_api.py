@@ -0,0 +1,158 @@
+# the three questions of the notebook as functions over prepared statements,
+# with an optional read-through cache of whole partitions
+
+import time
+import threading
+from collections import OrderedDict
+from cql_queries import session_library_select, session_library_partition_select, \
+    song_playlist_select, song_playlist_partition_select, user_song_select
+
+
+class PartitionCache:
+    """
+    LRU cache with a time-to-live, keyed by (table, partition key), counting
+    hits, misses and evictions. Thread safe; a miss loads outside the lock.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        """
+        Function that returns the cached value of key, calling load() on a
+        miss or when the entry has expired.
+
+        Args:
+        ------------------------------------
+            key:   hashable partition key
+            load:  function returning the value to cache
+
+        Returns:
+            cached or loaded value
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = load()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, key=None):
+        """
+        Function that drops one partition, or everything when key is None.
+        """
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        """
+        Function that returns the counters as a dict.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+
+class SparkifyQueries:
+    """
+    Query API over the session_library, song_playlist and user_song tables.
+
+    Statements are prepared once and read with fetch_size rows per page, so
+    large partitions are streamed. With a cache, a question reads (and keeps)
+    the whole partition, and later questions on the same session, user or
+    song are answered from memory.
+    """
+
+    def __init__(self, session, cache=None, fetch_size=1000):
+        self.session = session
+        self.cache = cache
+        self.fetch_size = fetch_size
+        self.statements = {}
+        for name, query in [('session_library', session_library_select),
+                            ('session_library_partition', session_library_partition_select),
+                            ('song_playlist', song_playlist_select),
+                            ('song_playlist_partition', song_playlist_partition_select),
+                            ('user_song', user_song_select)]:
+            statement = session.prepare(query)
+            if hasattr(statement, 'fetch_size'):
+                statement.fetch_size = fetch_size
+            self.statements[name] = statement
+
+    def _rows(self, name, parameters):
+        # iterating the result set fetches the following pages on demand
+        return [tuple(row) for row in self.session.execute(self.statements[name], parameters)]
+
+    def _partition(self, table, key):
+        return self.cache.get((table, key), lambda: self._rows(table + '_partition', key))
+
+    def session_songs(self, session_id, item_in_session):
+        """
+        Function that answers Query 1: artist, song and length heard during a
+        session at an item.
+
+        Args:
+        ------------------------------------
+            session_id:       sessionId
+            item_in_session:  itemInSession
+
+        Returns:
+            list of (artist, song, length)
+        """
+        if self.cache is None:
+            return self._rows('session_library', (session_id, item_in_session))
+        return [row[1:] for row in self._partition('session_library', (session_id,))
+                if row[0] == item_in_session]
+
+    def user_playlist(self, user_id, session_id):
+        """
+        Function that answers Query 2: artist, song (sorted by itemInSession)
+        and user name for a user and session.
+
+        Args:
+        ------------------------------------
+            user_id:     userId
+            session_id:  sessionId
+
+        Returns:
+            list of (artist, song, firstName, lastName)
+        """
+        if self.cache is None:
+            return self._rows('song_playlist', (user_id, session_id))
+        return [row[1:] for row in self._partition('song_playlist', (user_id,))
+                if row[0] == session_id]
+
+    def song_listeners(self, song):
+        """
+        Function that answers Query 3: users who listened to a song.
+
+        Args:
+        ------------------------------------
+            song:  song title
+
+        Returns:
+            list of (firstName, lastName)
+        """
+        if self.cache is None:
+            return self._rows('user_song', (song,))
+        return self.cache.get(('user_song', (song,)), lambda: self._rows('user_song', (song,)))
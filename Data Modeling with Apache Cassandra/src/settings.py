@@ -0,0 +1,33 @@
+# contact points of the cluster, read from cassandra.cfg next to this file
+
+import os
+import sys
+
+# modules shared with the Postgres and Warehouse projects live in common/ at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'common'))
+from connections import cassandra_config, cassandra_session
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cassandra.cfg')
+
+
+def sparkify_session(hosts=None, create=False):
+    """
+    Function that returns the shared session of the cluster, set to the
+    sparkify keyspace.
+
+    Args:
+    ------------------------------------
+        hosts:   contact points replacing HOSTS of cassandra.cfg
+        create:  create the keyspace first
+
+    Returns:
+        cassandra Session
+    """
+    from cql_queries import keyspace_create
+
+    config = cassandra_config(CONFIG_FILE, hosts=hosts)
+    session = cassandra_session(config)
+    if create:
+        session.execute(keyspace_create.format(config.keyspace))
+    session.set_keyspace(config.keyspace)
+    return session
@@ -0,0 +1,47 @@
+import pytest
+
+from cassandra_loader import ConcurrentWriter, partition_batches
+
+
+def _rows(keys):
+    return [(key, n) for n, key in enumerate(keys)]
+
+
+def test_full_batches_are_sent_as_soon_as_they_fill():
+    batches = partition_batches(iter(_rows('aabab')), 1, 2)
+    assert next(batches) == [('a', 0), ('a', 1)]
+    assert list(batches) == [[('b', 2), ('b', 4)], [('a', 3)]]
+
+
+def test_every_row_is_sent_once_in_a_batch_of_its_partition():
+    rows = _rows('abcabcaab')
+    batches = list(partition_batches(rows, 1, 3, max_pending=2))
+    assert sorted(row for batch in batches for row in batch) == sorted(rows)
+    assert all(len({row[0] for row in batch}) == 1 and len(batch) <= 3 for batch in batches)
+
+
+def test_small_partitions_are_not_held_until_the_end():
+    # one row per partition never fills a batch; the oldest ones are sent once max_pending rows are held
+    def rows():
+        for n in range(1000):
+            yield ('user{}'.format(n), n)
+            if n == 100:
+                raise AssertionError('read past the rows needed')
+
+    batches = partition_batches(rows(), 1, 20, max_pending=10)
+    assert [next(batches) for _ in range(50)][0] == [('user0', 0)]
+
+
+class FailingSession:
+    # raises before a request is sent, e.g. on a statement that cannot be bound
+    def execute_async(self, statement, parameters=None):
+        raise ValueError('cannot bind')
+
+
+def test_a_request_failing_before_it_is_sent_frees_its_slot():
+    writer = ConcurrentWriter(FailingSession(), concurrency=2)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            writer.submit('INSERT', (1,))
+    # a leaked slot would block the next request, and join(), for good
+    assert writer.slots.acquire(timeout=1)
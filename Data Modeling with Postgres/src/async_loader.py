@@ -0,0 +1,235 @@
+# asyncio pipeline of the bulk load: reading, transforming and writing run as
+# concurrent stages joined by bounded queues, so disk reads, parsing and the
+# database round-trips overlap and a load runs at about the pace of its slowest
+# stage instead of the sum of all of them
+#
+#     read (threads) -> transform (processes) -> batch (file order) -> write (asyncpg connections)
+#
+# Every queue is bounded, so a slow stage holds the ones before it back and
+# memory stays flat: at most queue_size files are read ahead, queue_size more
+# are being transformed, and one batch per writer waits to be written.
+# Writers COPY their batches into their own session's staging tables at the
+# same time, but merge and commit them one at a time in batch order, so the
+# tables end up exactly as after a serial run.
+
+import io
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from sql_queries import stage_truncate
+import instrumentation
+from instrumentation import stage, record
+
+try:
+    import asyncpg
+except ImportError:  # only needed by --mode async
+    asyncpg = None
+
+
+# end of a queue
+DONE = None
+
+
+def read_file(filepath):
+    """
+    Function that reads the content of a file, in a thread of the read stage.
+    """
+    with stage('read') as timed:
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        timed.add(bytes_read=len(data))
+    return data
+
+
+def to_csv(df):
+    """
+    Function that renders a DataFrame as the CSV read by the staging COPY.
+    """
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, header=False, na_rep='\\N', encoding='utf-8')
+    buf.seek(0)
+    return buf
+
+
+def rowcount(status):
+    """
+    Function that returns the row count of a command tag, e.g. 'INSERT 0 42'.
+    """
+    count = status.split()[-1]
+    return int(count) if count.isdigit() else 0
+
+
+class Sequencer:
+    """
+    Hands out turns in batch order, so the merges and commits of concurrent
+    writers happen one batch at a time in the order of the files.
+    """
+
+    def __init__(self):
+        self.next = 0
+        self.condition = asyncio.Condition()
+
+    async def wait(self, seq):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.next == seq)
+
+    async def advance(self):
+        async with self.condition:
+            self.next += 1
+            self.condition.notify_all()
+
+
+async def read_stage(files, threads, out):
+    # the reads are queued as futures in file order, so a full queue of them is in flight
+    loop = asyncio.get_running_loop()
+    for filepath in files:
+        await out.put((filepath, loop.run_in_executor(threads, read_file, filepath)))
+    await out.put(DONE)
+
+
+async def transform_stage(inp, out, processes, transform):
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await inp.get()
+        if item is DONE:
+            await out.put(DONE)
+            return
+        filepath, reading = item
+        data = await reading
+        await out.put((filepath, loop.run_in_executor(processes, transform, data)))
+
+
+async def batch_stage(inp, out, prepare, batch_files, writers):
+    # collects the transformed files in file order; prepare() sees every file
+    # before the next one, as in a serial run
+    seq, frames, files = 0, {}, []
+    while True:
+        item = await inp.get()
+        if item is not DONE:
+            filepath, transforming = item
+            file_frames, seconds, metrics = await transforming
+            instrumentation.merge(metrics)
+            if prepare is not None:
+                file_frames = prepare(file_frames, filepath)
+            for table, df in file_frames.items():
+                frames.setdefault(table, []).append(df)
+            files.append(filepath)
+        if files and (item is DONE or len(files) == batch_files):
+            await out.put((seq, frames, files))
+            seq, frames, files = seq + 1, {}, []
+        if item is DONE:
+            for _ in range(writers):
+                await out.put(DONE)
+            return
+
+
+async def write_batch(conn, seq, frames, tables, sequencer):
+    """
+    Function that copies a batch into the connection's staging tables, then
+    waits for its turn to merge and commit it.
+
+    Returns:
+        number of rows copied
+    """
+    loop = asyncio.get_running_loop()
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        copied = []
+        for stage_table, create, columns, merge in tables:
+            table = stage_table[:-len('_stage')]
+            if not frames.get(table):
+                continue
+            df = pd.concat(frames[table], ignore_index=True)
+            start = time.perf_counter()
+            data = await loop.run_in_executor(None, to_csv, df)
+            await conn.copy_to_table(stage_table, source=data, columns=columns, format='csv', null='\\N')
+            record('copy', time.perf_counter() - start, rows_in=len(df), rows_out=len(df))
+            copied.append((stage_table, merge, len(df)))
+
+        start = time.perf_counter()
+        await sequencer.wait(seq)
+        record('wait', time.perf_counter() - start)
+        for stage_table, merge, rows in copied:
+            start = time.perf_counter()
+            status = await conn.execute(merge)
+            record('merge', time.perf_counter() - start, rows_in=rows, rows_out=rowcount(status))
+            await conn.execute(stage_truncate.format(stage_table))
+        start = time.perf_counter()
+        await transaction.commit()
+        record('commit', time.perf_counter() - start)
+    except BaseException:
+        await transaction.rollback()
+        raise
+    await sequencer.advance()
+    return sum(rows for stage_table, merge, rows in copied)
+
+
+async def write_stage(db, inp, tables, sequencer, num_files, progress):
+    async with db.acquire() as conn:
+        for stage_table, create, columns, merge in tables:
+            await conn.execute(create)
+        rows = 0
+        while True:
+            item = await inp.get()
+            if item is DONE:
+                return rows
+            seq, frames, files = item
+            rows += await write_batch(conn, seq, frames, tables, sequencer)
+            progress[0] += len(files)
+            print('{}/{} files processed.'.format(progress[0], num_files))
+
+
+async def load(config, files, transform, tables, processes, prepare=None, batch_files=500, writers=4,
+               queue_size=64, readers=4):
+    """
+    Function that loads files through the pipeline.
+
+    Args:
+    ------------------------------------
+        config:       PostgresConfig of the database
+        files:        the json files, in load order
+        transform:    picklable function of a file's bytes returning (dict of
+                      table name to DataFrame, seconds, stage totals), run in processes
+        tables:       bulk_song_tables or bulk_log_tables from sql_queries.py
+        processes:    ProcessPoolExecutor of the transform stage
+        prepare:      optional function of a file's frames and path returning
+                      the frames to load, called in file order
+        batch_files:  number of files merged per transaction
+        writers:      connections writing batches at the same time
+        queue_size:   files held between two stages
+        readers:      threads reading files
+
+    Returns:
+        number of rows copied
+    """
+    if asyncpg is None:
+        raise RuntimeError('asyncpg is required for --mode async')
+
+    read_queue = asyncio.Queue(queue_size)
+    transform_queue = asyncio.Queue(queue_size)
+    write_queue = asyncio.Queue(writers)
+    sequencer = Sequencer()
+    progress = [0]
+
+    with ThreadPoolExecutor(readers) as threads:
+        async with asyncpg.create_pool(host=config.host, port=config.port, database=config.dbname,
+                                       user=config.user, password=config.password,
+                                       min_size=writers, max_size=writers) as db:
+            write_tasks = [asyncio.create_task(write_stage(db, write_queue, tables, sequencer, len(files), progress))
+                           for _ in range(writers)]
+            tasks = [asyncio.create_task(read_stage(files, threads, read_queue)),
+                     asyncio.create_task(transform_stage(read_queue, transform_queue, processes, transform)),
+                     asyncio.create_task(batch_stage(transform_queue, write_queue, prepare, batch_files, writers))]
+            tasks += write_tasks
+            try:
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    task.result()
+            finally:
+                # a failed stage stops the others; batches not committed are rolled back
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            return sum(task.result() for task in write_tasks)
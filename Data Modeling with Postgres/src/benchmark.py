@@ -0,0 +1,113 @@
+import time
+import argparse
+import create_tables
+from settings import sparkify_config
+from connections import postgres_connection
+from song_index import SongIndex
+from time_dimension import TimeDimension
+from etl import process_data, process_data_bulk, process_song_file, process_log_file, \
+    extract_song_frames, extract_log_frames
+
+
+TABLES = ['songs', 'artists', 'time', 'users', 'songplays']
+
+
+def count_rows(cur):
+    """
+    Function that counts the rows loaded into the star schema.
+
+    Args:
+    ---------------------------------------
+        cur:        cursor of the created database
+
+    Returns:
+        total number of rows over all five tables
+    """
+    total = 0
+    for table in TABLES:
+        cur.execute("SELECT count(*) FROM {}".format(table))
+        total += cur.fetchone()[0]
+    return total
+
+
+def run(mode, lookup, song_path, log_path, batch_files, workers=1):
+    """
+    Function that resets sparkifydb, loads the song and log files with the
+    given mode and returns the elapsed seconds and the number of rows loaded.
+
+    Args:
+    ---------------------------------------
+        mode:           'row' or 'bulk'
+        lookup:         'query' (song_select per event) or 'index' (SongIndex)
+        song_path:      the directory of song json files
+        log_path:       the directory of log json files
+        batch_files:    files merged per transaction in bulk mode
+        workers:        processes parsing files in bulk mode
+
+    Returns:
+        (seconds, rows)
+    """
+    create_tables.main([])
+
+    with postgres_connection(sparkify_config()) as conn:
+        cur = conn.cursor()
+
+        start = time.perf_counter()
+        index = SongIndex.from_db(cur) if lookup == 'index' else None
+        times = TimeDimension.from_db(cur)
+        if mode == 'bulk':
+            process_data_bulk(cur, conn, song_path, extract_song_frames, batch_files, index, workers)
+            process_data_bulk(cur, conn, log_path, extract_log_frames, batch_files, index, workers, times=times)
+        else:
+            process_data(cur, conn, song_path, process_song_file, index)
+            process_data(cur, conn, log_path, process_log_file, index, times=times)
+        elapsed = time.perf_counter() - start
+
+        rows = count_rows(cur)
+    return elapsed, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare row-by-row and bulk COPY loading of sparkifydb, with and without the SongIndex.')
+    parser.add_argument('--song-data', default='data/song_data')
+    parser.add_argument('--log-data', default='data/log_data')
+    parser.add_argument('--batch-files', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help='worker counts to run the bulk/index load with, e.g. 1 2 4 8')
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ['row', 'bulk']:
+        for lookup in ['query', 'index']:
+            best = None
+            for _ in range(args.repeat):
+                elapsed, rows = run(mode, lookup, args.song_data, args.log_data, args.batch_files)
+                if best is None or elapsed < best[0]:
+                    best = (elapsed, rows)
+            results[(mode, lookup)] = best
+
+    scaling = {}
+    for workers in args.workers:
+        best = None
+        for _ in range(args.repeat):
+            elapsed, rows = run('bulk', 'index', args.song_data, args.log_data, args.batch_files, workers)
+            if best is None or elapsed < best[0]:
+                best = (elapsed, rows)
+        scaling[workers] = best
+
+    baseline = results[('row', 'query')][0]
+    print('{:<6}{:<8}{:>10}{:>12}{:>14}{:>10}'.format('mode', 'lookup', 'rows', 'seconds', 'rows/second', 'speedup'))
+    for (mode, lookup), (elapsed, rows) in results.items():
+        print('{:<6}{:<8}{:>10}{:>12.3f}{:>14.0f}{:>9.1f}x'.format(mode, lookup, rows, elapsed, rows / elapsed,
+                                                                    baseline / elapsed))
+
+    one = scaling[min(scaling)][0]
+    print()
+    print('{:<8}{:>10}{:>12}{:>14}{:>10}'.format('workers', 'rows', 'seconds', 'rows/second', 'scaling'))
+    for workers, (elapsed, rows) in scaling.items():
+        print('{:<8}{:>10}{:>12.3f}{:>14.0f}{:>9.1f}x'.format(workers, rows, elapsed, rows / elapsed, one / elapsed))
+
+
+if __name__ == "__main__":
+    main()
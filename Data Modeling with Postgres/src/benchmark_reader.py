@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import pandas as pd
+import json_reader
+from etl import get_files, extract_song_frames, extract_log_frames, song_frames, log_frames
+import quality
+
+
+def scale_up(src, dst, factor):
+    """
+    Function that copies every json file under src factor times into dst,
+    keeping the directory layout, to get a larger tree of the same files.
+
+    Args:
+    ---------------------------------------
+        src:        the directory of json files
+        dst:        the directory to write to
+        factor:     number of copies of each file
+
+    Returns:
+        list of the copied files
+    """
+    copies = []
+    for path in get_files(src):
+        rel = os.path.relpath(path, src)
+        for n in range(factor):
+            target = os.path.join(dst, str(n), rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(path, target)
+            copies.append(target)
+    return copies
+
+
+def read_pandas(all_files, extract):
+    """
+    Function that reads and transforms every file with one DataFrame per file.
+    """
+    for datafile in all_files:
+        extract(datafile)
+
+
+def read_stream(all_files, frames, columns, batch_rows):
+    """
+    Function that reads and transforms every file through columnar batches.
+    """
+    for batch, files in json_reader.iter_batches(all_files, columns, batch_rows):
+        frames(pd.DataFrame(batch, columns=columns))
+
+
+def validate_batches(batches, dataset):
+    """
+    Function that checks the data-quality rules over DataFrames already read.
+    """
+    for df in batches:
+        quality.validate(df, dataset)
+
+
+def validate_share(all_files, dataset, columns, batch_rows, stream_s):
+    """
+    Function that times the data-quality rules alone over the batches of the
+    streaming reader, as log_frames and song_frames run them, and returns
+    their share of the time the streaming reader took, validation included.
+    """
+    batches = [pd.DataFrame(batch, columns=columns) for batch, files in
+               json_reader.iter_batches(all_files, columns, batch_rows)]
+    if dataset == 'log_data':
+        batches = [df[df['page'] == 'NextSong'] for df in batches]
+    return timed(validate_batches, batches, dataset) / stream_s
+
+
+def timed(func, *args):
+    """
+    Function that returns the seconds func(*args) takes.
+    """
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Files/second of the pandas per-file reader vs. the streaming reader.')
+    parser.add_argument('--song-data', default='data/song_data')
+    parser.add_argument('--log-data', default='data/log_data')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--batch-rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    fast_loads = json_reader.loads
+    print('{:<6}{:<7}{:>8}{:>16}{:>16}{:>16}{:>12}'.format('data', 'scale', 'files', 'pandas files/s',
+                                                            'stream files/s', 'stdlib files/s', 'validate %'))
+    for name, dataset, src, extract, frames, columns in [
+            ('song', 'song_data', args.song_data, extract_song_frames, song_frames, json_reader.SONG_COLUMNS),
+            ('log', 'log_data', args.log_data, extract_log_frames, log_frames, json_reader.LOG_COLUMNS)]:
+        for factor in args.scale:
+            tmp = tempfile.mkdtemp()
+            try:
+                all_files = scale_up(src, tmp, factor)
+                pandas_s = timed(read_pandas, all_files, extract)
+                json_reader.loads = fast_loads
+                stream_s = timed(read_stream, all_files, frames, columns, args.batch_rows)
+                json_reader.loads = json.loads
+                stdlib_s = timed(read_stream, all_files, frames, columns, args.batch_rows)
+                json_reader.loads = fast_loads
+                share = validate_share(all_files, dataset, columns, args.batch_rows, stream_s)
+            finally:
+                shutil.rmtree(tmp)
+
+            n = len(all_files)
+            print('{:<6}{:<7}{:>8}{:>16.0f}{:>16.0f}{:>16.0f}{:>11.1f}%'.format(
+                name, factor, n, n / pandas_s, n / stream_s, n / stdlib_s, share * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,36 @@
+import argparse
 import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from sql_queries import create_table_queries, drop_table_queries, songplay_relkind, songplay_migration_queries, \
+    start_time_time_tables, songplay_key_migration_queries, songplay_partition_function, lookup_index_queries, songplay_index_queries, analyze_queries, rollup_table_creates, \
+    rollup_index_queries, rollup_watermark_create
+from settings import sparkify_config
+from connections import postgres_connection, close_pool
 
 
-def create_database():
+def create_database(reset=True):
+    # pooled connections to sparkifydb would block DROP DATABASE
+    config = sparkify_config()
+    close_pool(config)
+
     # connect to default database
-    try:
-        conn = psycopg2.connect("host=127.0.0.1 dbname=studentdb user=student password=student")
-    except psycopg2.Error as e:
-        print("Error: could not make connection to the studentdb database")
-    
-    conn.set_session(autocommit=True)
-    
-    cur = conn.cursor()
-    
-    # create sparkify database with UTF8 encoding
-    try:
-        cur.execute("DROP DATABASE IF EXISTS sparkifydb")
-    except psycopg2.Error as e:
-        print(e)
-    try:
-        cur.execute("CREATE DATABASE sparkifydb WITH ENCODING 'utf8' TEMPLATE template0")
-    except psycopg2.Error as e:
-        print(e)
-
-    # close connection to default database
-    conn.close()    
-    
-    # connect to sparkify database
-    try:
-        conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
-    except psycopg2.Error as e:
-        print("could not make connection to the sparkifydb database")
-        
-    cur = conn.cursor()
-    
-    return cur, conn
+    with postgres_connection(sparkify_config(admin=True), autocommit=True) as conn:
+        cur = conn.cursor()
+
+        # create sparkify database with UTF8 encoding
+        # (reset=False keeps an existing database for incremental loads)
+        if reset:
+            try:
+                cur.execute("DROP DATABASE IF EXISTS {}".format(config.dbname))
+            except psycopg2.Error as e:
+                print(e)
+        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (config.dbname,))
+        if cur.fetchone() is None:
+            try:
+                cur.execute("CREATE DATABASE {} WITH ENCODING 'utf8' TEMPLATE template0".format(config.dbname))
+            except psycopg2.Error as e:
+                print(e)
+
+    return config
 
 
 def create_tables(cur, conn):
@@ -46,16 +42,67 @@ def drop_tables(cur, conn):
     for query in drop_table_queries:
         cur.execute(query)
         conn.commit()
-        
-def main():
-    cur, conn = create_database()
-    
-    drop_tables(cur, conn)
-    create_tables(cur, conn)
 
 
+def migrate(cur, conn):
+    """
+    Function that brings the schema of a database loaded before songplays
+    was partitioned up to date, keeping its rows: songplays is copied into
+    monthly partitions, gets the item_in_session column of the natural key,
+    the lookup and analytics indexes are built and the rollup tables
+    created, to be filled by the next load. Runs in one
+    transaction, and does nothing on an up to date schema. Stops before
+    changing anything when a start_time is still a TIME without its date.
+
+    Args:
+    ---------------------------------------
+        cur:        cursor of the created database
+        conn:       connection of the created database
+
+    Returns:
+        True when songplays was partitioned
+    """
+    cur.execute(start_time_time_tables)
+    tables = [row[0] for row in cur.fetchall()]
+    if tables:
+        raise SystemExit('start_time of {} is a TIME without its date, which cannot be migrated; recreate the '
+                         'database with create_tables.py and load the data again'.format(' and '.join(tables)))
 
-    conn.close()
+    cur.execute(songplay_partition_function)
+    cur.execute(songplay_relkind)
+    row = cur.fetchone()
+    converted = row is not None and row[0] != 'p'
+    if converted:
+        for query in songplay_migration_queries:
+            cur.execute(query)
+    for query in songplay_key_migration_queries + lookup_index_queries + songplay_index_queries + analyze_queries + rollup_table_creates + \
+            rollup_index_queries + [rollup_watermark_create]:
+        cur.execute(query)
+    conn.commit()
+    return converted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create the sparkifydb star schema.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='keep the existing database and tables, only create missing ones')
+    parser.add_argument('--migrate', action='store_true',
+                        help='keep the existing database and its rows, and move it to the current schema: '
+                             'partition songplays by month and build the indexes')
+    args = parser.parse_args(argv)
+
+    config = create_database(reset=not (args.incremental or args.migrate))
+
+    # connect to sparkify database
+    with postgres_connection(config) as conn:
+        cur = conn.cursor()
+        if args.migrate:
+            if migrate(cur, conn):
+                print('songplays partitioned by month')
+            return
+        if not args.incremental:
+            drop_tables(cur, conn)
+        create_tables(cur, conn)
 
 
 if __name__ == "__main__":
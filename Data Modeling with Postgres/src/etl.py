@@ -1,10 +1,85 @@
 import os
+import io
 import glob
-import psycopg2
+import time
+import asyncio
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from sql_queries import *
+from song_index import SongIndex
+from time_dimension import TimeDimension, time_rows
+from json_reader import iter_batches, SONG_COLUMNS, LOG_COLUMNS
 
-def process_song_file(cur, filepath):
+from settings import sparkify_config
+from manifest import TableManifest
+from connections import postgres_connection
+import staging_cache
+import async_loader
+import quality
+import rollups
+import instrumentation
+from instrumentation import stage
+
+def extract_song_frames(filepath):
+    """
+    Function that reads a song json file and returns the rows for the songs
+    and artists tables.
+    
+    Args:
+    ---------------------------------------
+        filepath:   the song json file
+        
+    Returns:
+        dict of table name to DataFrame, in the column order of the insert
+    """
+    # open song file
+    return song_frames(read_json(filepath))
+
+
+def read_json(filepath):
+    """
+    Function that reads a JSON lines file into a DataFrame.
+    
+    Args:
+    ---------------------------------------
+        filepath:   the json file
+        
+    Returns:
+        DataFrame of the records
+    """
+    with stage('parse', bytes_read=os.path.getsize(filepath)) as timed:
+        df = pd.read_json(filepath, lines=True)
+        timed.add(rows_out=len(df))
+    return df
+
+
+def song_frames(df):
+    """
+    Function that splits song records into the rows for the songs and
+    artists tables.
+    
+    Args:
+    ---------------------------------------
+        df:         DataFrame of song records
+        
+    Returns:
+        dict of table name to DataFrame, in the column order of the insert,
+        and the rows failing the data-quality rules under 'quarantine'
+    """
+    df, bad = validate(df, 'song_data')
+    with stage('transform', rows_in=len(df)) as timed:
+        frames = {'songs': df[['song_id', 'title', 'artist_id', 'year', 'duration']],
+                  'artists': df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude',
+                                 'artist_longitude']]}
+        timed.add(rows_out=len(df) * 2)
+    if bad is not None:
+        frames['quarantine'] = bad
+    return frames
+
+
+def process_song_file(cur, filepath, index=None, times=None):
     """
     Function that reads a song json file, processes and inserts the results 
     into a Postgres database with two tables.
@@ -13,75 +88,296 @@ def process_song_file(cur, filepath):
     ---------------------------------------
         cur:        cursor of the created database
         filepath:   the song json file
+        index:      optional SongIndex to refresh with the loaded song
+        times:      unused, song files have no timestamps
         
     Returns:
+        number of rows inserted
     """
-    # open song file
-    df = pd.read_json(filepath, lines=True)
+    frames = set_aside(extract_song_frames(filepath), filepath)
+    if not len(frames['songs']):
+        return 0
+
+    # rows_out counts the rows the inserts wrote, not those ON CONFLICT skipped
+    with stage('insert', rows_in=2) as timed:
+        # insert song record
+        song_data = frames['songs'].values[0].tolist()
+        cur.execute(song_table_insert, song_data)
+        timed.add(rows_out=cur.rowcount)
+
+        # insert artist record
+        artist_data = frames['artists'].values[0].tolist()
+        cur.execute(artist_table_insert, artist_data)
+        timed.add(rows_out=cur.rowcount)
 
-    # insert song record
-    song_data = df[['song_id', 'title', 'artist_id', 'year', 'duration']].values[0].tolist()
-    cur.execute(song_table_insert, song_data)
+    if index is not None:
+        index.add(frames['songs'], frames['artists'])
 
-    # insert artist record
-    artist_data = df[['artist_id', 'artist_name', 'artist_location','artist_latitude','artist_longitude']].values[0].tolist()
-    cur.execute(artist_table_insert, artist_data)
+    return len(frames['songs']) + len(frames['artists'])
 
 
-def process_log_file(cur, filepath):
+def extract_log_frames(filepath):
     """
-    Function that reads a log json file, processes and inserts the results 
-    into a Postgres database with three tables.
+    Function that reads a log json file and returns the rows for the time,
+    users and songplays tables.
     
     Args:
     ---------------------------------------
-        cur:        cursor of the created database
         filepath:   the log json file
         
     Returns:
+        dict of table name to DataFrame; the songplays frame still carries
+        song, artist and length, which are resolved to song_id/artist_id on load
     """
     # open log file
-    df = pd.read_json(filepath, lines=True)
+    return log_frames(read_json(filepath))
+
 
+def log_frames(df):
+    """
+    Function that turns log records into the rows for the time, users and
+    songplays tables.
+    
+    Args:
+    ---------------------------------------
+        df:         DataFrame of log records
+        
+    Returns:
+        dict of table name to DataFrame; the songplays frame still carries
+        song, artist and length, which are resolved to song_id/artist_id on
+        load. NextSong events failing the data-quality rules are under 'quarantine'
+    """
     # filter by NextSong action
-    df = df[df['page'] == 'NextSong']
+    df, bad = validate(df[df['page'] == 'NextSong'], 'log_data')
+    with stage('transform', rows_in=len(df)) as timed:
+        frames = _log_frames(df)
+        timed.add(rows_out=sum(len(frame) for frame in frames.values()))
+    if bad is not None:
+        frames['quarantine'] = bad
+    return frames
+
+
+def validate(df, dataset):
+    """
+    Function that checks the data-quality rules of common/quality.py over
+    the records of a file or batch in one vectorized pass.
+    
+    Args:
+    ---------------------------------------
+        df:         DataFrame of records
+        dataset:    'song_data' or 'log_data'
+        
+    Returns:
+        (DataFrame of the good records, DataFrame of the bad ones with the
+        rules they break, or None)
+    """
+    with stage('validate', rows_in=len(df)) as timed:
+        df, bad = quality.validate(df, dataset)
+        timed.add(rows_out=len(df))
+    return df, bad
+
+
+def set_aside(frames, source=None):
+    """
+    Function that takes the rows failing the data-quality rules out of the
+    frames of a file or batch and appends them to the quarantine file.
+    
+    Args:
+    ---------------------------------------
+        frames:     dict of table name to DataFrame, changed in place
+        source:     the file the rows came from, when known
+        
+    Returns:
+        frames
+    """
+    quality.quarantine(frames.pop('quarantine', None), source)
+    return frames
+
 
+def _log_frames(df):
     # convert timestamp column to datetime
     t = pd.to_datetime(df['ts'], unit='ms')
 
-    # insert time data records
-    time_data = [t, t.dt.hour, t.dt.day, t.dt.weekofyear, t.dt.month, t.dt.year, t.dt.weekday]
-    column_labels = ['ts', 'hour', 'day', 'weekofyear', 'month', 'year', 'weekday']
-    time_df = pd.DataFrame(dict(zip(column_labels, time_data)))
+    # time data records, one per distinct timestamp
+    time_df = time_rows(t)
 
-    for i, row in time_df.iterrows():
-        cur.execute(time_table_insert, list(row))
-
-    # load user table
+    # user records
     user_df = df[['userId', 'firstName', 'lastName', 'gender', 'level']]
 
-    # insert user records
-    for i, row in user_df.iterrows():
-        cur.execute(user_table_insert, row)
+    # songplay records
+    songplay_df = df[['ts', 'userId', 'level', 'song', 'artist', 'length', 'sessionId', 'itemInSession', 'location',
+                      'userAgent']]
+    songplay_df = songplay_df.assign(ts=t, itemInSession=df['itemInSession'].astype('int64'))
 
-    # insert songplay records
-    for index, row in df.iterrows():
+    return {'time': time_df, 'users': user_df, 'songplays': songplay_df}
 
-        # get songid and artistid from song and artist tables
-        cur.execute(song_select, (row.song, row.artist, row.length))
-        results = cur.fetchone()
 
-        if results:
-            songid, artistid = results
-        else:
-            songid, artistid = None, None
+def process_log_file(cur, filepath, index=None, times=None):
+    """
+    Function that reads a log json file, processes and inserts the results 
+    into a Postgres database with three tables.
+    
+    Args:
+    ---------------------------------------
+        cur:        cursor of the created database
+        filepath:   the log json file
+        index:      optional SongIndex; without it every event runs song_select
+        times:      optional TimeDimension; only new start_times are inserted
+        
+    Returns:
+        number of rows inserted
+    """
+    frames = set_aside(extract_log_frames(filepath), filepath)
+    if times is not None:
+        frames['time'] = times.new_rows(frames['time'])
+    rows = sum(len(df) for df in frames.values())
+
+    # rows_out counts the rows the inserts wrote, not those ON CONFLICT skipped
+    with stage('insert', rows_in=rows) as inserted:
+        # monthly partitions of the file's songplays
+        if len(frames['songplays']):
+            cur.execute(songplay_partitions_range, (frames['songplays'].ts.min(), frames['songplays'].ts.max()))
+
+        # insert time data records
+        for i, row in frames['time'].iterrows():
+            cur.execute(time_table_insert, list(row))
+            inserted.add(rows_out=cur.rowcount)
+
+        # insert user records
+        for i, row in frames['users'].iterrows():
+            cur.execute(user_table_insert, row)
+            inserted.add(rows_out=cur.rowcount)
+
+        # insert songplay records resolved in one lookup against the index
+        if index is not None:
+            with stage('lookup', rows_in=len(frames['songplays'])):
+                songplays = index.resolve(frames['songplays'])
+            for i, row in songplays.iterrows():
+                cur.execute(songplay_table_insert, list(row))
+                inserted.add(rows_out=cur.rowcount)
+            return rows
+
+        # insert songplay records
+        for i, row in frames['songplays'].iterrows():
+
+            # get songid and artistid from song and artist tables
+            with stage('song_select', rows_in=1) as timed:
+                cur.execute(song_select, (row.song, row.artist, row.length))
+                results = cur.fetchone()
+                if results:
+                    timed.add(rows_out=1)
 
-        # insert songplay record
-        songplay_data = (row.ts, row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent)
-        cur.execute(songplay_table_insert, songplay_data)
+            songid, artistid = results if results else (None, None)
 
+            # insert songplay record
+            songplay_data = (row.ts, row.userId, row.level, songid, artistid, row.sessionId, row.itemInSession,
+                             row.location, row.userAgent)
+            cur.execute(songplay_table_insert, songplay_data)
+            inserted.add(rows_out=cur.rowcount)
 
-def process_data(cur, conn, filepath, func):
+    return rows
+
+
+def copy_frame(cur, df, stage, columns):
+    """
+    Function that streams a DataFrame into a staging table with COPY FROM STDIN.
+    
+    Args:
+    ---------------------------------------
+        cur:        cursor of the created database
+        df:         rows to copy, in the column order of columns
+        stage:      name of the staging table
+        columns:    staging table columns the DataFrame maps onto
+        
+    Returns:
+    """
+    with instrumentation.stage('copy', rows_in=len(df), rows_out=len(df)):
+        buf = io.StringIO()
+        df.to_csv(buf, index=False, header=False, na_rep='\\N')
+        buf.seek(0)
+        cur.copy_expert(stage_copy.format(stage, ', '.join(columns)), buf)
+
+
+def bulk_load(cur, frames, tables):
+    """
+    Function that copies a batch of rows into temporary staging tables and
+    merges them into the star schema with one statement per table. The caller
+    commits.
+    
+    Args:
+    ---------------------------------------
+        cur:        cursor of the created database
+        frames:     dict of table name to list of DataFrames
+        tables:     bulk_song_tables or bulk_log_tables from sql_queries.py
+        
+    Returns:
+        number of rows copied
+    """
+    rows = 0
+    for stage, create, columns, merge in tables:
+        table = stage[:-len('_stage')]
+        if not frames.get(table):
+            continue
+        df = pd.concat(frames[table], ignore_index=True)
+        cur.execute(create)
+        copy_frame(cur, df, stage, columns)
+        with instrumentation.stage('merge', rows_in=len(df)) as timed:
+            cur.execute(merge)
+            timed.add(rows_out=max(cur.rowcount, 0))
+        cur.execute(stage_truncate.format(stage))
+        rows += len(df)
+    return rows
+
+
+def get_files(filepath):
+    """
+    Function that gets all files with a json extension under a directory.
+    
+    Args:
+    ---------------------------------------
+        filepath:   the directory to walk
+        
+    Returns:
+        list of absolute file paths
+    """
+    all_files = []
+    with stage('discover') as timed:
+        for root, dirs, files in os.walk(filepath):
+            files = glob.glob(os.path.join(root,'*.json'))
+            for f in files :
+                all_files.append(os.path.abspath(f))
+        timed.add(rows_out=len(all_files))
+    return all_files
+
+
+def pending_files(all_files, manifest, filepath):
+    """
+    Function that drops the files the manifest has already loaded from
+    all_files, in place.
+    
+    Args:
+    ---------------------------------------
+        all_files:  list of absolute file paths, filtered in place
+        manifest:   Manifest or None to keep every file
+        filepath:   the directory the files were found in
+        
+    Returns:
+        dict of path to FileState of the files left to load
+    """
+    if manifest is None:
+        return {}
+
+    with stage('manifest', rows_in=len(all_files)) as timed:
+        states = {state.path: state for state in manifest.pending(all_files)}
+        timed.add(rows_out=len(states))
+    skipped = len(all_files) - len(states)
+    all_files[:] = [f for f in all_files if f in states]
+    if skipped:
+        print('{} files in {} already loaded, skipped'.format(skipped, filepath))
+    return states
+
+
+def process_data(cur, conn, filepath, func, index=None, manifest=None, times=None):
     """
     Function that gets all files with a json extension from the directory,
     iterate over every file and call the functions written above.
@@ -92,16 +388,17 @@ def process_data(cur, conn, filepath, func):
         conn:       connection of the created database
         filepath:   the filepath for the log json file
         func:       function call
+        index:      optional SongIndex passed on to func
+        manifest:   optional Manifest; only new or changed files are loaded
+                    and each file is recorded in the same transaction as its rows
+        times:      optional TimeDimension passed on to func
         
         
     Returns:
     """
     # get all files matching extension from directory
-    all_files = []
-    for root, dirs, files in os.walk(filepath):
-        files = glob.glob(os.path.join(root,'*.json'))
-        for f in files :
-            all_files.append(os.path.abspath(f))
+    all_files = get_files(filepath)
+    states = pending_files(all_files, manifest, filepath)
 
     # get total number of files found
     num_files = len(all_files)
@@ -109,19 +406,550 @@ def process_data(cur, conn, filepath, func):
 
     # iterate over files and process
     for i, datafile in enumerate(all_files, 1):
-        func(cur, datafile)
-        conn.commit()
+        rows = func(cur, datafile, index, times)
+        if manifest is not None:
+            manifest.record(states[datafile], rows)
+        with stage('commit'):
+            conn.commit()
         print('{}/{} files processed.'.format(i, num_files))
 
 
+# SongIndex used by extract_file, set once per worker process by the pool initializer
+worker_index = None
+
+# whether extract_file hands the stage totals of its worker process back to the parent
+worker_metrics = False
+
+
+def set_worker_index(index, metrics=False):
+    """
+    Function that hands the SongIndex to a worker process.
+    
+    Args:
+    ---------------------------------------
+        index:      SongIndex or None
+        metrics:    record the stages of the worker for the parent
+        
+    Returns:
+    """
+    global worker_index, worker_metrics
+    worker_index = index
+    worker_metrics = metrics
+    if metrics:
+        instrumentation.start_worker()
+
+
+def extract_file(func, datafile):
+    """
+    Function that parses and transforms one file, resolving songplays against
+    the worker's SongIndex when there is one.
+    
+    Args:
+    ---------------------------------------
+        func:       extract_song_frames or extract_log_frames
+        datafile:   the json file
+        
+    Returns:
+        (frames, seconds spent on the file, stage totals of a worker process)
+    """
+    start = time.perf_counter()
+    frames = func(datafile)
+    if worker_index is not None and 'songplays' in frames:
+        with stage('lookup', rows_in=len(frames['songplays'])):
+            frames['songplays'] = worker_index.resolve(frames['songplays'])
+    return frames, time.perf_counter() - start, instrumentation.drain() if worker_metrics else {}
+
+
+def process_data_bulk(cur, conn, filepath, func, batch_files=500, index=None, workers=1, manifest=None,
+                      times=None):
+    """
+    Function that gets all files with a json extension from the directory and
+    loads them in batches through COPY and set-based merges, committing once
+    per batch instead of once per file.
+    
+    With more than one worker, files are parsed and transformed in a process
+    pool while this process stays the single writer; the next batch is parsed
+    while the current one is being written. Results come back in file order,
+    so the merges see the rows in the same order as a serial run.
+    
+    Args:
+    ---------------------------------------
+        cur:            cursor of the created database
+        conn:           connection of the created database
+        filepath:       the filepath for the json files
+        func:           extract_song_frames or extract_log_frames
+        batch_files:    number of files merged per transaction
+        index:          optional SongIndex refreshed by song batches and used
+                        to resolve song_id/artist_id of log batches
+        workers:        number of parsing processes
+        manifest:       optional Manifest; only new or changed files are loaded
+                        and each batch's files are recorded in the batch's transaction
+        times:          optional TimeDimension; only new start_times are copied
+        
+    Returns:
+        number of rows copied
+    """
+    if func is extract_song_frames:
+        tables = bulk_song_tables
+    elif index is not None:
+        tables = bulk_log_tables_indexed
+    else:
+        tables = bulk_log_tables
+
+    all_files = get_files(filepath)
+    states = pending_files(all_files, manifest, filepath)
+    num_files = len(all_files)
+    print('{} files found in {}'.format(num_files, filepath))
+    batches = [all_files[i:i + batch_files] for i in range(0, num_files, batch_files)]
+
+    if workers > 1:
+        pool = ProcessPoolExecutor(workers, initializer=set_worker_index,
+                                   initargs=(index, instrumentation.enabled()))
+        chunksize = max(1, batch_files // (workers * 4))
+        submit = lambda batch: pool.map(extract_file, [func] * len(batch), batch, chunksize=chunksize)
+    else:
+        pool = None
+        set_worker_index(index)
+        submit = lambda batch: map(extract_file, [func] * len(batch), batch)
+
+    start = time.perf_counter()
+    rows = 0
+    i = 0
+    try:
+        pending = submit(batches[0]) if batches else None
+        for b, batch in enumerate(batches):
+            results = pending
+            pending = submit(batches[b + 1]) if b + 1 < len(batches) else None
+
+            frames = {}
+            file_rows_loaded = []
+            for datafile, (file_frames, seconds, metrics) in zip(batch, results):
+                i += 1
+                instrumentation.merge(metrics)
+                set_aside(file_frames, datafile)
+                if times is not None and 'time' in file_frames:
+                    file_frames['time'] = times.new_rows(file_frames['time'])
+                for table, df in file_frames.items():
+                    frames.setdefault(table, []).append(df)
+                file_rows = sum(len(df) for df in file_frames.values())
+                file_rows_loaded.append((datafile, file_rows))
+                print('{}/{} files processed. {} rows in {:.1f} ms ({:.0f} rows/s) {}'.format(
+                    i, num_files, file_rows, seconds * 1000, file_rows / seconds if seconds else 0,
+                    os.path.basename(datafile)))
+
+            if index is not None and 'songs' in frames:
+                index.add(pd.concat(frames['songs']), pd.concat(frames['artists']))
+            rows += bulk_load(cur, frames, tables)
+            if manifest is not None:
+                for datafile, file_rows in file_rows_loaded:
+                    manifest.record(states[datafile], file_rows)
+            with stage('commit'):
+                conn.commit()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        set_worker_index(None)
+
+    elapsed = time.perf_counter() - start
+    if elapsed:
+        print('{} files, {} rows in {:.2f} s: {:.1f} files/s, {:.0f} rows/s with {} worker(s)'.format(
+            num_files, rows, elapsed, num_files / elapsed, rows / elapsed, workers))
+
+    return rows
+
+
+def transform_bytes(func, data):
+    """
+    Function that parses and transforms the content of one json file,
+    resolving songplays against the worker's SongIndex when there is one.
+    
+    Args:
+    ---------------------------------------
+        func:       song_frames or log_frames
+        data:       bytes of the json file
+        
+    Returns:
+        (frames, seconds spent on the file, stage totals of the worker process)
+    """
+    start = time.perf_counter()
+    with stage('parse', bytes_read=len(data)) as timed:
+        df = pd.read_json(io.BytesIO(data), lines=True)
+        timed.add(rows_out=len(df))
+    frames = func(df)
+    if worker_index is not None and 'songplays' in frames:
+        with stage('lookup', rows_in=len(frames['songplays'])):
+            frames['songplays'] = worker_index.resolve(frames['songplays'])
+    return frames, time.perf_counter() - start, instrumentation.drain() if worker_metrics else {}
+
+
+def process_data_async(config, filepath, func, batch_files=100, index=None, workers=1, writers=4, queue_size=64,
+                       times=None):
+    """
+    Function that gets all files with a json extension from the directory and
+    loads them through the asyncio pipeline of async_loader.py: files are
+    read by threads, parsed and transformed in a process pool, and copied by
+    several asyncpg connections at once, with bounded queues in between.
+    Batches are merged and committed in file order, so the tables end up as
+    after a serial bulk load.
+    
+    Args:
+    ---------------------------------------
+        config:         PostgresConfig of the database
+        filepath:       the filepath for the json files
+        func:           song_frames or log_frames
+        batch_files:    number of files merged per transaction
+        index:          optional SongIndex refreshed by song batches and used
+                        to resolve song_id/artist_id of log batches
+        workers:        number of parsing processes
+        writers:        number of connections with a batch in flight
+        queue_size:     number of files held between two stages
+        times:          optional TimeDimension; only new start_times are copied
+        
+    Returns:
+        number of rows copied
+    """
+    if func is song_frames:
+        tables = bulk_song_tables
+    elif index is not None:
+        tables = bulk_log_tables_indexed
+    else:
+        tables = bulk_log_tables
+
+    all_files = get_files(filepath)
+    num_files = len(all_files)
+    print('{} files found in {}'.format(num_files, filepath))
+
+    def prepare(frames, datafile):
+        set_aside(frames, datafile)
+        if times is not None and 'time' in frames:
+            frames['time'] = times.new_rows(frames['time'])
+        if index is not None and 'songs' in frames:
+            index.add(frames['songs'], frames['artists'])
+        return frames
+
+    start = time.perf_counter()
+    pool = ProcessPoolExecutor(workers, initializer=set_worker_index, initargs=(index, instrumentation.enabled()))
+    try:
+        rows = asyncio.run(async_loader.load(config, all_files, functools.partial(transform_bytes, func), tables,
+                                             pool, prepare, batch_files, writers, queue_size))
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    if elapsed:
+        print('{} files, {} rows in {:.2f} s: {:.1f} files/s, {:.0f} rows/s with {} worker(s), {} writer(s)'.format(
+            num_files, rows, elapsed, num_files / elapsed, rows / elapsed, workers, writers))
+
+    return rows
+
+
+def process_data_stream(cur, conn, filepath, func, batch_rows=10000, index=None, manifest=None, times=None):
+    """
+    Function that streams all json files under the directory through the
+    JSON-lines reader and bulk loads one columnar batch at a time, instead of
+    building a DataFrame per file.
+    
+    Args:
+    ---------------------------------------
+        cur:            cursor of the created database
+        conn:           connection of the created database
+        filepath:       the filepath for the json files
+        func:           song_frames or log_frames
+        batch_rows:     minimum number of records per batch and transaction
+        index:          optional SongIndex refreshed by song batches and used
+                        to resolve song_id/artist_id of log batches
+        manifest:       optional Manifest; only new or changed files are loaded
+                        and each batch's files are recorded in the batch's transaction
+        times:          optional TimeDimension; only new start_times are copied
+        
+    Returns:
+        number of rows copied
+    """
+    if func is song_frames:
+        tables, columns = bulk_song_tables, SONG_COLUMNS
+    elif index is not None:
+        tables, columns = bulk_log_tables_indexed, LOG_COLUMNS
+    else:
+        tables, columns = bulk_log_tables, LOG_COLUMNS
+
+    all_files = get_files(filepath)
+    states = pending_files(all_files, manifest, filepath)
+    num_files = len(all_files)
+    print('{} files found in {}'.format(num_files, filepath))
+
+    start = time.perf_counter()
+    rows = 0
+    i = 0
+    batches = instrumentation.timed_iter('parse', iter_batches(all_files, columns, batch_rows), counts=lambda item: {
+        'rows_out': sum(records for datafile, records in item[1]),
+        'bytes_read': sum(os.path.getsize(datafile) for datafile, records in item[1])})
+    for batch, files in batches:
+        frames = set_aside(func(pd.DataFrame(batch, columns=columns)))
+        if index is not None and 'songs' in frames:
+            index.add(frames['songs'], frames['artists'])
+        if index is not None and 'songplays' in frames:
+            with stage('lookup', rows_in=len(frames['songplays'])):
+                frames['songplays'] = index.resolve(frames['songplays'])
+        if times is not None and 'time' in frames:
+            frames['time'] = times.new_rows(frames['time'])
+
+        rows += bulk_load(cur, {table: [df] for table, df in frames.items()}, tables)
+        if manifest is not None:
+            for datafile, records in files:
+                manifest.record(states[datafile], records)
+        with stage('commit'):
+            conn.commit()
+        i += len(files)
+        print('{}/{} files processed.'.format(i, num_files))
+
+    elapsed = time.perf_counter() - start
+    if elapsed:
+        print('{} files, {} rows in {:.2f} s: {:.1f} files/s, {:.0f} rows/s streamed'.format(
+            num_files, rows, elapsed, num_files / elapsed, rows / elapsed))
+
+    return rows
+
+
+# columns of the cache read for each table group, and the rows kept
+CACHE_READS = {'song_data': (song_frames, SONG_COLUMNS[1:], None),
+               'log_data': (log_frames, ['ts', 'userId', 'firstName', 'lastName', 'gender', 'level', 'song', 'artist',
+                                         'length', 'sessionId', 'itemInSession', 'location', 'userAgent', 'page'],
+                            ('page', 'NextSong'))}
+
+
+def process_data_cache(cur, conn, filepath, cache, dataset, batch_rows=100000, index=None, manifest=None, times=None):
+    """
+    Function that brings the Parquet staging cache up to date with the json
+    files under the directory, then bulk loads the cache one columnar batch at
+    a time, part by part in the order of the json files. Only the columns the
+    tables need are read, and log batches only hold NextSong events, filtered
+    while reading.
+    
+    Args:
+    ---------------------------------------
+        cur:            cursor of the created database
+        conn:           connection of the created database
+        filepath:       the filepath for the json files
+        cache:          directory of the staging cache
+        dataset:        'song_data' or 'log_data'
+        batch_rows:     maximum number of records per batch and transaction
+        index:          optional SongIndex refreshed by song batches and used
+                        to resolve song_id/artist_id of log batches
+        manifest:       optional Manifest; only parts not loaded yet are read
+        times:          optional TimeDimension; only new start_times are copied
+        
+    Returns:
+        number of rows copied
+    """
+    with stage('normalize'):
+        converted, cached = staging_cache.normalize(filepath, cache, dataset)
+    print('{} of {} files in {} converted to {}'.format(converted, cached, filepath, cache))
+
+    func, columns, keep = CACHE_READS[dataset]
+    if func is song_frames:
+        tables = bulk_song_tables
+    elif index is not None:
+        tables = bulk_log_tables_indexed
+    else:
+        tables = bulk_log_tables
+    where = staging_cache.ds.field(keep[0]) == keep[1] if keep else None
+
+    parts = staging_cache.ordered_parts(cache, dataset)
+    states = {part: staging_cache.part_state(cache, dataset, part) for part, outputs in parts}
+    if manifest is not None:
+        parts = [(part, outputs) for part, outputs in parts if manifest.entries.get(states[part].path) != states[part]]
+    print('{} of {} parts of the cache to load'.format(len(parts), len(states)))
+
+    start = time.perf_counter()
+    rows = 0
+    for part, outputs in parts:
+        part_rows = 0
+        batches = instrumentation.timed_iter('parse', staging_cache.iter_frames(cache, dataset, columns, where,
+                                                                                batch_rows, parts=[part]),
+                                             counts=lambda df: {'rows_out': len(df)})
+        for df in batches:
+            frames = set_aside(func(df))
+            if index is not None and 'songs' in frames:
+                index.add(frames['songs'], frames['artists'])
+            if index is not None and 'songplays' in frames:
+                with stage('lookup', rows_in=len(frames['songplays'])):
+                    frames['songplays'] = index.resolve(frames['songplays'])
+            if times is not None and 'time' in frames:
+                frames['time'] = times.new_rows(frames['time'])
+
+            part_rows += bulk_load(cur, {table: [df] for table, df in frames.items()}, tables)
+            with stage('commit'):
+                conn.commit()
+
+        # a part cut short by a crash is loaded again; the songplays natural key drops its events loaded before
+        if manifest is not None:
+            manifest.record(states[part], part_rows)
+            conn.commit()
+        rows += part_rows
+
+    elapsed = time.perf_counter() - start
+    if elapsed:
+        print('{} rows in {:.2f} s: {:.0f} rows/s from the cache'.format(rows, elapsed, rows / elapsed))
+
+    return rows
+
+
+def build_indexes(cur, conn, drop=False):
+    """
+    Function that builds the analytics indexes of songplays and refreshes
+    the planner statistics, or drops the indexes before a large load so they
+    are built once from the loaded rows instead of being maintained row by row.
+    
+    Args:
+    ---------------------------------------
+        cur:        cursor of the created database
+        conn:       connection of the created database
+        drop:       drop the indexes instead
+        
+    Returns:
+    """
+    with stage('drop indexes' if drop else 'build indexes'):
+        for query in songplay_index_drops if drop else songplay_index_queries + analyze_queries:
+            cur.execute(query)
+        conn.commit()
+
+
+def update_rollups(cur, conn, rebuild=False):
+    """
+    Function that adds the songplays loaded since the last update to every
+    rollup of common/rollups.py, reading only those songplays, and moves the
+    watermarks past them, in one transaction.
+
+    Args:
+    ---------------------------------------
+        cur:        cursor of the created database
+        conn:       connection of the created database
+        rebuild:    count every songplay again instead, e.g. after loads
+                    that left the rollups out
+
+    Returns:
+        number of rollup rows updated or inserted
+    """
+    rows = 0
+    with stage('rollups') as timed:
+        lows = {}
+        for rollup in rollups.ROLLUPS:
+            cur.execute(rollup_watermark_insert, (rollup.name,))
+            cur.execute(rollup_watermark_select, (rollup.name,))
+            lows[rollup.name] = cur.fetchone()[0]
+        cur.execute(songplay_max_id)
+        high = cur.fetchone()[0]
+
+        for rollup in rollups.ROLLUPS:
+            low = lows[rollup.name]
+            if not rebuild and low >= high:
+                continue
+            queries = rollup_rebuild_queries if rebuild else rollup_update_queries
+            with stage('rollup ' + rollup.name):
+                for query in queries[rollup.name]:
+                    cur.execute(query, {'low': low, 'high': high})
+                    rows += max(cur.rowcount, 0)
+            cur.execute(rollup_watermark_update, (high, rollup.name))
+        conn.commit()
+        timed.add(rows_out=rows)
+    return rows
+
+
 def main():
-    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
-    cur = conn.cursor()
+    parser = argparse.ArgumentParser(description='Load song_data and log_data into sparkifydb.')
+    parser.add_argument('--mode', choices=['row', 'bulk', 'async'], default='row',
+                        help='row: one INSERT per row; bulk: COPY into staging tables and merge; '
+                             'async: bulk load with reading, parsing and writing overlapped')
+    parser.add_argument('--batch-files', type=int, default=None,
+                        help='files merged per transaction in bulk (default 500) and async (default 100) mode')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes parsing files in bulk and async mode')
+    parser.add_argument('--writers', type=int, default=4,
+                        help='connections with a batch in flight in async mode')
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help='files held between two stages in async mode')
+    parser.add_argument('--reader', choices=['pandas', 'stream', 'cache'], default='pandas',
+                        help='bulk mode only; stream: read records across files in columnar batches '
+                             'of --batch-rows instead of one DataFrame per file; cache: convert new files '
+                             'to the Parquet staging cache and load from it')
+    parser.add_argument('--cache', default='cache', help='directory of the staging cache with --reader cache')
+    parser.add_argument('--batch-rows', type=int, default=10000,
+                        help='records per batch with --reader stream or cache')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only load files that are new or changed since the last run, tracked in etl_manifest')
+    parser.add_argument('--lookup', choices=['index', 'query'], default='index',
+                        help='index: resolve songs with an in-memory SongIndex; query: run song_select per event')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='drop the songplays indexes before loading and build them again after it, '
+                             'for large loads')
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help='count every songplay into the rollups again instead of only the new ones')
+    parser.add_argument('--song-data', default='data/song_data')
+    parser.add_argument('--log-data', default='data/log_data')
+    quality.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if args.workers > 1 and args.mode == 'row':
+        parser.error('--workers requires --mode bulk or async')
+    if args.reader in ('stream', 'cache') and (args.mode != 'bulk' or args.workers > 1):
+        parser.error('--reader {} requires --mode bulk with a single worker'.format(args.reader))
+    if args.mode == 'async' and args.incremental:
+        parser.error('--mode async does not track loaded files with --incremental')
+    if args.batch_files is None:
+        args.batch_files = 100 if args.mode == 'async' else 500
+    instrumentation.configure_from_args('postgres_etl', args)
+    quality.configure(args.quarantine)
+
+    # a pooled connection, kept warm for the other jobs of the process
+    with postgres_connection(sparkify_config()) as conn:
+        cur = conn.cursor()
+
+        # built once from the songs already loaded, refreshed by the song files below
+        # and shared by every log file of the run
+        index = SongIndex.from_db(cur) if args.lookup == 'index' else None
+
+        times = TimeDimension.from_db(cur)
+        manifest = TableManifest(cur) if args.incremental else None
+        conn.commit()
+        if args.defer_indexes:
+            build_indexes(cur, conn, drop=True)
+
+        if args.mode == 'async':
+            process_data_async(sparkify_config(), filepath=args.song_data, func=song_frames,
+                               batch_files=args.batch_files, index=index, workers=args.workers,
+                               writers=args.writers, queue_size=args.queue_size)
+            process_data_async(sparkify_config(), filepath=args.log_data, func=log_frames,
+                               batch_files=args.batch_files, index=index, workers=args.workers,
+                               writers=args.writers, queue_size=args.queue_size, times=times)
+        elif args.reader == 'cache':
+            process_data_cache(cur, conn, filepath=args.song_data, cache=args.cache, dataset='song_data',
+                               batch_rows=args.batch_rows, index=index, manifest=manifest)
+            process_data_cache(cur, conn, filepath=args.log_data, cache=args.cache, dataset='log_data',
+                               batch_rows=args.batch_rows, index=index, manifest=manifest, times=times)
+        elif args.reader == 'stream':
+            process_data_stream(cur, conn, filepath=args.song_data, func=song_frames,
+                                batch_rows=args.batch_rows, index=index, manifest=manifest)
+            process_data_stream(cur, conn, filepath=args.log_data, func=log_frames,
+                                batch_rows=args.batch_rows, index=index, manifest=manifest, times=times)
+        elif args.mode == 'bulk':
+            process_data_bulk(cur, conn, filepath=args.song_data, func=extract_song_frames,
+                              batch_files=args.batch_files, index=index, workers=args.workers, manifest=manifest)
+            process_data_bulk(cur, conn, filepath=args.log_data, func=extract_log_frames,
+                              batch_files=args.batch_files, index=index, workers=args.workers, manifest=manifest,
+                              times=times)
+        else:
+            process_data(cur, conn, filepath=args.song_data, func=process_song_file, index=index, manifest=manifest)
+            process_data(cur, conn, filepath=args.log_data, func=process_log_file, index=index, manifest=manifest,
+                         times=times)
+
+        # manifest mtime updates of touched-but-unchanged files
+        conn.commit()
 
-    process_data(cur, conn, filepath='data/song_data', func=process_song_file)
-    process_data(cur, conn, filepath='data/log_data', func=process_log_file)
+        # a fresh database gets its songplays indexes here, after its first load
+        build_indexes(cur, conn)
 
-    conn.close()
+        # the rollups count the songplays of this run
+        update_rollups(cur, conn, rebuild=args.rebuild_rollups)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+import json
+import argparse
+import statistics
+import create_tables
+from sql_queries import song_select, songplay_relkind, lookup_index_drops, songplay_index_drops
+from settings import sparkify_config
+from connections import postgres_connection
+
+
+# the queries compared, with the query picking their parameters from the loaded data
+QUERIES = {
+    'lookup': (song_select,
+               """SELECT songs.title, artists.artist_name, songs.duration \
+                  FROM songs join artists on songs.artist_id = artists.artist_id \
+                  ORDER BY songs.song_id LIMIT 1"""),
+    'day': ("""SELECT count(*), count(DISTINCT user_id) FROM songplays \
+               WHERE start_time >= %s AND start_time < %s::timestamp + interval '1 day'""",
+            """SELECT date_trunc('day', start_time), date_trunc('day', start_time) FROM songplays \
+               GROUP BY 1 ORDER BY count(*) DESC LIMIT 1"""),
+    'month': ("""SELECT level, count(*) FROM songplays \
+                 WHERE start_time >= %s AND start_time < %s::timestamp + interval '1 month' GROUP BY level""",
+              """SELECT date_trunc('month', start_time), date_trunc('month', start_time) FROM songplays \
+                 GROUP BY 1 ORDER BY count(*) DESC LIMIT 1"""),
+    'user_month': ("""SELECT count(*) FROM songplays \
+                      WHERE user_id = %s AND start_time >= %s AND start_time < %s::timestamp + interval '1 month'""",
+                   """SELECT user_id, date_trunc('month', start_time), date_trunc('month', start_time) \
+                      FROM songplays GROUP BY 1, 2 ORDER BY count(*) DESC LIMIT 1"""),
+}
+
+
+def plan_nodes(plan):
+    """
+    Function that walks an EXPLAIN plan tree.
+
+    Returns:
+        generator of the plan's nodes
+    """
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(cur, query, params, repeat=5):
+    """
+    Function that runs EXPLAIN ANALYZE on a query several times.
+
+    Args:
+    ---------------------------------------
+        cur:        cursor of the created database
+        query:      the query
+        params:     its parameters
+        repeat:     number of runs; the median times are kept
+
+    Returns:
+        dict with the median execution and planning ms, the buffers of the
+        last run, its scan nodes and the songplays partitions it scanned
+    """
+    runs = []
+    for _ in range(repeat):
+        cur.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query, params)
+        result = cur.fetchone()[0]
+        runs.append(json.loads(result) if isinstance(result, str) else result)
+
+    plan = runs[-1][0]['Plan']
+    nodes = list(plan_nodes(plan))
+    return {'execution_ms': statistics.median(run[0]['Execution Time'] for run in runs),
+            'planning_ms': statistics.median(run[0]['Planning Time'] for run in runs),
+            'buffers': plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0),
+            'scans': sorted({node['Node Type'] for node in nodes if 'Scan' in node['Node Type']}),
+            'partitions': len({node['Relation Name'] for node in nodes
+                               if node.get('Relation Name', '').startswith('songplays')})}
+
+
+def measure(cur, repeat=5):
+    """
+    Function that runs EXPLAIN ANALYZE on every query of QUERIES, with
+    parameters taken from the busiest day, month and user of the data.
+
+    Returns:
+        dict of query name -> result of explain()
+    """
+    results = {}
+    for name, (query, pick) in QUERIES.items():
+        cur.execute(pick)
+        params = cur.fetchone()
+        if params is None:
+            print('{}: no rows to pick parameters from, skipped'.format(name))
+            continue
+        results[name] = explain(cur, query, params, repeat)
+    return results
+
+
+def without_indexes(cur, conn, repeat=5):
+    """
+    Function that measures the queries with the lookup and songplays indexes
+    dropped in a transaction that is rolled back afterwards, so the database
+    is left as it was.
+    """
+    try:
+        for query in lookup_index_drops + songplay_index_drops:
+            cur.execute(query)
+        return measure(cur, repeat)
+    finally:
+        conn.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='EXPLAIN ANALYZE the song lookup and date range queries on '
+                                                 'songplays before and after partitioning and indexing.')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per query; the median is reported')
+    parser.add_argument('--migrate', action='store_true',
+                        help='measure an unpartitioned database, migrate it with create_tables.migrate() '
+                             'and measure it again')
+    parser.add_argument('--output', default=None, help='append the results to this JSON lines file')
+    args = parser.parse_args()
+
+    with postgres_connection(sparkify_config()) as conn:
+        cur = conn.cursor()
+        cur.execute(songplay_relkind)
+        row = cur.fetchone()
+        unpartitioned = row is not None and row[0] != 'p'
+        if unpartitioned and not args.migrate:
+            print('songplays is not partitioned; run with --migrate to compare with the current schema')
+        if args.migrate and unpartitioned:
+            before = measure(cur, args.repeat)
+            conn.commit()
+            create_tables.migrate(cur, conn)
+            baseline = 'unpartitioned, no indexes'
+        else:
+            before = without_indexes(cur, conn, args.repeat)
+            baseline = 'no indexes'
+        after = measure(cur, args.repeat)
+        conn.commit()
+
+    print('before: {}; after: current schema'.format(baseline))
+    print('{:<12}{:>12}{:>12}{:>9}{:>12}{:>12}  {}'.format('query', 'before ms', 'after ms', 'speedup', 'buffers',
+                                                          'partitions', 'scans after'))
+    for name in after:
+        b, a = before.get(name), after[name]
+        print('{:<12}{:>12}{:>12.3f}{:>9}{:>12}{:>12}  {}'.format(
+            name, '{:.3f}'.format(b['execution_ms']) if b else '-', a['execution_ms'],
+            '{:.1f}x'.format(b['execution_ms'] / a['execution_ms']) if b and a['execution_ms'] else '-',
+            '{}/{}'.format(b['buffers'] if b else '-', a['buffers']),
+            '{}/{}'.format(b['partitions'] if b else '-', a['partitions']), ', '.join(a['scans'])))
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps({'baseline': baseline, 'before': before, 'after': after}) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import json
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+SONG_COLUMNS = ['num_songs', 'artist_id', 'artist_latitude', 'artist_longitude', 'artist_location',
+                'artist_name', 'song_id', 'title', 'duration', 'year']
+
+LOG_COLUMNS = ['artist', 'auth', 'firstName', 'gender', 'itemInSession', 'lastName', 'length', 'level',
+               'location', 'method', 'page', 'registration', 'sessionId', 'song', 'status', 'ts',
+               'userAgent', 'userId']
+
+
+def iter_records(filepath):
+    """
+    Function that parses the records of one JSON-lines file.
+
+    Args:
+    ---------------------------------------
+        filepath:   the json file
+
+    Returns:
+        generator of dicts, one per non-empty line
+    """
+    with open(filepath, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield loads(line)
+
+
+def iter_batches(all_files, columns, batch_rows=10000):
+    """
+    Function that streams the records of many JSON-lines files as columnar
+    batches, without building a DataFrame per file.
+
+    A batch is closed at the first file boundary after batch_rows records, so
+    every file is entirely inside one batch (and one transaction) and memory is
+    bounded by batch_rows plus the largest file, however many files there are.
+
+    Args:
+    ---------------------------------------
+        all_files:  list of json files, read in order
+        columns:    keys to keep; missing keys become None
+        batch_rows: minimum number of records per batch
+
+    Returns:
+        generator of (dict of column to list of values, list of (file, rows))
+    """
+    records = []
+    files = []
+    for filepath in all_files:
+        before = len(records)
+        records.extend(iter_records(filepath))
+        files.append((filepath, len(records) - before))
+
+        if len(records) >= batch_rows:
+            yield {column: [r.get(column) for r in records] for column in columns}, files
+            records = []
+            files = []
+
+    if files:
+        yield {column: [r.get(column) for r in records] for column in columns}, files
@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import timedelta
+from settings import sparkify_config
+from connections import postgres_connection
+from synthetic_data import generate
+import rollups
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def requests(cur):
+    """
+    Function that builds the play-count questions of the analytics team, with
+    the week and user taken from the loaded data.
+
+    Returns:
+        dict of name -> arguments of rollups.plan()
+    """
+    cur.execute("""SELECT min(start_time) FROM songplays""")
+    first = cur.fetchone()[0]
+    cur.execute("""SELECT user_id FROM songplays GROUP BY 1 ORDER BY count(*) DESC LIMIT 1""")
+    user = cur.fetchone()[0]
+    week = rollups.truncate(first, 'week')
+    return {'daily_plays': dict(grain='day'),
+            'free_paid_by_hour': dict(dimensions=['level'], grain='hour'),
+            'plays_per_user_day': dict(dimensions=['user_id'], grain='day'),
+            'user_month': dict(dimensions=['user_id'], grain='month', filters={'user_id': user}),
+            'location_level_month': dict(dimensions=['location', 'level'], grain='month'),
+            'top_songs_week': dict(dimensions=['song_id'], start=week, end=week + timedelta(days=7), top=10)}
+
+
+def time_plan(cur, request, repeat, sizes=None, use_rollups=True):
+    """
+    Function that runs a request repeat times, on the smallest rollup
+    answering it or on songplays.
+
+    Returns:
+        (source, median seconds, rows of the last run)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        source, rows = rollups.plays(cur, sizes=sizes, rollups=rollups.ROLLUPS if use_rollups else [], **request)
+        times.append(time.perf_counter() - start)
+    return source, statistics.median(times), rows
+
+
+def load(scale, data_dir, seed, match_rate, etl_args):
+    """
+    Function that generates the synthetic dataset of a scale, unless it is
+    there already, and loads it into a new sparkifydb, which fills the rollups.
+    """
+    data = os.path.join(data_dir, '{:g}x-seed{}-match{:g}'.format(scale, seed, match_rate))
+    dataset = generate(data, scale, seed, match_rate)
+    print('{} events, {} songs in {}'.format(dataset['events'], dataset['songs'], data))
+    subprocess.run([sys.executable, 'create_tables.py'], cwd=HERE, check=True)
+    subprocess.run([sys.executable, 'etl.py', '--song-data', os.path.join(data, 'song_data'),
+                    '--log-data', os.path.join(data, 'log_data')] + etl_args.split(), cwd=HERE, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time play-count questions on the rollups against the same '
+                                                 'questions on songplays.')
+    parser.add_argument('--scale', type=float, default=None,
+                        help='generate a synthetic dataset of this multiple of the bundled sample and load it '
+                             'into a new database first; the loaded database is measured otherwise')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--match-rate', type=float, default=0.5)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'sparkify_synthetic'),
+                        help='datasets are generated here once per scale and seed')
+    parser.add_argument('--etl-args', default='--mode bulk', help='options of the load')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per query; the median is reported')
+    parser.add_argument('--output', default=None, help='append the results to this JSON lines file')
+    args = parser.parse_args()
+
+    if args.scale is not None:
+        load(args.scale, args.data_dir, args.seed, args.match_rate, args.etl_args)
+
+    results = {}
+    with postgres_connection(sparkify_config()) as conn:
+        cur = conn.cursor()
+        cur.execute("""SELECT count(*) FROM songplays""")
+        fact_rows = cur.fetchone()[0]
+        sizes = rollups.measure(cur)
+        for name, request in requests(cur).items():
+            # one warm-up run of each
+            time_plan(cur, request, 1, sizes)
+            time_plan(cur, request, 1, use_rollups=False)
+            source, rollup_s, rollup_rows = time_plan(cur, request, args.repeat, sizes)
+            _, fact_s, expected = time_plan(cur, request, args.repeat, use_rollups=False)
+            results[name] = {'source': source, 'source_rows': sizes.get(source, fact_rows), 'rows': len(rollup_rows),
+                             'rollup_ms': rollup_s * 1000, 'fact_ms': fact_s * 1000,
+                             'same': [tuple(row) for row in rollup_rows] == [tuple(row) for row in expected]}
+        conn.commit()
+
+    print('songplays: {} rows; {}'.format(fact_rows, ', '.join('{}: {} rows'.format(name, rows)
+                                                               for name, rows in sizes.items())))
+    print('{:<22}{:<20}{:>8}{:>12}{:>12}{:>9}  {}'.format('request', 'answered from', 'rows', 'fact ms',
+                                                          'rollup ms', 'speedup', 'same rows'))
+    for name, result in results.items():
+        print('{:<22}{:<20}{:>8}{:>12.3f}{:>12.3f}{:>9}  {}'.format(
+            name, result['source'], result['rows'], result['fact_ms'], result['rollup_ms'],
+            '{:.1f}x'.format(result['fact_ms'] / result['rollup_ms']) if result['rollup_ms'] else '-',
+            'yes' if result['same'] else 'NO'))
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps({'scale': args.scale, 'seed': args.seed, 'songplays': fact_rows, 'sizes': sizes,
+                                'results': results}) + '\n')
+    if not all(result['same'] for result in results.values()):
+        raise SystemExit('the rollups and songplays disagree')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+# connection settings of sparkifydb, read from sparkify.cfg next to this file
+
+import os
+import sys
+
+# modules shared with the Warehouse and Spark projects live in common/ at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'common'))
+from connections import read_config, postgres_config
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sparkify.cfg')
+
+
+def sparkify_config(admin=False):
+    """
+    Function that returns the validated settings of sparkifydb.
+
+    Args:
+    ---------------------------------------
+        admin:      settings of the database connected to while sparkifydb
+                    is dropped and created instead
+
+    Returns:
+        PostgresConfig
+    """
+    config = postgres_config(CONFIG_FILE, 'POSTGRES')
+    if admin:
+        return config._replace(dbname=read_config(CONFIG_FILE).get('POSTGRES', 'ADMIN_DB_NAME', fallback='studentdb'))
+    return config
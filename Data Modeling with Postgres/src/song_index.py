@@ -0,0 +1,101 @@
+import pandas as pd
+from sql_queries import song_index_select
+
+
+def hash_keys(df):
+    """
+    Function that hashes the (title, artist name, duration) columns of a
+    DataFrame into one 64-bit key per row.
+
+    Args:
+    ---------------------------------------
+        df:     DataFrame whose first three columns are title, artist name
+                and duration (column names are ignored)
+
+    Returns:
+        numpy array of uint64 keys
+    """
+    return pd.util.hash_pandas_object(df.iloc[:, :3], index=False).values
+
+
+class SongIndex:
+    """
+    In-memory replacement for song_select: maps (title, artist_name, duration)
+    to (song_id, artist_id) so a whole log DataFrame is resolved with one
+    vectorized lookup instead of one query per event.
+
+    Only the 64-bit hash of the key is kept, next to the two ids. Like
+    ON CONFLICT DO NOTHING, the first song seen for a key wins.
+    """
+
+    def __init__(self):
+        self.ids = pd.DataFrame({'song_id': [], 'artist_id': []}, index=pd.Index([], dtype='uint64'))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_db(cls, cur):
+        """
+        Function that builds the index from the songs and artists already in
+        the database with a single query.
+
+        Args:
+        ---------------------------------------
+            cur:    cursor of the created database
+
+        Returns:
+            SongIndex
+        """
+        cur.execute(song_index_select)
+        rows = pd.DataFrame(cur.fetchall(), columns=['title', 'artist_name', 'duration', 'song_id', 'artist_id'])
+        index = cls()
+        index.add(rows)
+        return index
+
+    def add(self, songs, artists=None):
+        """
+        Function that adds songs to the index, e.g. after loading new song files.
+
+        Args:
+        ---------------------------------------
+            songs:      DataFrame with title, duration, song_id, artist_id and,
+                        unless artists is given, artist_name
+            artists:    optional DataFrame with artist_id and artist_name
+
+        Returns:
+        """
+        if artists is not None:
+            songs = songs.merge(artists[['artist_id', 'artist_name']].drop_duplicates('artist_id'),
+                                on='artist_id')
+        if songs.empty:
+            return
+
+        keys = hash_keys(songs[['title', 'artist_name', 'duration']])
+        new = pd.DataFrame({'song_id': songs['song_id'].values, 'artist_id': songs['artist_id'].values},
+                           index=pd.Index(keys, dtype='uint64'))
+        ids = pd.concat([self.ids, new])
+        self.ids = ids[~ids.index.duplicated(keep='first')]
+
+    def resolve(self, songplays):
+        """
+        Function that replaces the song, artist and length columns of a
+        songplays DataFrame with the matching song_id and artist_id.
+
+        Args:
+        ---------------------------------------
+            songplays:  DataFrame with ts, userId, level, song, artist, length,
+                        sessionId, itemInSession, location, userAgent columns
+
+        Returns:
+            DataFrame in the column order of songplay_table_insert; unmatched
+            events get None for song_id and artist_id
+        """
+        hits = self.ids.reindex(hash_keys(songplays[['song', 'artist', 'length']]))
+        hits = hits.astype(object).where(hits.notnull(), None)
+
+        # object columns, as pandas would otherwise infer strings and turn None into NaN
+        df = songplays.drop(columns=['song', 'artist', 'length'])
+        df.insert(3, 'song_id', pd.Series(hits['song_id'].values, index=df.index, dtype=object))
+        df.insert(4, 'artist_id', pd.Series(hits['artist_id'].values, index=df.index, dtype=object))
+        return df
@@ -1,3 +1,7 @@
+# settings puts common/ on the path, for the rollups shared with the Warehouse project
+import settings  # noqa: F401
+import rollups
+
 # DROP TABLES
 
 songplay_table_drop = ("""DROP TABLE IF EXISTS songplays""")
@@ -8,17 +12,53 @@ time_table_drop = ("""DROP TABLE IF EXISTS time""")
 
 # CREATE TABLES
 
-songplay_table_create = ("""CREATE TABLE IF NOT EXISTS songplays (songplay_id SERIAL PRIMARY KEY, \
-                        start_time TIME NOT NULL, \
+# partitioned by month of start_time, so date range queries only scan the
+# partitions they cover; the partitions are created by songplay_partitions()
+# before rows of a new month are loaded
+songplay_table_create = ("""CREATE TABLE IF NOT EXISTS songplays (songplay_id SERIAL, \
+                        start_time TIMESTAMP NOT NULL, \
                         user_id INTEGER NOT NULL REFERENCES users (user_id), \
                         level VARCHAR, \
                         song_id VARCHAR REFERENCES songs (song_id), \
                         artist_id VARCHAR REFERENCES artists (artist_id), \
                         session_id VARCHAR, \
+                        item_in_session INTEGER, \
                         location VARCHAR, \
-                        user_agent VARCHAR);""")
+                        user_agent VARCHAR, \
+                        PRIMARY KEY (songplay_id, start_time)) \
+                        PARTITION BY RANGE (start_time);""")
+
+# natural key of a songplay: the event's position in its session, so the
+# songplays of a file loaded again are dropped by ON CONFLICT DO NOTHING;
+# holds start_time, as every unique index of a partitioned table must
+songplay_event_key = ("""CREATE UNIQUE INDEX IF NOT EXISTS songplays_event_key \
+                      ON songplays (start_time, user_id, session_id, item_in_session)""")
+
+# creates the missing monthly partitions songplays_YYYY_MM covering [first_time, last_time];
+# does nothing while songplays is still the unpartitioned table of an old schema
+songplay_partition_function = ("""CREATE OR REPLACE FUNCTION songplay_partitions(first_time TIMESTAMP, last_time TIMESTAMP) \
+                              RETURNS void AS $$ \
+                              DECLARE month_start TIMESTAMP; \
+                              BEGIN \
+                                  IF (SELECT relkind FROM pg_class WHERE oid = 'songplays'::regclass) <> 'p' THEN \
+                                      RETURN; \
+                                  END IF; \
+                                  FOR month_start IN SELECT generate_series(date_trunc('month', first_time), \
+                                                                            date_trunc('month', last_time), \
+                                                                            interval '1 month') LOOP \
+                                      EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF songplays \
+                                                      FOR VALUES FROM (%L) TO (%L)', \
+                                                     'songplays_' || to_char(month_start, 'YYYY_MM'), \
+                                                     month_start, month_start + interval '1 month'); \
+                                  END LOOP; \
+                              END $$ LANGUAGE plpgsql;""")
+
+songplay_partition_function_drop = ("""DROP FUNCTION IF EXISTS songplay_partitions(TIMESTAMP, TIMESTAMP)""")
 
+# partitions for the rows of a file (row mode) or of the staging table (bulk mode)
+songplay_partitions_range = ("""SELECT songplay_partitions(%s, %s)""")
 
+songplay_partitions_stage = ("""SELECT songplay_partitions(min(start_time), max(start_time)) FROM songplays_stage""")
 
 user_table_create = ("""CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, \
                     first_name VARCHAR, \
@@ -38,7 +78,7 @@ artist_table_create = ("""CREATE TABLE IF NOT EXISTS artists (artist_id VARCHAR
                       artist_latitude VARCHAR, \
                       artist_longitude VARCHAR);""")
 
-time_table_create = ("""CREATE TABLE IF NOT EXISTS time (start_time TIME PRIMARY KEY, \
+time_table_create = ("""CREATE TABLE IF NOT EXISTS time (start_time TIMESTAMP PRIMARY KEY, \
                     hour INTEGER, \
                     day INTEGER, \
                     week INTEGER, \
@@ -49,8 +89,9 @@ time_table_create = ("""CREATE TABLE IF NOT EXISTS time (start_time TIME PRIMARY
 
 # INSERT RECORDS
 
-songplay_table_insert = ("""INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent) \
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING""")
+songplay_table_insert = ("""INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, item_in_session, \
+                        location, user_agent) \
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING""")
 
 user_table_insert = ("""INSERT INTO users (user_id, first_name, last_name, gender, level) \
                     VALUES (%s, %s, %s, %s, %s) ON CONFLICT (user_id) DO UPDATE SET \
@@ -76,7 +117,241 @@ song_select = ("""SELECT songs.song_id, artists.artist_id \
                 FROM songs join artists on songs.artist_id = artists.artist_id \
                 WHERE title=(%s) AND artist_name=(%s) AND duration=(%s)""")
 
+# every (title, artist_name, duration) key with its ids, to build the SongIndex in one round-trip
+song_index_select = ("""SELECT songs.title, artists.artist_name, songs.duration, songs.song_id, artists.artist_id \
+                      FROM songs join artists on songs.artist_id = artists.artist_id""")
+
+# BULK LOAD
+# rows are streamed with COPY into temporary staging tables, then merged with one
+# set-based statement per table; seq keeps the file order so the merges keep the
+# same "first row wins" / "last level wins" semantics as the inserts above
+
+song_stage_create = ("""CREATE TEMP TABLE IF NOT EXISTS songs_stage (seq BIGSERIAL, \
+                    song_id VARCHAR, \
+                    title VARCHAR, \
+                    artist_id VARCHAR, \
+                    year INTEGER, \
+                    duration FLOAT);""")
+
+artist_stage_create = ("""CREATE TEMP TABLE IF NOT EXISTS artists_stage (seq BIGSERIAL, \
+                      artist_id VARCHAR, \
+                      artist_name VARCHAR, \
+                      artist_location VARCHAR, \
+                      artist_latitude VARCHAR, \
+                      artist_longitude VARCHAR);""")
+
+time_stage_create = ("""CREATE TEMP TABLE IF NOT EXISTS time_stage (seq BIGSERIAL, \
+                    start_time TIMESTAMP, \
+                    hour INTEGER, \
+                    day INTEGER, \
+                    week INTEGER, \
+                    month INTEGER, \
+                    year INTEGER, \
+                    weekday INTEGER);""")
+
+user_stage_create = ("""CREATE TEMP TABLE IF NOT EXISTS users_stage (seq BIGSERIAL, \
+                    user_id INTEGER, \
+                    first_name VARCHAR, \
+                    last_name VARCHAR, \
+                    gender VARCHAR, \
+                    level VARCHAR);""")
+
+songplay_stage_create = ("""CREATE TEMP TABLE IF NOT EXISTS songplays_stage (seq BIGSERIAL, \
+                        start_time TIMESTAMP, \
+                        user_id INTEGER, \
+                        level VARCHAR, \
+                        song_id VARCHAR, \
+                        artist_id VARCHAR, \
+                        song VARCHAR, \
+                        artist VARCHAR, \
+                        length FLOAT, \
+                        session_id VARCHAR, \
+                        item_in_session INTEGER, \
+                        location VARCHAR, \
+                        user_agent VARCHAR);""")
+
+stage_copy = ("""COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')""")
+
+stage_truncate = ("""TRUNCATE {}""")
+
+song_table_merge = ("""INSERT INTO songs (song_id, title, artist_id, year, duration) \
+                    SELECT DISTINCT ON (song_id) song_id, title, artist_id, year, duration \
+                    FROM songs_stage ORDER BY song_id, seq \
+                    ON CONFLICT DO NOTHING""")
+
+artist_table_merge = ("""INSERT INTO artists (artist_id, artist_name, artist_location, artist_latitude, artist_longitude) \
+                      SELECT DISTINCT ON (artist_id) artist_id, artist_name, artist_location, artist_latitude, artist_longitude \
+                      FROM artists_stage ORDER BY artist_id, seq \
+                      ON CONFLICT DO NOTHING""")
+
+time_table_merge = ("""INSERT INTO time (start_time, hour, day, week, month, year, weekday) \
+                    SELECT DISTINCT ON (start_time) start_time, hour, day, week, month, year, weekday \
+                    FROM time_stage ORDER BY start_time, seq \
+                    ON CONFLICT DO NOTHING""")
+
+user_table_merge = ("""INSERT INTO users (user_id, first_name, last_name, gender, level) \
+                    SELECT DISTINCT ON (user_id) user_id, first_name, last_name, gender, level \
+                    FROM users_stage ORDER BY user_id, seq DESC \
+                    ON CONFLICT (user_id) DO UPDATE SET \
+                    first_name = users.first_name, \
+                    last_name = users.last_name, \
+                    gender = users.gender, \
+                    level=EXCLUDED.level""")
+
+# the partitions of the staged months are created first, in the same statement batch
+songplay_table_merge = (songplay_partitions_stage + """; INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, item_in_session, \
+                        location, user_agent) \
+                        SELECT s.start_time, s.user_id, s.level, m.song_id, m.artist_id, s.session_id, s.item_in_session, \
+                        s.location, s.user_agent \
+                        FROM songplays_stage s LEFT JOIN LATERAL \
+                            (SELECT songs.song_id, artists.artist_id \
+                             FROM songs join artists on songs.artist_id = artists.artist_id \
+                             WHERE songs.title = s.song AND artists.artist_name = s.artist AND songs.duration = s.length \
+                             LIMIT 1) m ON TRUE \
+                        ORDER BY s.seq \
+                        ON CONFLICT DO NOTHING""")
+
+# songplays whose song_id/artist_id were already resolved by the in-memory SongIndex
+songplay_table_merge_indexed = (songplay_partitions_stage + """; INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, \
+                                item_in_session, location, user_agent) \
+                                SELECT start_time, user_id, level, song_id, artist_id, session_id, item_in_session, location, \
+                                user_agent \
+                                FROM songplays_stage ORDER BY seq \
+                                ON CONFLICT DO NOTHING""")
+
+# start_times already loaded, to seed the TimeDimension in one round-trip
+time_select = ("""SELECT start_time FROM time""")
+
+# INDEXES
+
+# covering indexes of song_select and of the songplays merge: the artist is
+# found by name and the song by (title, duration), both without reading the tables
+song_lookup_index = ("""CREATE INDEX IF NOT EXISTS songs_title_duration_idx ON songs (title, duration) \
+                     INCLUDE (song_id, artist_id)""")
+
+artist_lookup_index = ("""CREATE INDEX IF NOT EXISTS artists_artist_name_idx ON artists (artist_name) \
+                       INCLUDE (artist_id)""")
+
+# indexes of the common analytics filters on songplays, created on every
+# partition; built after a load rather than maintained row by row during it
+songplay_start_time_index = ("""CREATE INDEX IF NOT EXISTS songplays_start_time_idx ON songplays (start_time)""")
+
+songplay_user_index = ("""CREATE INDEX IF NOT EXISTS songplays_user_id_idx ON songplays (user_id, start_time)""")
+
+songplay_song_index = ("""CREATE INDEX IF NOT EXISTS songplays_song_id_idx ON songplays (song_id, start_time)""")
+
+# MIGRATION of a database created before songplays was partitioned
+
+songplay_relkind = ("""SELECT relkind FROM pg_class WHERE oid = to_regclass('songplays')""")
+
+# tables whose start_time is still the TIME of the schema before TIMESTAMP; the
+# dates of those rows were never stored, so they cannot be converted
+start_time_time_tables = ("""SELECT table_name FROM information_schema.columns \
+                          WHERE table_schema = current_schema() AND table_name IN ('songplays', 'time') \
+                          AND column_name = 'start_time' AND data_type = 'time without time zone' \
+                          ORDER BY table_name""")
+
+# item_in_session is added before the copy, so the values of a table that has
+# it are kept; the old key index is renamed, as index names are per schema
+songplay_migration_queries = [
+    """ALTER TABLE songplays ADD COLUMN IF NOT EXISTS item_in_session INTEGER""",
+    """ALTER TABLE songplays RENAME TO songplays_unpartitioned""",
+    """ALTER TABLE songplays_unpartitioned RENAME CONSTRAINT songplays_pkey TO songplays_unpartitioned_pkey""",
+    """ALTER INDEX IF EXISTS songplays_event_key RENAME TO songplays_unpartitioned_event_key""",
+    songplay_table_create,
+    """SELECT songplay_partitions(min(start_time), max(start_time)) FROM songplays_unpartitioned""",
+    """INSERT INTO songplays (songplay_id, start_time, user_id, level, song_id, artist_id, session_id, \
+       item_in_session, location, user_agent) \
+       SELECT songplay_id, start_time, user_id, level, song_id, artist_id, session_id, item_in_session, location, \
+       user_agent \
+       FROM songplays_unpartitioned""",
+    """SELECT setval(pg_get_serial_sequence('songplays', 'songplay_id'), coalesce(max(songplay_id), 0) + 1, false) \
+       FROM songplays""",
+    """DROP TABLE songplays_unpartitioned"""]
+
+# songplays loaded before the natural key keep a NULL item_in_session, which
+# the key does not hold, so only the songplays loaded from now on are unique
+songplay_key_migration_queries = ["""ALTER TABLE songplays ADD COLUMN IF NOT EXISTS item_in_session INTEGER""",
+                                  songplay_event_key]
+
+# ROLLUPS
+# play counts by time bucket and dimensions (common/rollups.py), updated at the
+# end of every load from the songplays it added: rollup_watermark holds the
+# highest songplay_id each rollup has counted, and songplay_id grows with every
+# merge, as the loads merge one batch at a time
+
+rollup_table_creates = ['CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY ({}));'.format(
+    rollup.name, ', '.join('{} {}'.format(*column) for column in columns), ', '.join(primary_key))
+    for rollup in rollups.ROLLUPS for columns, primary_key in [rollups.columns(rollup)]]
+rollup_table_drops = ['DROP TABLE IF EXISTS {}'.format(rollup.name) for rollup in rollups.ROLLUPS]
+
+rollup_watermark_create = ("""CREATE TABLE IF NOT EXISTS rollup_watermark (rollup VARCHAR PRIMARY KEY, \
+                           songplay_id BIGINT NOT NULL);""")
+
+rollup_watermark_drop = ("""DROP TABLE IF EXISTS rollup_watermark""")
+
+# a new rollup starts from 0, so its first update counts every songplay
+rollup_watermark_insert = ("""INSERT INTO rollup_watermark (rollup, songplay_id) VALUES (%s, 0) \
+                           ON CONFLICT DO NOTHING""")
+
+# locked until the update commits, so two loads cannot count the same songplays
+rollup_watermark_select = ("""SELECT songplay_id FROM rollup_watermark WHERE rollup = %s FOR UPDATE""")
+
+rollup_watermark_update = ("""UPDATE rollup_watermark SET songplay_id = %s WHERE rollup = %s""")
+
+# the rollups filtered on a user or a song are read through these
+rollup_index_queries = ["""CREATE INDEX IF NOT EXISTS plays_daily_user_user_id_idx ON plays_daily_user (user_id, bucket)""",
+                        """CREATE INDEX IF NOT EXISTS plays_hourly_song_song_id_idx ON plays_hourly_song (song_id, bucket)"""]
+
+songplay_max_id = ("""SELECT coalesce(max(songplay_id), 0) FROM songplays""")
+
+# rollup name -> (UPDATE, INSERT) adding the songplays in (%(low)s, %(high)s]
+rollup_update_queries = {
+    rollup.name: rollups.update_statements(
+        rollup, 'songplays WHERE songplay_id > %(low)s AND songplay_id <= %(high)s')
+    for rollup in rollups.ROLLUPS}
+
+# rollup name -> (DELETE, INSERT) counting the songplays up to %(high)s again
+rollup_rebuild_queries = {
+    rollup.name: rollups.rebuild_statements(rollup, 'songplays WHERE songplay_id <= %(high)s')
+    for rollup in rollups.ROLLUPS}
+
 # QUERY LISTS
 
-create_table_queries = [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
+lookup_index_queries = [song_lookup_index, artist_lookup_index]
+lookup_index_drops = ["""DROP INDEX IF EXISTS songs_title_duration_idx""",
+                      """DROP INDEX IF EXISTS artists_artist_name_idx"""]
+songplay_index_queries = [songplay_start_time_index, songplay_user_index, songplay_song_index]
+songplay_index_drops = ["""DROP INDEX IF EXISTS songplays_start_time_idx""",
+                        """DROP INDEX IF EXISTS songplays_user_id_idx""",
+                        """DROP INDEX IF EXISTS songplays_song_id_idx"""]
+
+# planner statistics, refreshed after a load or a migration so the new indexes and partitions are used
+analyze_queries = ["""ANALYZE songs""", """ANALYZE artists""", """ANALYZE songplays"""]
+
+# songplays references the other tables, so it is created last
+create_table_queries = [user_table_create, song_table_create, artist_table_create, time_table_create,
+                        songplay_partition_function, songplay_table_create, songplay_event_key] + lookup_index_queries + \
+                       rollup_table_creates + rollup_index_queries + [rollup_watermark_create]
+drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop,
+                      songplay_partition_function_drop] + rollup_table_drops + [rollup_watermark_drop]
+
+# (staging table, staging create, columns copied, merge) per target table, in load order
+bulk_song_tables = [('songs_stage', song_stage_create,
+                     ['song_id', 'title', 'artist_id', 'year', 'duration'], song_table_merge),
+                    ('artists_stage', artist_stage_create,
+                     ['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude'],
+                     artist_table_merge)]
+bulk_log_tables = [('time_stage', time_stage_create,
+                    ['start_time', 'hour', 'day', 'week', 'month', 'year', 'weekday'], time_table_merge),
+                   ('users_stage', user_stage_create,
+                    ['user_id', 'first_name', 'last_name', 'gender', 'level'], user_table_merge),
+                   ('songplays_stage', songplay_stage_create,
+                    ['start_time', 'user_id', 'level', 'song', 'artist', 'length', 'session_id', 'item_in_session', 'location',
+                     'user_agent'],
+                    songplay_table_merge)]
+bulk_log_tables_indexed = bulk_log_tables[:2] + \
+                  [('songplays_stage', songplay_stage_create,
+                    ['start_time', 'user_id', 'level', 'song_id', 'artist_id', 'session_id', 'item_in_session', 'location',
+                     'user_agent'],
+                    songplay_table_merge_indexed)]
@@ -0,0 +1,76 @@
+import pandas as pd
+from sql_queries import time_select
+
+
+def _keys(values):
+    # start_times as nanoseconds, whatever unit the frame or driver gave them in
+    return values.astype('datetime64[ns]').view('int64').tolist()
+
+
+def time_rows(t):
+    """
+    Function that computes the calendar attributes of the time table for a
+    Series of timestamps in one vectorized pass, one row per distinct timestamp.
+
+    Args:
+    ---------------------------------------
+        t:      Series of datetime64 values
+
+    Returns:
+        DataFrame in the column order of time_table_insert
+    """
+    t = t.drop_duplicates()
+    return pd.DataFrame({'start_time': t.values,
+                         'hour': t.dt.hour.values,
+                         'day': t.dt.day.values,
+                         'week': t.dt.isocalendar().week.values.astype('int64'),
+                         'month': t.dt.month.values,
+                         'year': t.dt.year.values,
+                         'weekday': t.dt.weekday.values})
+
+
+class TimeDimension:
+    """
+    Set of the start_times already in the time table, so repeated timestamps
+    are dropped in the loader instead of being sent to the database for
+    ON CONFLICT DO NOTHING to discard.
+    """
+
+    def __init__(self, loaded=()):
+        self.loaded = set(loaded)
+
+    def __len__(self):
+        return len(self.loaded)
+
+    @classmethod
+    def from_db(cls, cur):
+        """
+        Function that seeds the set from the time table with a single query.
+
+        Args:
+        ---------------------------------------
+            cur:    cursor of the created database
+
+        Returns:
+            TimeDimension
+        """
+        cur.execute(time_select)
+        start_times = pd.to_datetime([row[0] for row in cur.fetchall()])
+        return cls(_keys(start_times.values))
+
+    def new_rows(self, time_df):
+        """
+        Function that keeps the rows of a time frame whose start_time has not
+        been loaded yet, and marks them as loaded.
+
+        Args:
+        ---------------------------------------
+            time_df:    DataFrame returned by time_rows()
+
+        Returns:
+            DataFrame with only the new start_times
+        """
+        keys = _keys(time_df['start_time'].values)
+        new = [key not in self.loaded for key in keys]
+        self.loaded.update(keys)
+        return time_df[new]
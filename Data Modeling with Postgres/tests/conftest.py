@@ -0,0 +1,11 @@
+# the modules under test are imported from src/ as etl.py imports them; the
+# other projects have modules of the same names, so those are forgotten first
+
+import os
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+
+for name in ('settings', 'sql_queries', 'create_tables', 'etl'):
+    sys.modules.pop(name, None)
+sys.path.insert(0, SRC)
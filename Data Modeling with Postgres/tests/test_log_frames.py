@@ -0,0 +1,37 @@
+import re
+
+import pandas as pd
+
+from etl import log_frames
+from song_index import SongIndex
+from sql_queries import songplay_table_insert, bulk_log_tables, bulk_log_tables_indexed
+
+EVENT = {'artist': 'Des\'ree', 'auth': 'Logged In', 'firstName': 'Kaylee', 'gender': 'F', 'itemInSession': 1,
+         'lastName': 'Summers', 'length': 246.30812, 'level': 'free', 'location': 'Phoenix-Mesa-Scottsdale, AZ',
+         'method': 'PUT', 'page': 'NextSong', 'registration': 1540344794796.0, 'sessionId': 139,
+         'song': 'You Gotta Be', 'status': 200, 'ts': 1541106106796, 'userAgent': 'Mozilla/5.0', 'userId': '8'}
+
+
+def _insert_columns():
+    return [column.strip() for column in re.search(r'\((.*?)\)', songplay_table_insert, re.S).group(1).split(',')]
+
+
+def test_resolved_songplays_follow_the_insert_columns():
+    songplays = SongIndex().resolve(log_frames(pd.DataFrame([EVENT]))['songplays'])
+    assert len(songplays.columns) == len(_insert_columns())
+    assert _insert_columns()[6] == 'item_in_session'
+    assert songplays.columns[6] == 'itemInSession'
+    assert songplays.iloc[0]['itemInSession'] == 1
+
+
+def test_staged_songplays_carry_the_natural_key():
+    for tables in (bulk_log_tables, bulk_log_tables_indexed):
+        stage, create, columns, merge = tables[-1]
+        assert 'item_in_session' in columns
+        assert 'item_in_session' in merge
+
+
+def test_events_without_item_in_session_are_quarantined():
+    frames = log_frames(pd.DataFrame([EVENT, dict(EVENT, itemInSession=None, ts=EVENT['ts'] + 1)]))
+    assert len(frames['songplays']) == 1
+    assert frames['quarantine']['reason'].tolist() == ['itemInSession not an id']
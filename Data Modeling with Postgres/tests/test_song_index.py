@@ -0,0 +1,41 @@
+import pandas as pd
+
+from song_index import SongIndex
+
+
+class FakeCursor:
+    # returns the rows of song_index_select: title, artist name, duration, song_id, artist_id
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+
+def _songplays(*events):
+    return pd.DataFrame([(1541105830796, '26', 'free', song, artist, length, 583, 4, 'San Jose', 'Mozilla')
+                         for song, artist, length in events],
+                        columns=['ts', 'userId', 'level', 'song', 'artist', 'length', 'sessionId',
+                                 'itemInSession', 'location', 'userAgent'])
+
+
+def test_resolve_matches_title_artist_and_duration():
+    index = SongIndex.from_db(FakeCursor([('Intro', 'The xx', 127.92118, 'SOA', 'ARA')]))
+    df = index.resolve(_songplays(('Intro', 'The xx', 127.92118), ('Intro', 'The xx', 128.0),
+                                  ('Angie', 'The xx', 127.92118)))
+    assert list(df.columns) == ['ts', 'userId', 'level', 'song_id', 'artist_id', 'sessionId', 'itemInSession',
+                                'location', 'userAgent']
+    assert df['song_id'].tolist() == ['SOA', None, None]
+    assert df['artist_id'].tolist() == ['ARA', None, None]
+
+
+def test_add_joins_artists_and_keeps_the_first_song_of_a_key():
+    index = SongIndex()
+    songs = pd.DataFrame({'title': ['Intro', 'Intro'], 'duration': [127.92118, 127.92118],
+                          'song_id': ['SOA', 'SOB'], 'artist_id': ['ARA', 'ARA']})
+    index.add(songs, pd.DataFrame({'artist_id': ['ARA'], 'artist_name': ['The xx']}))
+    assert len(index) == 1
+    assert index.resolve(_songplays(('Intro', 'The xx', 127.92118)))['song_id'].tolist() == ['SOA']
@@ -0,0 +1,44 @@
+import glob
+import os
+
+import etl
+from instrumentation import Recorder
+from sql_queries import artist_table_insert
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data')
+
+
+class FakeCursor:
+    # inserts write a row unless their statement is in conflicts; song_select finds song
+    def __init__(self, conflicts=(), song=None):
+        self.conflicts = conflicts
+        self.song = song
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        self.rowcount = 0 if query in self.conflicts else 1
+
+    def fetchone(self):
+        return self.song
+
+
+def _recorded(monkeypatch, process, filepath, cur):
+    recorder = Recorder(enabled=True)
+    monkeypatch.setattr(etl, 'stage', recorder.stage)
+    process(cur, filepath)
+    return recorder.totals
+
+
+def test_song_insert_counts_the_rows_written(monkeypatch):
+    filepath = sorted(glob.glob(os.path.join(DATA, 'song_data', '*', '*', '*', '*.json')))[0]
+    totals = _recorded(monkeypatch, etl.process_song_file, filepath, FakeCursor([artist_table_insert]))
+    assert (totals['insert']['rows_in'], totals['insert']['rows_out']) == (2, 1)
+
+
+def test_song_select_counts_the_songs_found(monkeypatch):
+    filepath = sorted(glob.glob(os.path.join(DATA, 'log_data', '*', '*', '*.json')))[0]
+    for song, found in ((None, 0), (('SOA', 'ARA'), 1)):
+        totals = _recorded(monkeypatch, etl.process_log_file, filepath, FakeCursor(song=song))
+        assert totals['song_select']['calls'] > 0
+        assert totals['song_select']['rows_out'] == found * totals['song_select']['calls']
+        assert totals['insert']['rows_out'] == totals['insert']['rows_in']
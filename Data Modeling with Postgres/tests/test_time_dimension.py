@@ -0,0 +1,44 @@
+from datetime import datetime
+
+import pandas as pd
+
+from time_dimension import TimeDimension, time_rows
+
+
+class FakeCursor:
+    # returns the start_times of the time table as the driver does, as datetimes
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_time_rows_one_row_per_timestamp():
+    t = pd.to_datetime(pd.Series([1541105830796, 1541105830796, 1541106106796]), unit='ms')
+    df = time_rows(t)
+    assert len(df) == 2
+    assert list(df.columns) == ['start_time', 'hour', 'day', 'week', 'month', 'year', 'weekday']
+    assert df.iloc[0][['hour', 'day', 'week', 'month', 'year', 'weekday']].tolist() == [20, 1, 44, 11, 2018, 3]
+
+
+def test_new_rows_drops_start_times_loaded_by_earlier_runs():
+    ts = [1541105830796, 1541106106796]
+    db = [(datetime(2018, 11, 1, 20, 57, 10, 796000),)]
+    times = TimeDimension.from_db(FakeCursor(db))
+    assert len(times) == 1
+
+    df = time_rows(pd.to_datetime(pd.Series(ts), unit='ms'))
+    new = times.new_rows(df)
+    assert new['start_time'].tolist() == [pd.Timestamp(ts[1], unit='ms')]
+    assert len(times) == 2
+
+
+def test_new_rows_marks_rows_as_loaded():
+    times = TimeDimension()
+    df = time_rows(pd.to_datetime(pd.Series([1541105830796]), unit='ms'))
+    assert len(times.new_rows(df)) == 1
+    assert len(times.new_rows(df)) == 0
@@ -0,0 +1,69 @@
+# run times of the analytics queries against the star schema, on Redshift or on
+# a local Postgres created with DIALECT=postgres, appended to a JSON lines file
+# so layouts can be compared across runs
+
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+from sql_queries import analytics_queries
+from settings import DIALECT, warehouse_config
+from connections import postgres_connection
+
+
+def time_query(cur, query, repeat):
+    """
+    Function that runs a query repeat times, fetching every row.
+
+    Returns:
+        (list of run times in seconds, number of rows)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cur.execute(query)
+        rows = len(cur.fetchall())
+        times.append(time.perf_counter() - start)
+    return times, rows
+
+
+def main():
+    """
+    Main function runs every analytics query (after one warm-up run), prints
+    the median and best run times and appends them to the results file.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the analytics queries.')
+    parser.add_argument('--dsn', default=None,
+                        help='connection string, e.g. of a local Postgres; [CLUSTER] of dwh.cfg by default')
+    parser.add_argument('--queries', nargs='+', choices=sorted(analytics_queries), default=sorted(analytics_queries))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--label', default='', help='name of the layout being measured')
+    parser.add_argument('--results', default='benchmark_queries.jsonl')
+    parser.add_argument('--explain', action='store_true', help='print the plan of every query')
+    args = parser.parse_args()
+
+    with postgres_connection(warehouse_config(args.dsn), autocommit=True) as conn:
+        cur = conn.cursor()
+        if DIALECT == 'redshift':
+            # repeated runs would otherwise be answered from the result cache
+            cur.execute('SET enable_result_cache_for_session TO off')
+
+        run_at = datetime.now(timezone.utc).isoformat()
+        print('{:<26}{:>8}{:>12}{:>12}'.format('query', 'rows', 'median s', 'best s'))
+        with open(args.results, 'a') as results:
+            for name in args.queries:
+                query = analytics_queries[name]
+                if args.explain:
+                    cur.execute('EXPLAIN ' + query)
+                    print('\n'.join(row[0] for row in cur.fetchall()))
+                time_query(cur, query, 1)
+                times, rows = time_query(cur, query, args.repeat)
+                median = sorted(times)[len(times) // 2]
+                print('{:<26}{:>8}{:>12.4f}{:>12.4f}'.format(name, rows, median, min(times)))
+                results.write(json.dumps({'run_at': run_at, 'dialect': DIALECT, 'label': args.label, 'query': name,
+                                          'rows': rows, 'median_s': median, 'best_s': min(times),
+                                          'times_s': times}) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 # create the fact and dimension tables for the star schema in Redshift
 
-import configparser
+import argparse
 import psycopg2
 from sql_queries import create_table_queries, drop_table_queries
+from settings import warehouse_config
+from connections import postgres_connection
 
 
 def drop_tables(cur, conn):
@@ -46,18 +48,21 @@ def create_tables(cur, conn):
 def main():
     """
     Main funciton connects to the Redshift database, drop existing and creat new tables.
+    With --incremental existing tables and the etl_manifest are kept.
     """
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
+    parser = argparse.ArgumentParser(description='Create the Redshift staging and star schema tables.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='keep existing tables, only create missing ones')
+    parser.add_argument('--dsn', default=None,
+                        help='connection string, e.g. of a local Postgres; [CLUSTER] of dwh.cfg by default')
+    args = parser.parse_args()
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} \
-                             port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
+    with postgres_connection(warehouse_config(args.dsn)) as conn:
+        cur = conn.cursor()
 
-    drop_tables(cur, conn)
-    create_tables(cur, conn)
-
-    conn.close()
+        if not args.incremental:
+            drop_tables(cur, conn)
+        create_tables(cur, conn)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+# run SQL statements as a dependency graph: every statement whose dependencies
+# have completed runs at once, each on its own connection from a pool
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from instrumentation import stage
+
+
+class StepFailed(Exception):
+    """
+    Raised when a statement fails; the statements still running are cancelled
+    and the ones not started yet are skipped.
+    """
+
+    def __init__(self, name, error):
+        super().__init__('{} failed: {}'.format(name, error))
+        self.name = name
+        self.error = error
+
+
+def topological_order(steps):
+    """
+    Function that checks the dependencies of the steps and orders them.
+
+    Args:
+    ------------------------------------
+        steps:  dict of name -> (query, list of names it depends on)
+
+    Returns:
+        list of names, every step after its dependencies
+    """
+    order = []
+    state = {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError('cycle in steps: {}'.format(' -> '.join(path + [name])))
+        state[name] = 'visiting'
+        for dependency in steps[name][1]:
+            if dependency not in steps:
+                raise ValueError('{} depends on unknown step {}'.format(name, dependency))
+            visit(dependency, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for name in steps:
+        visit(name, [])
+    return order
+
+
+class DagRunner:
+    """
+    Runs the steps over a connection pool. Each statement is its own
+    transaction, committed when it succeeds, so a failure leaves the steps
+    already completed in place.
+    """
+
+    def __init__(self, pool, workers=4):
+        self.pool = pool
+        self.workers = workers
+        self.running = {}
+        self.lock = threading.Lock()
+
+    def _execute(self, name, query):
+        conn = self.pool.getconn()
+        broken = False
+        with self.lock:
+            self.running[name] = conn
+        try:
+            start = time.perf_counter()
+            with stage(name) as timed, conn.cursor() as cur:
+                if callable(query):
+                    query(cur)
+                else:
+                    cur.execute(query)
+                timed.add(rows_out=max(cur.rowcount, 0))
+            with stage('commit'):
+                conn.commit()
+            return time.perf_counter() - start
+        except Exception:
+            # the error of the statement is raised, not the one of a rollback
+            # on a connection the server closed
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            with self.lock:
+                del self.running[name]
+            # a broken connection is closed instead of lent to the next step
+            self.pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def _cancel_running(self):
+        with self.lock:
+            for conn in self.running.values():
+                conn.cancel()
+
+    def run(self, steps):
+        """
+        Function that runs the steps, starting each one as soon as all of its
+        dependencies have completed.
+
+        Args:
+        ------------------------------------
+            steps:  dict of name -> (query, list of names it depends on); a
+                    query may also be a function of the cursor
+
+        Returns:
+            dict of name -> wall time in seconds, in completion order
+        """
+        topological_order(steps)
+        waiting = {name: set(dependencies) for name, (query, dependencies) in steps.items()}
+        timings = {}
+        futures = {}
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            while waiting or futures:
+                for name in [name for name, dependencies in waiting.items() if not dependencies]:
+                    del waiting[name]
+                    futures[executor.submit(self._execute, name, steps[name][0])] = name
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures.pop(future)
+                    try:
+                        timings[name] = future.result()
+                    except Exception as e:
+                        self._cancel_running()
+                        for other in futures:
+                            other.cancel()
+                        raise StepFailed(name, e) from e
+                    print('{:<20}{:>10.2f} s'.format(name, timings[name]))
+                    for dependencies in waiting.values():
+                        dependencies.discard(name)
+        return timings
@@ -1,70 +1,241 @@
-# load data from S3 into staging tables on Redshift 
+# load data from S3 into staging tables on Redshift
 # process that data into your analytics tables on Redshift
 
-import configparser
-import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+import time
+import argparse
+from sql_queries import etl_steps, merge_etl_steps, quarantine_tables, quarantine_queries, rollup_rebuild_queries, \
+    staging_truncate, reference_queries
+from dag_runner import DagRunner, StepFailed
+from settings import config, warehouse_config
+from connections import postgres_pool
+import quality
+from instrumentation import add_arguments, configure_from_args
+from prestage import FORMATS, strip_quotes, prestage, copy_statement, load_local, list_input, write_manifest
 
 
-def load_staging_tables(cur, conn):
+def select_steps(steps, skip=()):
     """
-    Tables defines in the sql_queries.py loaded into Amazon Redshift database.
-    
+    Steps defined in the sql_queries.py without the skipped ones, e.g. the
+    COPY statements when the staging tables were loaded by other means.
+
+    Args:
+    -------------------------------------
+        steps: dict of name -> (query, dependencies)
+        skip:  names of the steps to leave out
+
+    return: dict of name -> (query, dependencies)
+    """
+    unknown = set(skip) - set(steps)
+    if unknown:
+        raise ValueError('unknown steps: {}'.format(', '.join(sorted(unknown))))
+    return {name: (query, [dependency for dependency in dependencies if dependency not in skip])
+            for name, (query, dependencies) in steps.items() if name not in skip}
+
+
+def staging_steps(args):
+    """
+    COPY steps of the staging tables, generated at run time. Without
+    --prestage they load the S3 prefixes of dwh.cfg directly; with it the
+    input is listed (and coalesced) first and loaded through a manifest, or
+    with --local, loaded from a local manifest by COPY FROM STDIN. Every
+    step empties its staging table first.
+
+    Args:
+    -------------------------------------
+        args:   parsed command line
+
+    return: dict of name -> (query, dependencies)
+    """
+    sources = {'staging_events': args.log_data or strip_quotes(config['S3']['LOG_DATA']),
+               'staging_songs': args.song_data or strip_quotes(config['S3']['SONG_DATA'])}
+    jsonpaths = {'staging_events': strip_quotes(config['S3']['LOG_JSONPATH']),
+                 'staging_songs': 'auto'}
+    iam_role = strip_quotes(config['IAM_ROLE'].get('ARN', ''))
+    region = strip_quotes(config['S3'].get('REGION', '')) or None
+
+    steps = {}
+    for table, source in sources.items():
+        if table in args.skip:
+            # left out by select_steps, nothing to list or coalesce
+            steps[table] = (None, [])
+        elif args.cache is not None:
+            steps[table] = truncated(table, cached_step(table, args, iam_role, region))
+        elif args.prestage is None:
+            steps[table] = truncated(table, (copy_statement(table, source, iam_role, region,
+                                                            jsonpath=jsonpaths[table]), []))
+        else:
+            steps[table] = truncated(table, prestaged_step(table, source, args, iam_role, region, jsonpaths[table]))
+    return steps
+
+
+def truncated(table, step):
+    """
+    Step emptying a staging table before loading it, so the rows of earlier
+    runs are not merged again with the new ones.
+
+    Args:
+    -------------------------------------
+        table:  staging_events or staging_songs
+        step:   (query or function of the cursor, dependencies) loading it
+
+    return: (query or function of the cursor, dependencies)
+    """
+    query, dependencies = step
+    if not callable(query):
+        return staging_truncate.format(table) + '\n' + query, dependencies
+
+    def run(cur):
+        cur.execute(staging_truncate.format(table))
+        query(cur)
+
+    return run, dependencies
+
+
+def quarantine_step(table):
+    """
+    Step moving the staged rows of a table that break the data-quality rules
+    of common/quality.py to its quarantine table, counting the rows breaking
+    each rule, so the star schema is only loaded from good rows.
+
     Args:
     -------------------------------------
-        cur:  database cursor
-        conn: database connection
-        
-    return: 
+        table:  staging_events or staging_songs
+
+    return: (function of the cursor, dependencies)
     """
-    for query in copy_table_queries:
-        try:
-            cur.execute(query)
-            conn.commit()
-            
-        except psycopg2.Error as e:
-            print(e)
+    count, insert, delete = quarantine_queries[table]
+    rules = quality.RULES[quarantine_tables[table][1]]
+
+    def run(cur):
+        cur.execute(count)
+        counts = {rule.name: n for rule, n in zip(rules, cur.fetchone()) if n}
+        cur.execute(insert)
+        cur.execute(delete)
+        quality.count(counts, max(cur.rowcount, 0))
 
+    return run, [table]
 
-def insert_tables(cur, conn):
+
+def reference_step(load):
     """
-    Tables defined in the sql_queries.py are inserted from the staging tables
-    into the existing star schema tables in the redshift database.
-    
+    Step counting the songplays of the run whose user, song or artist is not
+    in its dimension. Redshift does not enforce foreign keys, so the counts
+    are reported with the quarantine's, as rules; the rows stay loaded.
+
     Args:
     -------------------------------------
-        cur:  database cursor
-        conn: database connection
-        
-    return: 
+        load:   merge or append
+
+    return: (function of the cursor, dependencies)
+    """
+    query, names = reference_queries[load]
+
+    def run(cur):
+        cur.execute(query)
+        quality.count({name: n for name, n in zip(names, cur.fetchone()) if n})
+
+    return run, ['fact_songplay', 'dim_users', 'dim_songs', 'dim_artists']
+
+
+def prestaged_step(table, source, args, iam_role, region, jsonpath):
+    """
+    Pre-stage one input and return the step loading its manifest.
+
+    return: (query, dependencies)
+    """
+    start = time.perf_counter()
+    manifest, files = prestage(source, args.prestage, table, args.coalesce, args.slices,
+                               args.chunk_mb * 1024 * 1024)
+    print('{:<20}{:>10.2f} s pre-stage, {} files'.format(table, time.perf_counter() - start, files))
+    if args.local:
+        return load_local(table, manifest, args.coalesce), []
+    return copy_statement(table, manifest, iam_role, region, manifest=True, fmt=args.coalesce,
+                          jsonpath=jsonpath), []
+
+
+def cached_step(table, args, iam_role, region):
+    """
+    Write a manifest of the Parquet files of the staging cache
+    (common/staging_cache.py) and return the step loading it. The cache files
+    have the columns of the staging tables in order, as COPY ... PARQUET needs.
+
+    return: (query, dependencies)
     """
-    for query in insert_table_queries:
-        try:
-            cur.execute(query)
-            conn.commit()
-            
-        except psycopg2.Error as e:
-            print(e)
+    dataset = 'log_data' if table == 'staging_events' else 'song_data'
+    files = list_input('{}/{}'.format(args.cache.rstrip('/'), dataset), '.parquet')
+    manifest = write_manifest(files, '{}/{}.manifest'.format(args.cache.rstrip('/'), table))
+    print('{}: {} cached files in {}'.format(table, len(files), manifest))
+    if args.local:
+        return load_local(table, manifest, 'parquet'), []
+    return copy_statement(table, manifest, iam_role, region, manifest=True, fmt='parquet'), []
 
 
 def main():
     """
-    Main function connects to the redshift database/cluster
+    Main function connects to the redshift database/cluster, then
     load staging tables
     insert existing tables from the staging tables
+    as a dependency graph, independent statements running concurrently.
+    The run stops at the first failing statement.
     """
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
+    parser = argparse.ArgumentParser(description='Load the staging and star schema tables.')
+    parser.add_argument('--workers', type=int, default=4, help='statements run at once')
+    parser.add_argument('--load', choices=['merge', 'append'], default='merge',
+                        help='merge: rerunnable, deduplicated loads; append: plain INSERT ... SELECT DISTINCT')
+    parser.add_argument('--dsn', default=None,
+                        help='connection string, e.g. of a local Postgres; [CLUSTER] of dwh.cfg by default')
+    parser.add_argument('--skip', nargs='+',
+                        choices=sorted(merge_etl_steps) + sorted(quarantine_tables) + ['references'] +
+                        sorted(quarantine for quarantine, dataset in quarantine_tables.values()),
+                        default=[], help='steps to leave out, e.g. staging_events staging_songs')
+    parser.add_argument('--prestage', default=None,
+                        help='s3:// prefix or directory: list the input, write COPY manifests there and load from them')
+    parser.add_argument('--coalesce', choices=FORMATS, default='json',
+                        help='with --prestage, merge the small input files into gzip or parquet chunks')
+    parser.add_argument('--slices', type=int, default=4, help='slices of the cluster; chunks come in multiples of it')
+    parser.add_argument('--chunk-mb', type=int, default=128, help='target uncompressed size of a chunk')
+    parser.add_argument('--song-data', default=None, help='[S3] SONG_DATA of dwh.cfg by default')
+    parser.add_argument('--log-data', default=None, help='[S3] LOG_DATA of dwh.cfg by default')
+    parser.add_argument('--cache', default=None,
+                        help='s3:// prefix or directory of the Parquet staging cache to load instead of the JSON')
+    parser.add_argument('--local', action='store_true',
+                        help='load the pre-staged manifests with COPY FROM STDIN, e.g. into a local Postgres')
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help='count every songplay into the rollups again, e.g. after --load append runs, '
+                             'which do not update them')
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.local and args.prestage is None and args.cache is None:
+        parser.error('--local needs --prestage or --cache')
+    if args.prestage is not None and args.cache is not None:
+        parser.error('--prestage and --cache are alternatives')
+    configure_from_args('warehouse_etl', args)
+    quality.configure()
+
+    steps = dict(merge_etl_steps if args.load == 'merge' else etl_steps)
+    steps.update({quarantine: quarantine_step(table) for table, (quarantine, dataset) in quarantine_tables.items()})
+    steps['references'] = reference_step(args.load)
+    if args.rebuild_rollups:
+        steps['rollups'] = (rollup_rebuild_queries, ['fact_songplay', 'references'])
+
+    # checked before anything is pre-staged; the staging tables are the keys of quarantine_tables
+    unknown = set(args.skip) - set(steps) - set(quarantine_tables)
+    if unknown:
+        parser.error('--skip {}: no such step with --load {}'.format(', '.join(sorted(unknown)), args.load))
+    steps = dict(staging_steps(args), **steps)
+
+    pool = postgres_pool(warehouse_config(args.dsn), args.workers)
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} \
-                            port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
-    
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
+    start = time.perf_counter()
+    try:
+        timings = DagRunner(pool, args.workers).run(select_steps(steps, args.skip))
+    except StepFailed as e:
+        print(e)
+        raise SystemExit(1)
 
-    conn.close()
+    print('{} statements in {:.2f} s ({:.2f} s of statement time)'.format(
+        len(timings), time.perf_counter() - start, sum(timings.values())))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,322 @@
+# pre-stage the raw JSON for COPY: list the input (S3 prefix or local directory),
+# optionally coalesce the small files into gzip'd JSON or Parquet chunks, one
+# or more per slice, and write the COPY manifest naming them. The COPY
+# statements are generated at run time from the manifest; load_local() is the
+# local Postgres stand-in for COPY ... MANIFEST
+
+import io
+import os
+import csv
+import gzip
+import json
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sql_queries import staging_columns, staging_copy, staging_copy_json, staging_copy_parquet, staging_copy_stdin
+from instrumentation import stage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for --coalesce parquet
+    pa = None
+
+try:
+    import boto3
+except ImportError:  # only needed for s3:// locations
+    boto3 = None
+
+
+FORMATS = ['json', 'gzip', 'parquet']
+
+PARQUET_TYPES = {'TEXT': 'string', 'INT': 'int32', 'BIGINT': 'int64', 'FLOAT': 'float64'}
+
+
+def strip_quotes(value):
+    """
+    Function that removes the quotes around a dwh.cfg value.
+    """
+    return value.strip().strip("'\"")
+
+
+def split_s3(url):
+    """
+    Function that splits s3://bucket/key into (bucket, key).
+    """
+    bucket, _, key = url[len('s3://'):].partition('/')
+    return bucket, key
+
+
+_client = []
+_client_lock = threading.Lock()
+
+
+def _s3():
+    # one client shared by the chunk writers; creating clients is not thread safe
+    if boto3 is None:
+        raise RuntimeError('boto3 is required for s3:// locations')
+    with _client_lock:
+        if not _client:
+            _client.append(boto3.client('s3'))
+    return _client[0]
+
+
+def list_input(source, extension='.json'):
+    """
+    Function that lists the input files under an S3 prefix or a local directory.
+
+    Args:
+    ------------------------------------
+        source:     s3://bucket/prefix or a directory
+        extension:  of the files to list, e.g. .parquet for the staging cache
+
+    Returns:
+        sorted list of (url, size in bytes)
+    """
+    files = []
+    with stage('discover') as timed:
+        if source.startswith('s3://'):
+            bucket, prefix = split_s3(source)
+            for page in _s3().get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+                files.extend(('s3://{}/{}'.format(bucket, item['Key']), item['Size'])
+                             for item in page.get('Contents', []) if item['Key'].endswith(extension))
+        else:
+            for root, dirs, names in os.walk(source):
+                files.extend((os.path.abspath(os.path.join(root, name)), os.path.getsize(os.path.join(root, name)))
+                             for name in names if name.endswith(extension))
+        timed.add(rows_out=len(files))
+    return sorted(files)
+
+
+def read_bytes(url):
+    """
+    Function that reads a whole S3 object or local file.
+    """
+    if url.startswith('s3://'):
+        bucket, key = split_s3(url)
+        return _s3().get_object(Bucket=bucket, Key=key)['Body'].read()
+    with open(url, 'rb') as f:
+        return f.read()
+
+
+def write_bytes(url, data):
+    """
+    Function that writes an S3 object or local file.
+    """
+    if url.startswith('s3://'):
+        bucket, key = split_s3(url)
+        _s3().put_object(Bucket=bucket, Key=key, Body=data)
+        return
+    os.makedirs(os.path.dirname(url) or '.', exist_ok=True)
+    with open(url, 'wb') as f:
+        f.write(data)
+
+
+def iter_objects(data):
+    """
+    Function that yields the JSON objects of a file, whether they are one per
+    line or concatenated.
+    """
+    text = data.decode('utf8')
+    decoder = json.JSONDecoder()
+    position = 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position == len(text):
+            return
+        record, position = decoder.raw_decode(text, position)
+        yield record
+
+
+def project(records, columns):
+    """
+    Function that maps JSON records to the staging columns, matching names
+    case-insensitively as COPY ... JSON 'auto' does.
+
+    Returns:
+        list of row tuples
+    """
+    names = [name.lower() for name, kind in columns]
+    rows = []
+    for record in records:
+        record = {key.lower(): value for key, value in record.items()}
+        rows.append(tuple(record.get(name) for name in names))
+    return rows
+
+
+def plan_chunks(files, slices, chunk_bytes):
+    """
+    Function that groups the input files into chunks of similar size. The
+    number of chunks is a multiple of the number of slices, so every slice
+    loads the same amount of data, except with fewer files than slices:
+    files are not split, so there is one chunk per file and some slices
+    get none.
+
+    Args:
+    ------------------------------------
+        files:        list of (url, size)
+        slices:       number of slices of the cluster
+        chunk_bytes:  target uncompressed size of a chunk
+
+    Returns:
+        list of lists of urls
+    """
+    total = sum(size for url, size in files)
+    count = slices * max(1, -(-total // (chunk_bytes * slices)))
+    # no more chunks than files, still a multiple of the slices where there are enough
+    count = min(count, len(files) // slices * slices or len(files))
+    # largest files first, each into the smallest chunk so far
+    heap = [(0, index) for index in range(count)]
+    chunks = [[] for _ in range(count)]
+    for url, size in sorted(files, key=lambda item: -item[1]):
+        used, index = heapq.heappop(heap)
+        chunks[index].append(url)
+        heapq.heappush(heap, (used + size, index))
+    return [sorted(chunk) for chunk in chunks if chunk]
+
+
+def write_chunk(urls, dest, table, fmt):
+    """
+    Function that concatenates input files into one gzip'd JSON or Parquet
+    chunk.
+
+    Returns:
+        (url of the chunk, size in bytes)
+    """
+    with stage('read') as timed:
+        data = [read_bytes(url) for url in urls]
+        timed.add(rows_out=len(data), bytes_read=sum(len(part) for part in data))
+    with stage('coalesce', rows_in=len(data)):
+        body = encode_chunk(data, table, fmt)
+    write_bytes(dest, body)
+    return dest, len(body)
+
+
+def encode_chunk(data, table, fmt):
+    """
+    Function that encodes the contents of input files as one gzip'd JSON or
+    Parquet chunk.
+    """
+    if fmt == 'parquet':
+        if pa is None:
+            raise RuntimeError('pyarrow is required for Parquet chunks')
+        columns = staging_columns[table]
+        rows = project((record for part in data for record in iter_objects(part)), columns)
+        schema = pa.schema([(name.lower(), PARQUET_TYPES[kind]) for name, kind in columns])
+        arrays = [pa.array([row[i] for row in rows], type=schema.field(i).type) for i in range(len(columns))]
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_arrays(arrays, schema=schema), buffer, compression='snappy')
+        body = buffer.getvalue()
+    else:
+        body = gzip.compress(b'\n'.join(part.rstrip() for part in data) + b'\n')
+    return body
+
+
+def write_manifest(files, url):
+    """
+    Function that writes a COPY manifest listing the files to load. The
+    content length is included, as Parquet loads require it.
+
+    Returns:
+        url of the manifest
+    """
+    entries = [{'url': path, 'mandatory': True, 'meta': {'content_length': size}} for path, size in files]
+    write_bytes(url, json.dumps({'entries': entries}, indent=1).encode('utf8'))
+    return url
+
+
+def prestage(source, dest, table, fmt='json', slices=4, chunk_bytes=128 * 1024 * 1024, workers=8):
+    """
+    Function that pre-stages one input for COPY.
+
+    Args:
+    ------------------------------------
+        source:       s3:// prefix or directory of the raw JSON
+        dest:         s3:// prefix or directory for the chunks and the manifest
+        table:        staging table the input is loaded into
+        fmt:          'json' lists the input files as they are, 'gzip' or
+                      'parquet' coalesce them into chunks
+        slices:       number of slices of the cluster
+        chunk_bytes:  target uncompressed size of a chunk
+        workers:      chunks written at once
+
+    Returns:
+        (manifest url, number of files listed in it)
+    """
+    # rows_in counts the input files, rows_out the files of the manifest
+    with stage('prestage {}'.format(table)) as timed:
+        files = list_input(source)
+        timed.add(rows_in=len(files))
+        if fmt != 'json':
+            extension = '.parquet' if fmt == 'parquet' else '.json.gz'
+            chunks = plan_chunks(files, slices, chunk_bytes)
+            targets = ['{}/{}/part-{:05d}{}'.format(dest.rstrip('/'), table, index, extension)
+                       for index in range(len(chunks))]
+            with ThreadPoolExecutor(workers) as executor:
+                files = list(executor.map(lambda args: write_chunk(*args, table, fmt), zip(chunks, targets)))
+        manifest = write_manifest(files, '{}/{}.manifest'.format(dest.rstrip('/'), table))
+        timed.add(rows_out=len(files))
+    return manifest, len(files)
+
+
+def copy_statement(table, source, iam_role, region=None, manifest=False, fmt='json', jsonpath='auto'):
+    """
+    Function that generates the COPY statement of a staging table.
+
+    Args:
+    ------------------------------------
+        table:     staging table
+        source:    s3:// prefix, or url of a manifest
+        iam_role:  ARN of the role reading the bucket
+        region:    region of the bucket; the cluster's region when empty
+        manifest:  whether source is a manifest
+        fmt:       'json', 'gzip' or 'parquet'
+        jsonpath:  'auto' or the url of a JSONPaths file
+
+    Returns:
+        SQL string
+    """
+    if fmt == 'parquet':
+        format_clause = staging_copy_parquet
+    else:
+        format_clause = staging_copy_json.format(jsonpath, 'GZIP ' if fmt == 'gzip' else '')
+    return staging_copy.format(table, source, iam_role,
+                               "region '{}' ".format(region) if region else '',
+                               'MANIFEST ' if manifest else '', format_clause)
+
+
+def load_local(table, manifest, fmt='json'):
+    """
+    Function that returns a step loading the files of a local manifest into a
+    staging table with COPY FROM STDIN, standing in for COPY ... MANIFEST.
+
+    Returns:
+        function of a cursor
+    """
+    columns = staging_columns[table]
+
+    def load(cur):
+        with open(manifest) as f:
+            entries = json.load(f)['entries']
+        for entry in entries:
+            with stage('parse') as timed:
+                data = read_bytes(entry['url'])
+                timed.add(bytes_read=len(data))
+                if fmt == 'parquet':
+                    if pa is None:
+                        raise RuntimeError('pyarrow is required for Parquet chunks')
+                    rows = [tuple(row.values()) for row in pq.read_table(io.BytesIO(data)).to_pylist()]
+                else:
+                    if fmt == 'gzip':
+                        data = gzip.decompress(data)
+                    rows = project(iter_objects(data), columns)
+                timed.add(rows_out=len(rows))
+            with stage('copy', rows_in=len(rows)) as timed:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                buffer.seek(0)
+                cur.copy_expert(staging_copy_stdin.format(table, ', '.join(name for name, kind in columns)), buffer)
+                timed.add(rows_out=max(cur.rowcount, 0))
+
+    return load
@@ -0,0 +1,31 @@
+# settings of the warehouse, read once from dwh.cfg and validated
+
+import os
+import sys
+
+# modules shared with the Postgres and Cassandra projects live in common/ at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'common'))
+from connections import ConfigError, read_config, postgres_config
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dwh.cfg')
+
+config = read_config(CONFIG_FILE)
+
+# redshift, or postgres for a local stand-in
+DIALECT = config.get('ETL', 'DIALECT', fallback='redshift').strip().lower()
+if DIALECT not in ('redshift', 'postgres'):
+    raise ConfigError('{} [ETL] DIALECT must be redshift or postgres, not {!r}'.format(CONFIG_FILE, DIALECT))
+
+
+def warehouse_config(dsn=None):
+    """
+    Function that returns the validated connection settings of the cluster.
+
+    Args:
+    ------------------------------------
+        dsn:  connection string replacing [CLUSTER], e.g. of a local Postgres
+
+    Returns:
+        PostgresConfig
+    """
+    return postgres_config(CONFIG_FILE, 'CLUSTER', dsn=dsn)
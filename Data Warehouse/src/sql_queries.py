@@ -1,12 +1,21 @@
 # define the SQL statements, which will be imported into the 
 # create_table.py and etl.py files
 
-import configparser
+from settings import DIALECT
+from table_layout import read_layout, table_create
+import quality
+import rollups
 
 
 # CONFIG
-config = configparser.ConfigParser()
-config.read('dwh.cfg')
+# the identity column and the physical layout of the tables differ between
+# redshift and postgres. Postgres gets a serial, since identity columns are
+# not supported on partitioned tables before Postgres 17
+IDENTITY = {'redshift': 'BIGINT IDENTITY(0, 1)',
+            'postgres': 'BIGSERIAL'}[DIALECT]
+
+NOW = {'redshift': 'GETDATE()',
+       'postgres': 'now()'}[DIALECT]
 
 # DROP TABLES
 
@@ -17,113 +26,124 @@ user_table_drop = "DROP TABLE IF EXISTS dim_users"
 song_table_drop = "DROP TABLE IF EXISTS dim_songs"
 artist_table_drop = "DROP TABLE IF EXISTS dim_artists"
 time_table_drop = "DROP TABLE IF EXISTS dim_time"
+# processed-files manifest (common/manifest.py), dropped with the tables it describes
+manifest_table_drop = "DROP TABLE IF EXISTS etl_manifest"
+quarantine_events_table_drop = "DROP TABLE IF EXISTS quarantine_events"
+quarantine_songs_table_drop = "DROP TABLE IF EXISTS quarantine_songs"
+songplay_delta_table_drop = "DROP TABLE IF EXISTS songplay_delta"
+rollup_table_drops = ["DROP TABLE IF EXISTS {}".format(rollup.name) for rollup in rollups.ROLLUPS]
 
 # CREATE STAGING TABLES
 
 
-staging_events_table_create= ("""CREATE TABLE IF NOT EXISTS staging_events (artist TEXT, \
-                                 auth            TEXT, \
-                                 firstName       TEXT, \
-                                 gender          TEXT, \
-                                 itemInSession   INT, \
-                                 lastName        TEXT, \
-                                 length          FLOAT, \
-                                 level           TEXT, \
-                                 location        TEXT, \
-                                 method          TEXT, \
-                                 page            TEXT, \
-                                 registration    FLOAT, \
-                                 sessionId       INT, \
-                                 song            TEXT, \
-                                 status          INT, \
-                                 ts              BIGINT, \
-                                 userAgent       TEXT, \
-                                 userId          TEXT);
-""")
+# (name, type) columns in the order of the COPY column mapping; pre-staged
+# Parquet chunks (prestage.py) are written with the same columns
+staging_columns = {'staging_events': [('artist', 'TEXT'),
+                                      ('auth', 'TEXT'),
+                                      ('firstName', 'TEXT'),
+                                      ('gender', 'TEXT'),
+                                      ('itemInSession', 'INT'),
+                                      ('lastName', 'TEXT'),
+                                      ('length', 'FLOAT'),
+                                      ('level', 'TEXT'),
+                                      ('location', 'TEXT'),
+                                      ('method', 'TEXT'),
+                                      ('page', 'TEXT'),
+                                      ('registration', 'FLOAT'),
+                                      ('sessionId', 'INT'),
+                                      ('song', 'TEXT'),
+                                      ('status', 'INT'),
+                                      ('ts', 'BIGINT'),
+                                      ('userAgent', 'TEXT'),
+                                      ('userId', 'TEXT')],
+                   'staging_songs': [('num_songs', 'INT'),
+                                     ('artist_id', 'TEXT'),
+                                     ('artist_latitude', 'FLOAT'),
+                                     ('artist_longitude', 'FLOAT'),
+                                     ('artist_location', 'TEXT'),
+                                     ('artist_name', 'TEXT'),
+                                     ('song_id', 'TEXT'),
+                                     ('title', 'TEXT'),
+                                     ('duration', 'FLOAT'),
+                                     ('year', 'INT')]}
 
-staging_songs_table_create = ("""CREATE TABLE IF NOT EXISTS staging_songs (num_songs INT, \
-                                 artist_id TEXT, \
-                                 artist_latitude  FLOAT, \
-                                 artist_location  TEXT, \
-                                 artist_name      TEXT, \
-                                 song_id          TEXT, \
-                                 title            TEXT, \
-                                 duration         FLOAT, \
-                                 year             INT);
-""")
-
-# fact table fact_songplay
-songplay_table_create = ("""CREATE TABLE IF NOT EXISTS fact_songplay (songplay_id INT PRIMARY KEY, \
-                            start_time      DATE NOT NULL, \
-                            user_id         TEXT NOT NULL, \
-                            level           TEXT, \
-                            song_id         TEXT, \
-                            artist_id       TEXT, \
-                            session_id      INT, \
-                            location        TEXT, \
-                            user_agent      TEXT);
-""")
+staging_events_table_create, staging_songs_table_create = [
+    'CREATE TABLE IF NOT EXISTS {} ({});'.format(table, ', '.join('{} {}'.format(*column) for column in columns))
+    for table, columns in staging_columns.items()]
 
-# dimension tables, dim_users, dim_songs, dim_artists and dim_time
+# fact table fact_songplay and dimension tables, dim_users, dim_songs,
+# dim_artists and dim_time: (name, type) columns and primary key; the CREATE
+# statements are generated with the distribution and sort keys of layout.cfg
+# (indexes and monthly partitions on Postgres)
 
-user_table_create = ("""CREATE TABLE IF NOT EXISTS dim_users (user_id TEXT PRIMARY KEY, \
-                        first_name TEXT, \
-                        last_name  TEXT, \
-                        gender     TEXT, \
-                        level      TEXT);
-""")
+star_tables = {'fact_songplay': ([('songplay_id', IDENTITY),
+                                  ('start_time', 'TIMESTAMP NOT NULL'),
+                                  ('user_id', 'TEXT NOT NULL'),
+                                  ('level', 'TEXT'),
+                                  ('song_id', 'TEXT'),
+                                  ('artist_id', 'TEXT'),
+                                  ('session_id', 'INT'),
+                                  ('item_in_session', 'INT'),
+                                  ('location', 'TEXT'),
+                                  ('user_agent', 'TEXT')], ['songplay_id']),
+               'dim_users': ([('user_id', 'TEXT'),
+                              ('first_name', 'TEXT'),
+                              ('last_name', 'TEXT'),
+                              ('gender', 'TEXT'),
+                              ('level', 'TEXT')], ['user_id']),
+               'dim_songs': ([('song_id', 'TEXT'),
+                              ('title', 'TEXT'),
+                              ('artist_id', 'TEXT'),
+                              ('year', 'INT'),
+                              ('duration', 'FLOAT')], ['song_id']),
+               'dim_artists': ([('artist_id', 'TEXT'),
+                                ('name', 'TEXT'),
+                                ('location', 'TEXT'),
+                                ('latitude', 'FLOAT'),
+                                ('longitude', 'FLOAT')], ['artist_id']),
+               'dim_time': ([('start_time', 'TIMESTAMP'),
+                             ('hour', 'INT'),
+                             ('day', 'INT'),
+                             ('week', 'INT'),
+                             ('month', 'INT'),
+                             ('year', 'INT'),
+                             ('weekday', 'INT')], ['start_time'])}
 
-song_table_create = ("""CREATE TABLE IF NOT EXISTS dim_songs (song_id TEXT PRIMARY KEY, \
-                        title       TEXT, \
-                        artist_id   TEXT, \
-                        year        INT, \
-                        duration    FLOAT);
-""")
+layout = read_layout('layout.cfg')
+songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create = [
+    table_create(table, columns, primary_key, layout, DIALECT)
+    for table, (columns, primary_key) in star_tables.items()]
 
-artist_table_create = ("""CREATE TABLE IF NOT EXISTS dim_artists (artist_id TEXT PRIMARY KEY, \
-                          name      TEXT, \
-                          location  TEXT, \
-                          latitude  FLOAT, \
-                          longitude FLOAT);
-""")
+# STAGING TABLES
 
-time_table_create = ("""CREATE TABLE IF NOT EXISTS dim_time (start_time DATE PRIMARY KEY, \
-                        hour      INT, \
-                        day       INT, \
-                        week      INT, \
-                        month     INT, \
-                        year      INT, \
-                        weekday   INT);
+# generated at run time by prestage.copy_statement, from a prefix or a manifest:
+# table, source, IAM role, then the REGION, MANIFEST and format clauses
+staging_copy = ("""copy {} from '{}' \
+                   credentials 'aws_iam_role={}' \
+                   compupdate off {}{}{};
 """)
 
-# STAGING TABLES
+staging_copy_json = "FORMAT AS JSON '{}' {}TRUNCATECOLUMNS BLANKSASNULL EMPTYASNULL"
 
-staging_events_copy = ("""copy staging_events from {} 
-                          credentials 'aws_iam_role={}' 
-                          compupdate off region 'us-west-2' FORMAT AS JSON {} 
-                          TRUNCATECOLUMNS BLANKSASNULL EMPTYASNULL;
-                       """).format(config['S3'].get('LOG_DATA'),
-                                   config['IAM_ROLE'].get('ARN').strip("'"),
-                                   config['S3'].get('LOG_JSONPATH'))
+staging_copy_parquet = "FORMAT AS PARQUET"
 
+# local stand-in for the COPY of a manifest entry
+staging_copy_stdin = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)"
 
-staging_songs_copy = ("""copy staging_songs from {} 
-                          credentials 'aws_iam_role={}' 
-                          compupdate off region 'us-west-2' 
-                          FORMAT AS JSON 'auto' 
-                          TRUNCATECOLUMNS BLANKSASNULL EMPTYASNULL;
-                        """).format(config['S3'].get('SONG_DATA'),
-                                    config['IAM_ROLE'].get('ARN').strip("'"))
+# run before every load of a staging table, so it only holds this run's rows
+staging_truncate = "TRUNCATE {};"
 
 # FINAL TABLES
 
-songplay_table_insert = ("""INSERT INTO fact_songplay (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent) \
+songplay_table_insert = ("""INSERT INTO fact_songplay (start_time, user_id, level, song_id, artist_id, session_id, item_in_session, \
+                                                      location, user_agent) \
                             SELECT timestamp 'epoch' + ts/1000 * interval '1 second' as start_time, \
                                     se.userId as user_id, \
                                     se.level as level, \
                                     ss.song_id as song_id, \
                                     ss.artist_id as artist_id, \
-                                    se.sessionId as session_id, 
+                                    se.sessionId as session_id, \
+                                    se.itemInSession as item_in_session, \
                                     se.location as location, \
                                     se.userAgent as user_agent \
                             FROM staging_events as se \
@@ -165,28 +185,216 @@ artist_table_insert = ("""INSERT INTO dim_artists (artist_id, name, location, la
 
 # since we're dealing with millisecond epochs we're going to either divide or multiple the epoch value
 # by 1000.
+# start_time is computed in a subquery and the weekday read as dow, so the
+# statement also runs on Postgres
 time_table_insert = ("""INSERT INTO dim_time (start_time, hour, day, week, month, year, weekday) \
-                        SELECT timestamp 'epoch' + ts/1000 * interval '1 second' as start_time, \
+                        SELECT start_time, \
                                extract(hour from start_time) as hour, \
                                extract(day from start_time) as day, \
                                extract(week from start_time) as week, \
                                extract(month from start_time) as month, \
                                extract(year from start_time) as year, \
-                               extract(weekday from start_time) as weekday \
-                         FROM staging_events \
-                         WHERE page='NextSong';
+                               extract(dow from start_time) as weekday \
+                         FROM (SELECT timestamp 'epoch' + ts/1000 * interval '1 second' as start_time \
+                               FROM staging_events \
+                               WHERE page='NextSong') as events;
                               
 """)
 
+# MERGE FROM STAGING
+# rerunnable loads: each dimension only receives keys it does not hold yet (users
+# are replaced by their latest row), and songplays are matched on title, artist
+# and duration, one song per match, so every NextSong event gives one fact row
+
+# the new songplays go through songplay_delta, where the rollups step finds
+# them; rows left there by a run whose rollups failed are already in
+# fact_songplay, so they are not inserted twice, and are counted by the next rollups step.
+# An event is identified by its position in its session, (start_time, user_id,
+# session_id, item_in_session), and staged once however often it was loaded
+songplay_table_merge = ("""INSERT INTO songplay_delta (start_time, user_id, level, song_id, artist_id, session_id, item_in_session, \
+                                                   location, user_agent) \
+                           SELECT e.start_time, e.userId, e.level, s.song_id, s.artist_id, e.sessionId, e.itemInSession, \
+                                  e.location, e.userAgent \
+                           FROM (SELECT timestamp 'epoch' + ts/1000 * interval '1 second' as start_time, \
+                                        userId, level, song, artist, length, sessionId, itemInSession, location, userAgent, \
+                                        ROW_NUMBER() OVER (PARTITION BY ts, userId, sessionId, itemInSession \
+                                                           ORDER BY level, location, userAgent) as occurrence \
+                                 FROM staging_events \
+                                 WHERE page = 'NextSong') as e \
+                           LEFT JOIN (SELECT ds.song_id, ds.artist_id, ds.title, da.name, ds.duration, \
+                                             ROW_NUMBER() OVER (PARTITION BY ds.title, da.name, ds.duration \
+                                                                ORDER BY ds.song_id) as n \
+                                      FROM dim_songs as ds \
+                                      JOIN dim_artists as da ON (ds.artist_id = da.artist_id)) as s \
+                                  ON (s.n = 1 AND s.title = e.song AND s.name = e.artist AND s.duration = e.length) \
+                           WHERE e.occurrence = 1 \
+                             AND NOT EXISTS (SELECT 1 FROM fact_songplay as f \
+                                             WHERE f.start_time = e.start_time \
+                                               AND f.user_id = e.userId \
+                                               AND f.session_id = e.sessionId \
+                                               AND f.item_in_session = e.itemInSession);
+                           INSERT INTO fact_songplay (start_time, user_id, level, song_id, artist_id, session_id, item_in_session, \
+                                                      location, user_agent) \
+                           SELECT d.start_time, d.user_id, d.level, d.song_id, d.artist_id, d.session_id, d.item_in_session, \
+                                  d.location, d.user_agent \
+                           FROM songplay_delta as d \
+                           WHERE NOT EXISTS (SELECT 1 FROM fact_songplay as f \
+                                             WHERE f.start_time = d.start_time \
+                                               AND f.user_id = d.user_id \
+                                               AND f.session_id = d.session_id \
+                                               AND f.item_in_session = d.item_in_session);
+""")
+
+# delete + insert in one transaction, so the latest level of a user wins
+user_table_merge = ("""DELETE FROM dim_users \
+                       USING staging_events \
+                       WHERE dim_users.user_id = staging_events.userId \
+                         AND staging_events.page = 'NextSong';
+                       INSERT INTO dim_users (user_id, first_name, last_name, gender, level) \
+                       SELECT userId, firstName, lastName, gender, level \
+                       FROM (SELECT userId, firstName, lastName, gender, level, \
+                                    ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) as n \
+                             FROM staging_events \
+                             WHERE page = 'NextSong' AND userId IS NOT NULL) as e \
+                       WHERE n = 1;
+""")
+
+song_table_merge = ("""INSERT INTO dim_songs (song_id, title, artist_id, year, duration) \
+                       SELECT song_id, title, artist_id, year, duration \
+                       FROM (SELECT song_id, title, artist_id, year, duration, \
+                                    ROW_NUMBER() OVER (PARTITION BY song_id ORDER BY year DESC) as n \
+                             FROM staging_songs \
+                             WHERE song_id IS NOT NULL AND artist_id IS NOT NULL) as s \
+                       WHERE n = 1 \
+                         AND NOT EXISTS (SELECT 1 FROM dim_songs as d WHERE d.song_id = s.song_id);
+""")
+
+artist_table_merge = ("""INSERT INTO dim_artists (artist_id, name, location, latitude, longitude) \
+                         SELECT artist_id, artist_name, artist_location, artist_latitude, artist_longitude \
+                         FROM (SELECT artist_id, artist_name, artist_location, artist_latitude, artist_longitude, \
+                                      ROW_NUMBER() OVER (PARTITION BY artist_id ORDER BY artist_name) as n \
+                               FROM staging_songs \
+                               WHERE artist_id IS NOT NULL AND artist_name IS NOT NULL) as s \
+                         WHERE n = 1 \
+                           AND NOT EXISTS (SELECT 1 FROM dim_artists as d WHERE d.artist_id = s.artist_id);
+""")
+
+time_table_merge = ("""INSERT INTO dim_time (start_time, hour, day, week, month, year, weekday) \
+                       SELECT start_time, \
+                              extract(hour from start_time) as hour, \
+                              extract(day from start_time) as day, \
+                              extract(week from start_time) as week, \
+                              extract(month from start_time) as month, \
+                              extract(year from start_time) as year, \
+                              extract(dow from start_time) as weekday \
+                       FROM (SELECT DISTINCT timestamp 'epoch' + ts/1000 * interval '1 second' as start_time \
+                             FROM staging_events \
+                             WHERE page='NextSong') as t \
+                       WHERE NOT EXISTS (SELECT 1 FROM dim_time as d WHERE d.start_time = t.start_time);
+""")
+
+# DATA QUALITY
+# staged rows breaking a rule of common/quality.py are moved to the quarantine
+# table of their staging table, with the names of the rules they break, before
+# the star schema is loaded: staging table -> (quarantine table, dataset)
+
+quarantine_tables = {'staging_events': ('quarantine_events', 'log_data'),
+                     'staging_songs': ('quarantine_songs', 'song_data')}
+
+quarantine_events_table_create, quarantine_songs_table_create = [
+    'CREATE TABLE IF NOT EXISTS {} ({}, reason TEXT, quarantined_at TIMESTAMP);'.format(
+        quarantine, ', '.join('{} {}'.format(*column) for column in staging_columns[table]))
+    for table, (quarantine, dataset) in quarantine_tables.items()]
+
+# staging table -> (count of the rows breaking each rule, INSERT into quarantine, DELETE from staging)
+quarantine_queries = {table: quality.quarantine_statements(dataset, table, quarantine,
+                                                           [name for name, kind in staging_columns[table]], NOW)
+                      for table, (quarantine, dataset) in quarantine_tables.items()}
+
+# keys of the songplays not in the dimensions, which Redshift does not check:
+# counted by the references step over the songplays of the run, once the
+# dimensions are loaded. load -> (query, rule names of its counts)
+songplay_references = [quality.Reference('user_id', 'dim_users', 'user_id'),
+                       quality.Reference('song_id', 'dim_songs', 'song_id'),
+                       quality.Reference('artist_id', 'dim_artists', 'artist_id')]
+reference_queries = {'merge': quality.reference_count('songplay_delta', songplay_references),
+                     'append': quality.reference_count('fact_songplay', songplay_references)}
+
+# ROLLUPS
+# play counts by time bucket and dimensions (common/rollups.py), with the
+# layout of layout.cfg. The rollups step adds the songplays of songplay_delta,
+# the ones the run loaded, to every rollup and empties it, in one transaction
+
+songplay_delta_table_create = 'CREATE TABLE IF NOT EXISTS songplay_delta ({});'.format(
+    ', '.join('{} {}'.format(*column) for column in star_tables['fact_songplay'][0][1:]))
+
+rollup_table_creates = [table_create(rollup.name, columns, primary_key, layout, DIALECT)
+                        for rollup in rollups.ROLLUPS
+                        for columns, primary_key in [rollups.columns(rollup, dict.fromkeys(rollup.dimensions, 'TEXT'))]]
+
+rollup_update_queries = ';\n'.join([query for rollup in rollups.ROLLUPS
+                                    for query in rollups.update_statements(rollup, 'songplay_delta')] +
+                                   ['DELETE FROM songplay_delta']) + ';'
+
+# every rollup counted again from fact_songplay, e.g. after --load append runs
+rollup_rebuild_queries = ';\n'.join([query for rollup in rollups.ROLLUPS
+                                     for query in rollups.rebuild_statements(rollup, 'fact_songplay')] +
+                                    ['DELETE FROM songplay_delta']) + ';'
+
+# ANALYTICS QUERIES
+# representative questions of the analytics team, run by benchmark_queries.py
+
+analytics_queries = {
+    'top_songs_month': ("""SELECT s.title, COUNT(*) as plays \
+                           FROM fact_songplay as f \
+                           JOIN dim_songs as s ON (f.song_id = s.song_id) \
+                           WHERE f.start_time >= '2018-11-01' AND f.start_time < '2018-12-01' \
+                           GROUP BY s.title \
+                           ORDER BY plays DESC \
+                           LIMIT 10;"""),
+    'top_artists': ("""SELECT a.name, COUNT(*) as plays \
+                       FROM fact_songplay as f \
+                       JOIN dim_artists as a ON (f.artist_id = a.artist_id) \
+                       GROUP BY a.name \
+                       ORDER BY plays DESC \
+                       LIMIT 10;"""),
+    'plays_by_hour_level': ("""SELECT t.hour, f.level, COUNT(*) as plays \
+                               FROM fact_songplay as f \
+                               JOIN dim_time as t ON (f.start_time = t.start_time) \
+                               GROUP BY t.hour, f.level \
+                               ORDER BY t.hour, f.level;"""),
+    'plays_by_gender_weekday': ("""SELECT u.gender, t.weekday, COUNT(*) as plays \
+                                   FROM fact_songplay as f \
+                                   JOIN dim_users as u ON (f.user_id = u.user_id) \
+                                   JOIN dim_time as t ON (f.start_time = t.start_time) \
+                                   GROUP BY u.gender, t.weekday \
+                                   ORDER BY u.gender, t.weekday;"""),
+    'daily_active_users': ("""SELECT DATE_TRUNC('day', start_time) as day, COUNT(DISTINCT user_id) as users \
+                              FROM fact_songplay \
+                              WHERE start_time >= '2018-11-01' AND start_time < '2018-11-08' \
+                              GROUP BY 1 \
+                              ORDER BY 1;"""),
+    'user_history': ("""SELECT f.start_time, s.title, a.name \
+                        FROM fact_songplay as f \
+                        LEFT JOIN dim_songs as s ON (f.song_id = s.song_id) \
+                        LEFT JOIN dim_artists as a ON (f.artist_id = a.artist_id) \
+                        WHERE f.user_id = '15' \
+                        ORDER BY f.start_time DESC \
+                        LIMIT 50;"""),
+}
+
 # QUERY LISTS
 
 create_table_queries = [staging_events_table_create, 
                         staging_songs_table_create, 
+                        quarantine_events_table_create, 
+                        quarantine_songs_table_create, 
                         songplay_table_create, 
                         user_table_create, 
                         song_table_create, 
                         artist_table_create, 
-                        time_table_create]
+                        time_table_create,
+                        songplay_delta_table_create] + rollup_table_creates
 
 drop_table_queries = [staging_events_table_drop, 
                       staging_songs_table_drop, 
@@ -194,13 +402,35 @@ drop_table_queries = [staging_events_table_drop,
                       user_table_drop, 
                       song_table_drop, 
                       artist_table_drop, 
-                      time_table_drop]
-
-copy_table_queries = [staging_events_copy, 
-                      staging_songs_copy]
+                      time_table_drop,
+                      manifest_table_drop,
+                      quarantine_events_table_drop,
+                      quarantine_songs_table_drop,
+                      songplay_delta_table_drop] + rollup_table_drops
 
 insert_table_queries = [songplay_table_insert, 
                         user_table_insert, 
                         song_table_insert, 
                         artist_table_insert, 
                         time_table_insert]
+
+# ETL steps: name -> (statement, names of the steps whose tables it reads).
+# The staging_events and staging_songs steps, and the quarantine_events and
+# quarantine_songs steps taking the rows that break the data-quality rules out
+# of them, are generated at run time by etl.py; each insert only waits for
+# the tables it selects from
+etl_steps = {'fact_songplay': (songplay_table_insert, ['quarantine_events', 'quarantine_songs']),
+             'dim_users': (user_table_insert, ['quarantine_events']),
+             'dim_songs': (song_table_insert, ['quarantine_songs']),
+             'dim_artists': (artist_table_insert, ['quarantine_songs']),
+             'dim_time': (time_table_insert, ['quarantine_events'])}
+
+# merge load: songplays are matched against the song and artist dimensions,
+# and the rollups count the new ones once the references step, generated at
+# run time by etl.py, has checked their keys
+merge_etl_steps = {'fact_songplay': (songplay_table_merge, ['quarantine_events', 'dim_songs', 'dim_artists']),
+                   'rollups': (rollup_update_queries, ['fact_songplay', 'references']),
+                   'dim_users': (user_table_merge, ['quarantine_events']),
+                   'dim_songs': (song_table_merge, ['quarantine_songs']),
+                   'dim_artists': (artist_table_merge, ['quarantine_songs']),
+                   'dim_time': (time_table_merge, ['quarantine_events'])}
@@ -0,0 +1,115 @@
+# generate the CREATE TABLE statements of the star schema from layout.cfg:
+# distribution style and sort keys on Redshift, the equivalent indexes and
+# monthly range partitions on Postgres
+
+import configparser
+
+
+def read_layout(filename='layout.cfg'):
+    """
+    Function that reads the per-table layout config.
+
+    Returns:
+        ConfigParser with one section per table
+    """
+    layout = configparser.ConfigParser(inline_comment_prefixes=('#',))
+    layout.read(filename)
+    return layout
+
+
+def _names(value):
+    return [name.strip() for name in value.split(',') if name.strip()] if value else []
+
+
+def month_starts(spec):
+    """
+    Function that expands 'YYYY-MM:YYYY-MM' into the first day of every month
+    of the range, plus the month after it (the upper bound of the last one).
+
+    Returns:
+        list of 'YYYY-MM-01' strings
+    """
+    first, last = spec.split(':')
+    year, month = map(int, first.split('-'))
+    last_year, last_month = map(int, last.split('-'))
+    months = []
+    while True:
+        months.append('{:04d}-{:02d}-01'.format(year, month))
+        if (year, month) > (last_year, last_month):
+            return months
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def redshift_create(table, columns, primary_key, options):
+    """
+    Function that builds a Redshift CREATE TABLE with DISTSTYLE, DISTKEY and
+    SORTKEY.
+    """
+    body = ', '.join('{} {}'.format(name, kind) for name, kind in columns)
+    body += ', PRIMARY KEY ({})'.format(', '.join(primary_key))
+    query = 'CREATE TABLE IF NOT EXISTS {} ({})'.format(table, body)
+
+    diststyle = options.get('diststyle', '').upper()
+    if diststyle:
+        query += ' DISTSTYLE {}'.format(diststyle)
+    if diststyle == 'KEY':
+        query += ' DISTKEY ({})'.format(options['distkey'])
+    if options.get('sortkey'):
+        query += ' SORTKEY ({})'.format(', '.join(_names(options['sortkey'])))
+    return query + ';'
+
+
+def postgres_create(table, columns, primary_key, options):
+    """
+    Function that builds a Postgres CREATE TABLE standing in for the Redshift
+    layout: B-tree indexes on the sort key, the distribution key and the
+    listed indexes, and monthly range partitions. A partitioned table's
+    primary key has to include the partition column, so it is added to it.
+    """
+    partition_by = options.get('partition_by')
+    if partition_by and partition_by not in primary_key:
+        primary_key = primary_key + [partition_by]
+
+    body = ', '.join('{} {}'.format(name, kind) for name, kind in columns)
+    body += ', PRIMARY KEY ({})'.format(', '.join(primary_key))
+    queries = ['CREATE TABLE IF NOT EXISTS {} ({}){}'.format(
+        table, body, ' PARTITION BY RANGE ({})'.format(partition_by) if partition_by else '')]
+
+    if partition_by:
+        starts = month_starts(options['partition_months'])
+        for start, end in zip(starts, starts[1:]):
+            queries.append("CREATE TABLE IF NOT EXISTS {0}_{1} PARTITION OF {0} FOR VALUES FROM ('{2}') TO ('{3}')"
+                           .format(table, start[:7].replace('-', '_'), start, end))
+        queries.append('CREATE TABLE IF NOT EXISTS {0}_default PARTITION OF {0} DEFAULT'.format(table))
+
+    indexes = [_names(options.get('sortkey'))] + [[name] for name in _names(options.get('distkey'))] \
+        + [[name] for name in _names(options.get('indexes'))]
+    seen = [primary_key]
+    for index in indexes:
+        if index and index not in seen and index != primary_key[:len(index)]:
+            seen.append(index)
+            queries.append('CREATE INDEX IF NOT EXISTS {0}_{1}_idx ON {0} ({2})'
+                           .format(table, '_'.join(index), ', '.join(index)))
+    return ';\n'.join(queries) + ';'
+
+
+def table_create(table, columns, primary_key, layout, dialect='redshift'):
+    """
+    Function that builds the CREATE TABLE statement(s) of a table.
+
+    Args:
+    ------------------------------------
+        table:        table name, and section of the layout
+        columns:      list of (name, type and constraints)
+        primary_key:  list of column names
+        layout:       read_layout() config; tables without a section get
+                      the defaults of the database
+        dialect:      'redshift' or 'postgres'
+
+    Returns:
+        SQL string, several ;-separated statements on Postgres
+    """
+    options = dict(layout[table]) if layout.has_section(table) else {}
+    if dialect == 'postgres':
+        return postgres_create(table, columns, primary_key, options)
+    return redshift_create(table, columns, primary_key, options)
@@ -0,0 +1,13 @@
+# the modules under test are imported from src/, and the shared ones from
+# common/, as settings.py puts it on the path; the other projects have
+# modules of the same names, so those are forgotten first
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+for name in ('settings', 'sql_queries', 'create_tables', 'etl'):
+    sys.modules.pop(name, None)
+sys.path.insert(0, os.path.join(HERE, os.pardir, os.pardir, 'common'))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'src'))
@@ -0,0 +1,78 @@
+import pytest
+
+from dag_runner import DagRunner, StepFailed, topological_order
+
+
+class FakeCursor:
+    rowcount = 0
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        if query == 'fail':
+            raise RuntimeError('statement failed')
+        self.conn.executed.append(query)
+
+
+class FakeConnection:
+    def __init__(self, rollback_error=None):
+        self.rollback_error = rollback_error
+        self.closed = 0
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        if self.rollback_error is not None:
+            self.closed = 2
+            raise self.rollback_error
+
+    def cancel(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+        self.returned = []
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        self.returned.append(close)
+
+
+def test_steps_run_after_their_dependencies():
+    steps = {'fact': ('b', ['dim']), 'dim': ('a', [])}
+    assert topological_order(steps) == ['dim', 'fact']
+    pool = FakePool(FakeConnection())
+    assert set(DagRunner(pool, workers=1).run(steps)) == {'dim', 'fact'}
+    assert pool.conn.executed == ['a', 'b']
+    assert pool.returned == [False, False]
+
+
+def test_failed_rollback_keeps_the_statement_error_and_closes_the_connection():
+    pool = FakePool(FakeConnection(rollback_error=ConnectionError('server closed the connection')))
+    with pytest.raises(StepFailed) as failed:
+        DagRunner(pool, workers=1).run({'fact': ('fail', [])})
+    assert isinstance(failed.value.error, RuntimeError)
+    assert pool.returned == [True]
+
+
+def test_failed_statement_returns_a_healthy_connection():
+    pool = FakePool(FakeConnection())
+    with pytest.raises(StepFailed):
+        DagRunner(pool, workers=1).run({'fact': ('fail', [])})
+    assert pool.returned == [False]
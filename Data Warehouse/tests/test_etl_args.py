@@ -0,0 +1,33 @@
+import sys
+
+import pytest
+
+import etl
+
+
+@pytest.fixture
+def run(monkeypatch):
+    # pre-staging and connecting stand for the load, which starts once the arguments are accepted
+    def unexpected(*args):
+        raise AssertionError('load started')
+
+    monkeypatch.setattr(etl, 'staging_steps', unexpected)
+    monkeypatch.setattr(etl, 'postgres_pool', unexpected)
+
+    def main(*argv):
+        monkeypatch.setattr(sys, 'argv', ['etl.py'] + list(argv))
+        etl.main()
+
+    return main
+
+
+def test_merge_only_steps_are_rejected_with_append(run, capsys):
+    with pytest.raises(SystemExit) as e:
+        run('--load', 'append', '--skip', 'rollups')
+    assert e.value.code == 2
+    assert '--skip rollups: no such step with --load append' in capsys.readouterr().err
+
+
+def test_steps_of_the_load_mode_are_accepted(run):
+    with pytest.raises(AssertionError, match='load started'):
+        run('--load', 'append', '--skip', 'staging_events', 'references')
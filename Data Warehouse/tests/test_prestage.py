@@ -0,0 +1,34 @@
+import json
+
+import instrumentation
+import prestage
+from prestage import plan_chunks
+
+
+def test_chunks_come_in_multiples_of_the_slices():
+    files = [('f{}'.format(n), 100) for n in range(10)]
+    assert len(plan_chunks(files, 4, 250)) == 4
+    # 12 chunks of 100 bytes would need more files than there are
+    chunks = plan_chunks(files, 4, 100)
+    assert len(chunks) == 8
+    assert sorted(url for chunk in chunks for url in chunk) == sorted(url for url, size in files)
+
+
+def test_fewer_files_than_slices_give_one_chunk_per_file():
+    assert plan_chunks([('a', 10), ('b', 5)], 4, 1000) == [['a'], ['b']]
+    assert plan_chunks([], 4, 1000) == []
+
+
+def test_prestage_records_the_files(tmp_path, monkeypatch):
+    source = tmp_path / 'log_data'
+    source.mkdir()
+    for n in range(3):
+        (source / '{}.json'.format(n)).write_text(json.dumps({'ts': n}))
+    recorder = instrumentation.Recorder(enabled=True)
+    monkeypatch.setattr(prestage, 'stage', recorder.stage)
+
+    manifest, count = prestage.prestage(str(source), str(tmp_path / 'out'), 'staging_events')
+    assert count == 3
+    assert len(json.loads(open(manifest).read())['entries']) == 3
+    totals = recorder.totals['prestage staging_events']
+    assert (totals['rows_in'], totals['rows_out']) == (3, 3)
@@ -0,0 +1,230 @@
+# end-to-end benchmark of the Postgres ETL, the Cassandra loader and the Spark
+# ETL (local[*]) on the same synthetic dataset. Each run is appended to a JSON
+# lines file with the commit it ran on and the per-stage metrics of the jobs,
+# and compared with the earlier runs of the same target, scale and options to
+# catch regressions
+#
+#     python common/benchmark_etl.py --scale 1 10 100 --targets postgres spark
+
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from synthetic_data import generate
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# steps of each target: (name, working directory, script and arguments); {data}
+# is the dataset, {work} a scratch directory removed after the run and {metrics}
+# the file of the step's stage metrics. The options of --<target>-args are
+# added to the last step.
+TARGETS = {
+    'postgres': [
+        ('create_tables', 'Data Modeling with Postgres/src', ['create_tables.py']),
+        ('etl', 'Data Modeling with Postgres/src',
+         ['etl.py', '--song-data', '{data}/song_data', '--log-data', '{data}/log_data', '--metrics', '{metrics}']),
+    ],
+    'cassandra': [
+        ('consolidate', 'Data Modeling with Apache Cassandra/src',
+         ['consolidate_events.py', '--input', '{data}/event_data', '--output', '{work}/event_datafile_new.csv',
+          '--metrics', '{metrics}']),
+        ('load', 'Data Modeling with Apache Cassandra/src',
+         ['cassandra_loader.py', '--file', '{work}/event_datafile_new.csv', '--metrics', '{metrics}']),
+    ],
+    'spark': [
+        ('etl', 'Data Lakes with Spark/src',
+         ['etl.py', '--master', 'local[*]', '--input', '{data}', '--output', '{work}/lake',
+          '--metrics', '{metrics}']),
+    ],
+}
+
+DEFAULT_ARGS = {'postgres': '--mode bulk', 'cassandra': '', 'spark': ''}
+
+
+def commit():
+    """
+    Function that returns the current commit, marked + when the tree has
+    uncommitted changes.
+    """
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return head + ('+' if dirty else '')
+
+
+def read_metrics(filename):
+    """
+    Function that reads the stage totals written by a job's --metrics option.
+
+    Returns:
+        dict of stage name -> counters
+    """
+    stages = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            for line in f:
+                record = json.loads(line)
+                stages[record['stage']] = {key: value for key, value in record.items()
+                                           if key not in ('job', 'started', 'stage')}
+    return stages
+
+
+def run_target(target, data, options, timeout=None):
+    """
+    Function that runs the steps of a target on a dataset.
+
+    Args:
+    ------------------------------------
+        target:   key of TARGETS
+        data:     directory of the dataset
+        options:  extra command line options of the last step
+        timeout:  seconds allowed per step
+
+    Returns:
+        dict with status, total seconds, seconds and stage metrics per step,
+        and the end of the output of a failed step
+    """
+    work = tempfile.mkdtemp(prefix='benchmark_etl_')
+    result = {'status': 'ok', 'seconds': 0.0, 'steps': {}, 'stages': {}}
+    try:
+        steps = TARGETS[target]
+        for n, (name, directory, command) in enumerate(steps):
+            metrics = os.path.join(work, name + '.metrics.jsonl')
+            command = [part.format(data=data, work=work, metrics=metrics) for part in command]
+            if n == len(steps) - 1:
+                command += shlex.split(options)
+            start = time.perf_counter()
+            try:
+                process = subprocess.run([sys.executable] + command,
+                                         cwd=os.path.join(ROOT, directory), capture_output=True, text=True,
+                                         timeout=timeout)
+                failed = process.returncode != 0
+                output = process.stdout + process.stderr
+            except subprocess.TimeoutExpired:
+                failed, output = True, 'timed out after {} s'.format(timeout)
+            seconds = time.perf_counter() - start
+
+            result['seconds'] += seconds
+            result['steps'][name] = seconds
+            result['stages'][name] = read_metrics(metrics)
+            if failed:
+                result['status'] = 'failed'
+                result['error'] = '{}: {}'.format(name, '\n'.join(output.strip().split('\n')[-5:]))
+                break
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return result
+
+
+def validate_share(target, result):
+    """
+    Function that returns the share of the load's wall time spent in its
+    data-quality rules, from the validate stage of the last step, or None
+    when that step does not validate. With several workers, the time of all
+    of them is counted.
+    """
+    name = TARGETS[target][-1][0]
+    validate = result['stages'].get(name, {}).get('validate')
+    if result['status'] != 'ok' or validate is None or not result['steps'].get(name):
+        return None
+    return validate['wall_seconds'] / result['steps'][name]
+
+
+def read_results(filename):
+    """
+    Function that reads the earlier runs.
+    """
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def baseline(results, record, runs=5):
+    """
+    Function that returns the median time of the last successful runs with
+    the same target, dataset and options, or None without any.
+    """
+    key = ('target', 'scale', 'seed', 'match_rate', 'options')
+    times = [result['seconds'] for result in results
+             if result['status'] == 'ok' and all(result.get(k) == record[k] for k in key)][-runs:]
+    if not times:
+        return None
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    """
+    Main function generates (or reuses) the dataset of every scale, runs every
+    target on it, prints each run against its baseline and appends it to the
+    results file.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the ETLs end to end on synthetic data.')
+    parser.add_argument('--scale', type=float, nargs='+', default=[1], help='multiples of the bundled sample')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--match-rate', type=float, default=0.5)
+    parser.add_argument('--targets', nargs='+', choices=sorted(TARGETS), default=sorted(TARGETS))
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'sparkify_synthetic'),
+                        help='datasets are generated here once per scale and seed')
+    for target in sorted(TARGETS):
+        parser.add_argument('--{}-args'.format(target), default=DEFAULT_ARGS[target],
+                            help='options added to the {} job'.format(target))
+    parser.add_argument('--timeout', type=float, default=None, help='seconds allowed per step')
+    parser.add_argument('--results', default='benchmark_etl.jsonl')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown over the baseline reported as a regression, e.g. 0.2 for 20%%')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 on a regression')
+    args = parser.parse_args()
+
+    results = read_results(args.results)
+    revision = commit()
+    regressions = 0
+    print('{:<10}{:>8}{:>9}{:>12}{:>12}{:>10}{:>14}{:>12}'.format('target', 'scale', 'status', 'seconds',
+                                                                   'baseline', 'change', 'events/s', 'validate %'))
+    for scale in args.scale:
+        data = os.path.join(args.data_dir, '{:g}x-seed{}-match{:g}'.format(scale, args.seed, args.match_rate))
+        dataset = generate(data, scale, args.seed, args.match_rate)
+
+        for target in args.targets:
+            options = getattr(args, '{}_args'.format(target))
+            record = {'run_at': datetime.now(timezone.utc).isoformat(), 'commit': revision, 'target': target,
+                      'scale': scale, 'seed': args.seed, 'match_rate': args.match_rate, 'options': options,
+                      'dataset': dataset}
+            record.update(run_target(target, data, options, args.timeout))
+            record['validate_share'] = validate_share(target, record)
+
+            reference = baseline(results, record)
+            change = record['seconds'] / reference - 1 if reference and record['status'] == 'ok' else None
+            regressed = change is not None and change > args.threshold
+            regressions += regressed
+            print('{:<10}{:>8g}{:>9}{:>12.2f}{:>12}{:>10}{:>14}{:>12}{}'.format(
+                target, scale, record['status'], record['seconds'],
+                '{:.2f}'.format(reference) if reference else '-',
+                '{:+.0%}'.format(change) if change is not None else '-',
+                '{:.0f}'.format(dataset['events'] / record['seconds']) if record['status'] == 'ok' else '-',
+                '{:.1%}'.format(record['validate_share']) if record['validate_share'] is not None else '-',
+                '  REGRESSION' if regressed else ''))
+            if record['status'] != 'ok':
+                print(record['error'])
+
+            results.append(record)
+            with open(args.results, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
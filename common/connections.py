@@ -0,0 +1,282 @@
+# configuration and pooled connections shared by the Postgres, Warehouse and
+# Cassandra ETLs: a config file is read and validated once per process, and
+# connections are kept warm in pools reused by every job run in the process
+
+import os
+import time
+import random
+import atexit
+import threading
+import configparser
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import psycopg2
+    from psycopg2.pool import ThreadedConnectionPool
+except ImportError:  # only needed by the Postgres and Warehouse projects
+    psycopg2 = None
+    ThreadedConnectionPool = object
+
+
+PostgresConfig = namedtuple('PostgresConfig', ['host', 'port', 'dbname', 'user', 'password'])
+CassandraConfig = namedtuple('CassandraConfig', ['hosts', 'port', 'keyspace'])
+
+# config keys of a Postgres/Redshift section, as in the [CLUSTER] section of dwh.cfg
+POSTGRES_KEYS = PostgresConfig(host='HOST', port='DB_PORT', dbname='DB_NAME', user='DB_USER', password='DB_PASSWORD')
+
+# keys a connection string must have; libpq has defaults for the others
+DSN_REQUIRED = ['host', 'dbname']
+
+# TCP keepalives, so a pooled connection dropped while idle is noticed, and a
+# bound on the time spent on an unreachable host
+KEEPALIVE = {'keepalives': 1, 'keepalives_idle': 30, 'keepalives_interval': 10, 'keepalives_count': 5,
+             'connect_timeout': 10}
+
+_lock = threading.Lock()
+_configs = {}
+_pools = {}
+_sessions = {}
+
+
+class ConfigError(ValueError):
+    """
+    Raised when a config file misses a required value or has one of the
+    wrong type.
+    """
+
+
+def read_config(filename):
+    """
+    Function that parses a config file once per process.
+
+    Args:
+    ------------------------------------
+        filename:  the .cfg file; a missing file gives an empty config
+
+    Returns:
+        ConfigParser, shared by every caller
+    """
+    path = os.path.abspath(filename)
+    with _lock:
+        if path not in _configs:
+            config = configparser.ConfigParser()
+            config.read(path)
+            _configs[path] = config
+        return _configs[path]
+
+
+def _integer(source, key, value):
+    # source names where value comes from in errors, e.g. 'dwh.cfg [CLUSTER]'
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ConfigError('{} {} must be an integer, not {!r}'.format(source, key, value))
+
+
+def postgres_config(filename, section, defaults=None, dsn=None):
+    """
+    Function that reads and validates the connection settings of a Postgres
+    or Redshift database.
+
+    Args:
+    ------------------------------------
+        filename:  the .cfg file
+        section:   its section, with the keys of POSTGRES_KEYS
+        defaults:  dict of PostgresConfig fields used for missing values
+        dsn:       connection string replacing the file, e.g. from --dsn;
+                   it needs the keys of DSN_REQUIRED, and port is 5432
+                   unless given
+
+    Returns:
+        PostgresConfig
+    """
+    values = dict(defaults or {})
+    if dsn:
+        try:
+            parsed = psycopg2.extensions.parse_dsn(dsn)
+        except psycopg2.ProgrammingError as e:
+            raise ConfigError('--dsn is not a connection string: {}'.format(str(e).strip()))
+        values.setdefault('port', '5432')
+        values.update({field: value for field, value in parsed.items() if field in PostgresConfig._fields and value})
+        source, keys, required = '--dsn', PostgresConfig(*PostgresConfig._fields), DSN_REQUIRED
+    else:
+        config = read_config(filename)
+        if config.has_section(section):
+            for field, key in POSTGRES_KEYS._asdict().items():
+                value = config[section].get(key, '').strip()
+                if value:
+                    values[field] = value
+        source, keys, required = '{} [{}]'.format(filename, section), POSTGRES_KEYS, PostgresConfig._fields
+
+    missing = [getattr(keys, field) for field in required if not values.get(field)]
+    if missing:
+        raise ConfigError('{} has no value for {}'.format(source, ', '.join(missing)))
+    values['port'] = _integer(source, keys.port, values['port'])
+    return PostgresConfig(**dict(dict.fromkeys(PostgresConfig._fields), **values))
+
+
+def cassandra_config(filename, section='CASSANDRA', hosts=None):
+    """
+    Function that reads and validates the contact points of a Cassandra
+    cluster: HOSTS (comma separated), PORT and KEYSPACE.
+
+    Args:
+    ------------------------------------
+        filename:  the .cfg file; localhost and sparkifydb when missing
+        section:   its section
+        hosts:     list of hosts replacing HOSTS, e.g. from --hosts
+
+    Returns:
+        CassandraConfig
+    """
+    config = read_config(filename)
+    options = config[section] if config.has_section(section) else {}
+    hosts = tuple(hosts or [host.strip() for host in options.get('HOSTS', '127.0.0.1').split(',') if host.strip()])
+    if not hosts:
+        raise ConfigError('{} [{}] has no value for HOSTS'.format(filename, section))
+    port = _integer('{} [{}]'.format(filename, section), 'PORT', options.get('PORT', '9042'))
+    return CassandraConfig(hosts, port, options.get('KEYSPACE', 'sparkifydb'))
+
+
+def retry(function, errors, attempts=5, backoff=0.5):
+    """
+    Function that calls function() until it does not raise one of errors,
+    sleeping with exponential backoff and jitter between the attempts.
+
+    Args:
+    ------------------------------------
+        function:  called without arguments
+        errors:    tuple of exception classes worth retrying
+        attempts:  calls before the last error is raised
+        backoff:   upper bound of the first sleep, doubled on every attempt
+
+    Returns:
+        the result of function()
+    """
+    for attempt in range(attempts):
+        try:
+            return function()
+        except errors as e:
+            if attempt == attempts - 1:
+                raise
+            delay = random.uniform(0, backoff * 2 ** attempt)
+            print('{}; retrying in {:.1f} s'.format(str(e).strip().split('\n')[0], delay))
+            time.sleep(delay)
+
+
+class RetryingPool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool whose new connections are retried with backoff and
+    opened with keepalives, and which replaces connections found closed.
+    """
+
+    def _connect(self, key=None):
+        return retry(lambda: ThreadedConnectionPool._connect(self, key), (psycopg2.OperationalError,))
+
+    def getconn(self, key=None):
+        conn = super().getconn(key)
+        if conn.closed:
+            self.putconn(conn, close=True)
+            conn = super().getconn(key)
+        return conn
+
+
+def postgres_pool(config, maxconn=8):
+    """
+    Function that returns the pool of a database, opening it on first use.
+    A pool opened with fewer connections is replaced by a larger one while
+    none of its connections are lent.
+
+    Args:
+    ------------------------------------
+        config:   PostgresConfig
+        maxconn:  connections the pool may hold
+
+    Returns:
+        RetryingPool
+    """
+    with _lock:
+        pool = _pools.get(config)
+        if pool is None or (pool.maxconn < maxconn and not pool._used):
+            if pool is not None:
+                pool.closeall()
+            pool = RetryingPool(1, maxconn, **config._asdict(), **KEEPALIVE)
+            _pools[config] = pool
+        return pool
+
+
+def close_pool(config):
+    """
+    Function that closes the connections of a database, e.g. before it is
+    dropped.
+    """
+    with _lock:
+        pool = _pools.pop(config, None)
+    if pool is not None:
+        pool.closeall()
+
+
+@contextmanager
+def postgres_connection(config, autocommit=False):
+    """
+    Context manager lending a pooled connection. Commit before leaving the
+    block: an open transaction is rolled back when the connection returns to
+    the pool.
+
+    Args:
+    ------------------------------------
+        config:      PostgresConfig
+        autocommit:  autocommit mode of the connection while lent
+
+    Returns:
+        psycopg2 connection
+    """
+    pool = postgres_pool(config)
+    conn = pool.getconn()
+    try:
+        conn.autocommit = autocommit
+        yield conn
+    finally:
+        if not conn.closed:
+            conn.rollback()
+            conn.autocommit = False
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def cassandra_session(config):
+    """
+    Function that returns the session of a cluster, connecting on first use
+    with heartbeats on idle connections and exponential reconnection.
+
+    Args:
+    ------------------------------------
+        config:  CassandraConfig
+
+    Returns:
+        cassandra Session, shared by every caller
+    """
+    from cassandra.cluster import Cluster, NoHostAvailable
+    from cassandra.policies import ExponentialReconnectionPolicy
+
+    with _lock:
+        if config not in _sessions:
+            cluster = Cluster(list(config.hosts), port=config.port, idle_heartbeat_interval=30,
+                              reconnection_policy=ExponentialReconnectionPolicy(1.0, 60.0))
+            _sessions[config] = (cluster, retry(cluster.connect, (NoHostAvailable,)))
+        return _sessions[config][1]
+
+
+@atexit.register
+def close_all():
+    """
+    Function that closes every pool and cluster of the process.
+    """
+    with _lock:
+        pools, sessions = list(_pools.values()), list(_sessions.values())
+        _pools.clear()
+        _sessions.clear()
+    for pool in pools:
+        pool.closeall()
+    for cluster, session in sessions:
+        cluster.shutdown()
@@ -0,0 +1,358 @@
+# per-stage wall time, CPU time, rows and bytes of the ETL jobs, written as JSON
+# lines or as a Prometheus text file, with an optional profiler around one stage
+#
+#     with stage('parse', bytes_read=size) as s:
+#         df = pd.read_json(filepath, lines=True)
+#         s.add(rows_out=len(df))
+#
+# Nothing is recorded until configure() is called, and stage() is then cheap
+# enough to wrap a single-row lookup.
+
+import os
+import io
+import sys
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import threading
+from datetime import datetime, timezone
+
+
+FORMATS = ['jsonl', 'prom']
+
+COUNTERS = ['calls', 'wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out', 'bytes_read']
+
+HELP = {'calls': 'Times the stage was entered.',
+        'wall_seconds': 'Wall time spent in the stage.',
+        'cpu_seconds': 'CPU time of the thread running the stage.',
+        'rows_in': 'Rows handed to the stage.',
+        'rows_out': 'Rows produced or written by the stage.',
+        'bytes_read': 'Bytes read by the stage.'}
+
+
+class Stage:
+    """
+    One occurrence of a stage; add() counts rows and bytes while it runs.
+    """
+
+    __slots__ = ['rows_in', 'rows_out', 'bytes_read']
+
+    def __init__(self, rows_in=0, rows_out=0, bytes_read=0):
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+        self.bytes_read = bytes_read
+
+    def add(self, rows_in=0, rows_out=0, bytes_read=0):
+        self.rows_in += rows_in
+        self.rows_out += rows_out
+        self.bytes_read += bytes_read
+
+
+class _NullStage:
+    # returned while recording is off, so instrumented code costs a method call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, rows_in=0, rows_out=0, bytes_read=0):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Timer:
+    __slots__ = ['recorder', 'name', 'stage', 'wall', 'cpu', 'profiling']
+
+    def __init__(self, recorder, name, stage):
+        self.recorder = recorder
+        self.name = name
+        self.stage = stage
+
+    def __enter__(self):
+        self.profiling = self.name == self.recorder.profile_stage and self.recorder._start_profile()
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self.stage
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        if self.profiling:
+            self.recorder._stop_profile()
+        self.recorder.record(self.name, wall, cpu, self.stage.rows_in, self.stage.rows_out, self.stage.bytes_read)
+        return False
+
+
+class Recorder:
+    """
+    Totals per stage name, thread safe. Nested stages are all counted, so
+    the wall time of an outer stage includes its inner ones.
+    """
+
+    def __init__(self, job='etl', output=None, fmt=None, profile_stage=None, profiler='cprofile', enabled=None):
+        self.job = job
+        self.output = output
+        self.fmt = fmt or ('prom' if output and output.endswith('.prom') else 'jsonl')
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.enabled = bool(output or profile_stage) if enabled is None else enabled
+        self.started = datetime.now(timezone.utc).isoformat()
+        self.totals = {}
+        self.lock = threading.Lock()
+        self._profile = None
+        self._profiling = False
+
+    def stage(self, name, rows_in=0, rows_out=0, bytes_read=0):
+        """
+        Function that returns a context manager timing one occurrence of a
+        stage; it yields a Stage to count rows and bytes on.
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Timer(self, name, Stage(rows_in, rows_out, bytes_read))
+
+    def record(self, name, wall, cpu=0.0, rows_in=0, rows_out=0, bytes_read=0):
+        """
+        Function that adds an occurrence measured elsewhere, e.g. in a worker
+        process.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            totals = self.totals.setdefault(name, dict.fromkeys(COUNTERS, 0))
+            totals['calls'] += 1
+            totals['wall_seconds'] += wall
+            totals['cpu_seconds'] += cpu
+            totals['rows_in'] += rows_in
+            totals['rows_out'] += rows_out
+            totals['bytes_read'] += bytes_read
+
+    def drain(self):
+        """
+        Function that returns the totals recorded so far and starts over, e.g.
+        to hand a worker process's totals to the parent.
+        """
+        with self.lock:
+            totals, self.totals = self.totals, {}
+        return totals
+
+    def merge(self, totals):
+        """
+        Function that adds the drained totals of another recorder.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            for name, other in totals.items():
+                mine = self.totals.setdefault(name, dict.fromkeys(COUNTERS, 0))
+                for counter in COUNTERS:
+                    mine[counter] += other[counter]
+
+    def _start_profile(self):
+        # one thread at a time; other threads entering the stage are not profiled
+        with self.lock:
+            if self._profiling:
+                return False
+            self._profiling = True
+        if self._profile is None:
+            if self.profiler == 'pyinstrument':
+                from pyinstrument import Profiler
+                self._profile = Profiler()
+            else:
+                self._profile = cProfile.Profile()
+        if self.profiler == 'pyinstrument':
+            self._profile.start()
+        else:
+            self._profile.enable()
+        return True
+
+    def _stop_profile(self):
+        if self.profiler == 'pyinstrument':
+            self._profile.stop()
+        else:
+            self._profile.disable()
+        with self.lock:
+            self._profiling = False
+
+    def lines(self):
+        """
+        Function that returns the totals as JSON lines.
+        """
+        with self.lock:
+            return [json.dumps(dict({'job': self.job, 'started': self.started, 'stage': name}, **totals))
+                    for name, totals in sorted(self.totals.items())]
+
+    def prometheus(self):
+        """
+        Function that returns the totals in the Prometheus text format.
+        """
+        out = io.StringIO()
+        with self.lock:
+            for counter in COUNTERS:
+                metric = 'etl_stage_{}_total'.format(counter)
+                out.write('# HELP {} {}\n# TYPE {} counter\n'.format(metric, HELP[counter], metric))
+                for name, totals in sorted(self.totals.items()):
+                    out.write('{}{{job="{}",stage="{}"}} {}\n'.format(metric, self.job, name, totals[counter]))
+        return out.getvalue()
+
+    def summary(self):
+        """
+        Function that returns a table of the totals, slowest stage first.
+        """
+        with self.lock:
+            items = sorted(self.totals.items(), key=lambda item: -item[1]['wall_seconds'])
+        rows = ['{:<28}{:>8}{:>10}{:>10}{:>12}{:>12}{:>14}'.format('stage', 'calls', 'wall s', 'cpu s',
+                                                                  'rows in', 'rows out', 'bytes read')]
+        for name, totals in items:
+            rows.append('{:<28}{calls:>8}{wall_seconds:>10.2f}{cpu_seconds:>10.2f}{rows_in:>12}{rows_out:>12}'
+                        '{bytes_read:>14}'.format(name[:27], **totals))
+        return '\n'.join(rows)
+
+    def write(self):
+        """
+        Function that writes the totals to the output file: appended JSON
+        lines, or a Prometheus text file replaced atomically (for the node
+        exporter's textfile collector). The profile of the profiled stage is
+        printed, and saved next to the output with cProfile.
+        """
+        if not self.enabled:
+            return
+        if self.output:
+            if self.fmt == 'prom':
+                tmp = self.output + '.tmp'
+                with open(tmp, 'w') as f:
+                    f.write(self.prometheus())
+                os.replace(tmp, self.output)
+            else:
+                with open(self.output, 'a') as f:
+                    f.writelines(line + '\n' for line in self.lines())
+        print(self.summary())
+
+        if self._profile is not None:
+            print('profile of stage {}:'.format(self.profile_stage))
+            if self.profiler == 'pyinstrument':
+                print(self._profile.output_text())
+            else:
+                pstats.Stats(self._profile, stream=sys.stdout).sort_stats('cumulative').print_stats(25)
+                if self.output:
+                    self._profile.dump_stats('{}.{}.prof'.format(self.output, self.profile_stage))
+
+
+_recorder = Recorder()
+
+
+def configure(job, output=None, fmt=None, profile_stage=None, profiler='cprofile'):
+    """
+    Function that starts recording for the process; the totals are written
+    when it exits.
+
+    Args:
+    ------------------------------------
+        job:            job label of the metrics
+        output:         file for the metrics; only printed when None
+        fmt:            'jsonl' or 'prom'; taken from the extension when None
+        profile_stage:  name of a stage to run under the profiler
+        profiler:       'cprofile' or 'pyinstrument'
+
+    Returns:
+        Recorder
+    """
+    global _recorder
+    _recorder = Recorder(job, output, fmt, profile_stage, profiler)
+    if _recorder.enabled:
+        atexit.register(_recorder.write)
+    return _recorder
+
+
+def start_worker(job='worker'):
+    """
+    Function that records in a worker process, without writing: the parent
+    collects the totals with drain() and merge().
+    """
+    global _recorder
+    _recorder = Recorder(job, enabled=True)
+    return _recorder
+
+
+def enabled():
+    """
+    Function that tells whether the process is recording.
+    """
+    return _recorder.enabled
+
+
+def drain():
+    """
+    Function that returns and resets the totals of the process recorder.
+    """
+    return _recorder.drain()
+
+
+def merge(totals):
+    """
+    Function that adds totals drained in another process to the process recorder.
+    """
+    _recorder.merge(totals)
+
+
+def add_arguments(parser):
+    """
+    Function that adds the instrumentation options to an entry point.
+    """
+    parser.add_argument('--metrics', default=None,
+                        help='write per-stage timings and row counts to this file (.jsonl or .prom)')
+    parser.add_argument('--metrics-format', choices=FORMATS, default=None)
+    parser.add_argument('--profile-stage', default=None, help='run this stage under the profiler')
+    parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile')
+
+
+def configure_from_args(job, args):
+    """
+    Function that calls configure() with the options of add_arguments().
+    """
+    return configure(job, args.metrics, args.metrics_format, args.profile_stage, args.profiler)
+
+
+def stage(name, rows_in=0, rows_out=0, bytes_read=0):
+    """
+    Function that times one occurrence of a stage with the process recorder.
+    """
+    return _recorder.stage(name, rows_in, rows_out, bytes_read)
+
+
+def record(name, wall, cpu=0.0, rows_in=0, rows_out=0, bytes_read=0):
+    """
+    Function that adds an occurrence measured elsewhere to the process recorder.
+    """
+    _recorder.record(name, wall, cpu, rows_in, rows_out, bytes_read)
+
+
+def timed_iter(name, iterable, counts=None):
+    """
+    Function that yields the items of an iterable, timing the production of
+    each one as an occurrence of the stage, e.g. a reader's parse. The
+    stage is not profiled.
+
+    Args:
+    ------------------------------------
+        name:      stage name
+        iterable:  the items
+        counts:    optional function of an item returning the keyword
+                   arguments of Stage.add, e.g. its rows and bytes
+    """
+    iterator = iter(iterable)
+    while True:
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        if _recorder.enabled:
+            record(name, time.perf_counter() - wall, time.thread_time() - cpu, **(counts(item) if counts else {}))
+        yield item
@@ -0,0 +1,182 @@
+# processed-files manifest shared by the Postgres, Warehouse and Spark ETLs,
+# so a run only loads files that are new or changed since the last run
+
+import os
+import json
+import hashlib
+from collections import namedtuple
+
+
+# size and mtime are compared first; the content hash is only computed when they
+# differ, so unchanged history is skipped without being read
+FileState = namedtuple('FileState', ['path', 'size', 'mtime', 'sha256'])
+
+manifest_table_create = ("""CREATE TABLE IF NOT EXISTS {} (path VARCHAR(1024) PRIMARY KEY, \
+                         size BIGINT NOT NULL, \
+                         mtime DOUBLE PRECISION NOT NULL, \
+                         sha256 VARCHAR(64) NOT NULL, \
+                         row_count INTEGER, \
+                         loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);""")
+
+manifest_select = ("""SELECT path, size, mtime, sha256 FROM {}""")
+
+# DELETE + INSERT rather than ON CONFLICT so the same statements run on Redshift
+manifest_delete = ("""DELETE FROM {} WHERE path = %s""")
+
+manifest_touch = ("""UPDATE {} SET mtime = %s WHERE path = %s""")
+
+manifest_insert = ("""INSERT INTO {} (path, size, mtime, sha256, row_count) VALUES (%s, %s, %s, %s, %s)""")
+
+
+def content_hash(path, block_size=1 << 20):
+    """
+    Function that computes the sha256 of a file.
+
+    Args:
+    ------------------------------------
+        path:        the file
+        block_size:  bytes read at a time
+
+    Returns:
+        hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    In-memory view of the processed files, keyed by absolute path.
+    Subclasses decide where the entries are persisted.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {})
+
+    def __len__(self):
+        return len(self.entries)
+
+    def state(self, path):
+        """
+        Function that returns the FileState of a path if it needs loading.
+
+        Args:
+        ------------------------------------
+            path:  the file
+
+        Returns:
+            FileState for new or changed files, None for files already loaded
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        known = self.entries.get(path)
+        if known is not None and known.size == stat.st_size and known.mtime == stat.st_mtime:
+            return None
+
+        sha256 = content_hash(path)
+        if known is not None and known.sha256 == sha256:
+            # touched but not changed: remember the new mtime, nothing to load
+            self.touch(known._replace(mtime=stat.st_mtime))
+            return None
+        return FileState(path, stat.st_size, stat.st_mtime, sha256)
+
+    def pending(self, paths):
+        """
+        Function that filters a list of files down to the ones that need loading.
+
+        Args:
+        ------------------------------------
+            paths:  the files found for this run
+
+        Returns:
+            list of FileState, in the order of paths
+        """
+        states = (self.state(path) for path in paths)
+        return [state for state in states if state is not None]
+
+    def touch(self, state):
+        """
+        Function that updates the mtime of a file whose content did not change.
+
+        Args:
+        ------------------------------------
+            state:  FileState with the new mtime
+
+        Returns:
+        """
+        self.entries[state.path] = state
+
+    def record(self, state, rows):
+        """
+        Function that marks a file as loaded.
+
+        Args:
+        ------------------------------------
+            state:  FileState returned by pending()
+            rows:   number of rows loaded from the file
+
+        Returns:
+        """
+        self.entries[state.path] = state
+
+
+class TableManifest(Manifest):
+    """
+    Manifest kept in a database table. record() only executes on the cursor:
+    call it before the commit of the data it describes, so a crash rolls back
+    both and the file is picked up again on the next run.
+    """
+
+    def __init__(self, cur, table='etl_manifest'):
+        self.cur = cur
+        self.table = table
+        cur.execute(manifest_table_create.format(table))
+        cur.execute(manifest_select.format(table))
+        super().__init__((row[0], FileState(*row)) for row in cur.fetchall())
+
+    def touch(self, state):
+        self.cur.execute(manifest_touch.format(self.table), (state.mtime, state.path))
+        super().touch(state)
+
+    def record(self, state, rows):
+        self.cur.execute(manifest_delete.format(self.table), (state.path,))
+        self.cur.execute(manifest_insert.format(self.table), (*state, rows))
+        super().record(state, rows)
+
+
+class JsonManifest(Manifest):
+    """
+    Manifest kept in a JSON file next to the output, for jobs without a
+    database to write to (e.g. the Spark data lake). save() replaces the file
+    atomically, so call it once the output of the recorded files is written.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows = {}
+        entries = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                for entry in json.load(f):
+                    entries[entry['path']] = FileState(entry['path'], entry['size'], entry['mtime'], entry['sha256'])
+                    self.rows[entry['path']] = entry.get('row_count')
+        super().__init__(entries)
+
+    def record(self, state, rows):
+        super().record(state, rows)
+        self.rows[state.path] = rows
+
+    def save(self):
+        """
+        Function that writes the manifest to its JSON file.
+
+        Returns:
+        """
+        entries = [dict(state._asdict(), row_count=self.rows.get(path)) for path, state in sorted(self.entries.items())]
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entries, f, indent=1)
+        os.replace(tmp, self.filename)
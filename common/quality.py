@@ -0,0 +1,320 @@
+# data-quality gate of the loaders: the rules of a dataset are checked over a
+# whole batch at once, rows breaking any of them are set aside with the names
+# of the rules they break, and the good rows go on to the bulk path
+#
+#     good, bad = validate(df, 'log_data')
+#     quarantine(bad, source=filepath)
+#
+# Quarantined rows are appended to a JSON lines file and counted per rule.
+# Every rule also renders as a SQL predicate, so the warehouse moves the bad
+# rows of its staging tables to quarantine tables with a few set-based statements.
+#
+# The rules only see one record at a time. Whether the keys of a fact row are
+# in the dimensions is checked after the load: Postgres enforces it with the
+# foreign keys of songplays, and the warehouse, whose foreign keys Redshift
+# does not enforce, counts the rows breaking a Reference with one join query.
+
+import atexit
+import threading
+from collections import namedtuple
+import instrumentation
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:  # only needed to validate DataFrames, not for the SQL of the warehouse
+    pd = None
+
+
+# check: function of a DataFrame returning a boolean array, True where the rule
+# is broken; sql: predicate true where it is broken
+Rule = namedtuple('Rule', ['name', 'column', 'check', 'sql'])
+
+# column of a fact table whose non-NULL values must be keys of a dimension table
+Reference = namedtuple('Reference', ['column', 'dimension', 'key'])
+
+# epoch milliseconds accepted for ts: 2000-01-01 to 2100-01-01
+TS_RANGE = (946684800000, 4102444800000)
+
+# separator of the rule names of a quarantined row
+SEPARATOR = '; '
+
+
+def _broken(mask):
+    # a boolean Series as a numpy array; NA, e.g. of a string column, is broken
+    return mask.to_numpy(dtype=bool, na_value=True)
+
+
+def _numbers(values):
+    # a numeric column as a float array, NaN where missing; numpy is used
+    # directly, as the pandas operations cost more than the rules on small batches
+    return values.to_numpy(dtype=float, na_value=np.nan)
+
+
+def _text(column):
+    # the column as text, '' for NULL, in both Redshift and Postgres
+    return "COALESCE(CAST({} AS VARCHAR), '')".format(column)
+
+
+def required(column):
+    """
+    Function that returns a rule breaking on missing or empty values.
+    """
+    def check(df):
+        values = df[column]
+        if pd.api.types.is_numeric_dtype(values):
+            return np.isnan(_numbers(values))
+        return values.to_numpy(dtype=object, na_value='') == ''
+
+    return Rule('{} missing'.format(column), column, check, "{} = ''".format(_text(column)))
+
+
+def identifier(column):
+    """
+    Function that returns a rule breaking on values that are not a
+    non-negative integer, e.g. the empty userId of logged out events.
+    """
+    def check(df):
+        if isinstance(df[column].dtype, pd.StringDtype):
+            # digits only, as the SQL below; much faster than parsing the strings as numbers
+            return _broken(~df[column].str.fullmatch('[0-9]+'))
+        values = pd.to_numeric(df[column], errors='coerce')
+        return _broken(values.isna() | (values < 0) | (values != np.floor(values)))
+
+    return Rule('{} not an id'.format(column), column, check, "{} !~ '^[0-9]+$'".format(_text(column)))
+
+
+def between(column, low, high, nullable=False):
+    """
+    Function that returns a rule breaking on numbers outside [low, high], on
+    values that are not numbers and, unless nullable, on missing values.
+    """
+    def check(df):
+        values = df[column]
+        if pd.api.types.is_numeric_dtype(values):
+            numbers = _numbers(values)
+            missing = np.isnan(numbers)
+            broken = missing if not nullable else np.zeros(len(numbers), dtype=bool)
+        else:
+            parsed = pd.to_numeric(values, errors='coerce')
+            numbers = _numbers(parsed)
+            # values that are not numbers are broken even where missing is allowed
+            broken = _broken(parsed.isna() if not nullable else parsed.isna() & values.notna())
+        return broken | (numbers < low) | (numbers > high)
+
+    sql = '{} < {} OR {} > {}'.format(column, low, column, high)
+    if not nullable:
+        sql = '{} IS NULL OR {}'.format(column, sql)
+    return Rule('{} out of range'.format(column), column, check, sql)
+
+
+def one_of(column, values):
+    """
+    Function that returns a rule breaking on values outside a set.
+    """
+    def check(df):
+        return _broken(~df[column].isin(values))
+
+    sql = '{} NOT IN ({})'.format(_text(column), ', '.join("'{}'".format(value) for value in values))
+    return Rule('{} not one of {}'.format(column, ', '.join(values)), column, check, sql)
+
+
+# the rules of the raw records, by dataset; keys referenced by other tables
+# (song_id, artist_id, userId) and the songplay key (ts, userId, sessionId,
+# itemInSession) must be present and well formed
+RULES = {'song_data': [required('song_id'),
+                       required('artist_id'),
+                       required('title'),
+                       between('duration', 0, 24 * 3600),
+                       between('year', 0, 2100),
+                       between('artist_latitude', -90, 90, nullable=True),
+                       between('artist_longitude', -180, 180, nullable=True)],
+         'log_data': [identifier('userId'),
+                      between('ts', *TS_RANGE),
+                      required('sessionId'),
+                      identifier('itemInSession'),
+                      one_of('level', ['free', 'paid']),
+                      between('length', 0, 24 * 3600, nullable=True)]}
+
+# rows of the raw records the rules apply to; the others are not loaded
+SCOPES = {'song_data': None, 'log_data': "page = 'NextSong'"}
+
+
+def validate(df, dataset):
+    """
+    Function that checks every rule of a dataset over a DataFrame at once.
+    Rules of columns the DataFrame does not have are left out.
+
+    Args:
+    ------------------------------------
+        df:       raw records of the dataset, in its scope
+        dataset:  'song_data' or 'log_data'
+
+    Returns:
+        (good rows, bad rows with dataset and reason columns, or None)
+    """
+    rules = [rule for rule in RULES[dataset] if rule.column in df.columns]
+    if not rules or not len(df):
+        return df, None
+    broken = np.column_stack([rule.check(df) for rule in rules])
+    bad = broken.any(axis=1)
+    if not bad.any():
+        return df, None
+
+    names = np.array([rule.name for rule in rules])
+    reasons = [SEPARATOR.join(names[row]) for row in broken[bad]]
+    return df[~bad], df[bad].assign(dataset=dataset, reason=reasons)
+
+
+def reference_count(table, references):
+    """
+    Function that renders the query counting the rows of a table whose keys
+    are not in their dimension, one count per reference. NULL keys, e.g. the
+    song of an event matching no song, are not counted.
+
+    Args:
+    ------------------------------------
+        table:       the fact table, or a table of its new rows
+        references:  list of Reference
+
+    Returns:
+        (SQL, rule name of each count)
+    """
+    joins, counts, names = [], [], []
+    for n, reference in enumerate(references):
+        alias = 'r{}'.format(n)
+        joins.append('LEFT JOIN (SELECT DISTINCT {1} FROM {0}) as {2} ON ({2}.{1} = f.{3})'.format(
+            reference.dimension, reference.key, alias, reference.column))
+        counts.append('SUM(CASE WHEN f.{0} IS NOT NULL AND {1}.{2} IS NULL THEN 1 ELSE 0 END)'.format(
+            reference.column, alias, reference.key))
+        names.append('{} not in {}'.format(reference.column, reference.dimension))
+    return 'SELECT {} FROM {} as f {}'.format(', '.join(counts), table, ' '.join(joins)), names
+
+
+def quarantine_statements(dataset, table, quarantine_table, columns, now):
+    """
+    Function that renders the rules of a dataset as the statements moving the
+    bad rows of a staging table to its quarantine table.
+
+    Args:
+    ------------------------------------
+        dataset:           'song_data' or 'log_data'
+        table:             the staging table
+        quarantine_table:  its quarantine table: its columns, reason and quarantined_at
+        columns:           column names of the staging table
+        now:               SQL of the current time
+
+    Returns:
+        (query counting the rows breaking each rule, INSERT into the
+        quarantine table, DELETE from the staging table)
+    """
+    rules = RULES[dataset]
+    scope = SCOPES[dataset]
+    broken = ['({})'.format(rule.sql) for rule in rules]
+    where = ' OR '.join(broken)
+    if scope:
+        where = '{} AND ({})'.format(scope, where)
+
+    count = 'SELECT {} FROM {} WHERE {}'.format(
+        ', '.join('SUM(CASE WHEN {} THEN 1 ELSE 0 END)'.format(sql) for sql in broken), table, where)
+    reason = 'SUBSTRING({} FROM {})'.format(
+        ' || '.join("CASE WHEN {} THEN '{}{}' ELSE '' END".format(sql, SEPARATOR, rule.name)
+                    for rule, sql in zip(rules, broken)), len(SEPARATOR) + 1)
+    insert = 'INSERT INTO {} ({}, reason, quarantined_at) SELECT {}, {}, {} FROM {} WHERE {}'.format(
+        quarantine_table, ', '.join(columns), ', '.join(columns), reason, now, table, where)
+    delete = 'DELETE FROM {} WHERE {}'.format(table, where)
+    return count, insert, delete
+
+
+class Quarantine:
+    """
+    Appends quarantined rows to a JSON lines file with the rules they break
+    and where they came from, and counts the violations of every rule.
+    Thread safe.
+    """
+
+    def __init__(self, output=None):
+        self.output = output
+        self.rows = 0
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def add(self, bad, source=None):
+        """
+        Function that quarantines the bad rows returned by validate().
+        """
+        if bad is None or not len(bad):
+            return
+        counts = {}
+        for reason in bad['reason']:
+            for name in reason.split(SEPARATOR):
+                counts[name] = counts.get(name, 0) + 1
+        if source is not None:
+            bad = bad.assign(source=source)
+        lines = bad.to_json(orient='records', lines=True, date_format='iso') if self.output else ''
+        with self.lock:
+            self.count(counts, len(bad))
+            if lines:
+                with open(self.output, 'a') as f:
+                    f.write(lines.rstrip('\n') + '\n')
+
+    def count(self, counts, rows=0):
+        """
+        Function that adds violations counted elsewhere, e.g. by the
+        warehouse, and the number of rows quarantined for them.
+        """
+        self.rows += rows
+        for name, n in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + n
+            instrumentation.record('rule ' + name, 0.0, rows_out=n)
+
+    def summary(self):
+        """
+        Function that returns the violations per rule, most frequent first.
+        """
+        rows = ['{} rows quarantined{}'.format(self.rows, ' to ' + self.output if self.output and self.rows else '')]
+        for name, n in sorted(self.counts.items(), key=lambda item: -item[1]):
+            rows.append('{:<40}{:>10}'.format(name, n))
+        return '\n'.join(rows)
+
+    def report(self):
+        if self.counts:
+            print(self.summary())
+
+
+_quarantine = Quarantine()
+
+
+def configure(output=None):
+    """
+    Function that sets the quarantine file of the process; the violations per
+    rule are printed when it exits.
+    """
+    global _quarantine
+    _quarantine = Quarantine(output)
+    atexit.register(_quarantine.report)
+    return _quarantine
+
+
+def quarantine(bad, source=None):
+    """
+    Function that quarantines bad rows with the process quarantine.
+    """
+    _quarantine.add(bad, source)
+
+
+def count(counts, rows=0):
+    """
+    Function that adds violations and quarantined rows counted elsewhere to
+    the process quarantine.
+    """
+    with _quarantine.lock:
+        _quarantine.count(counts, rows)
+
+
+def add_arguments(parser, default='quarantine.jsonl'):
+    """
+    Function that adds the quarantine option to an entry point.
+    """
+    parser.add_argument('--quarantine', default=default,
+                        help='append rows failing the data-quality rules to this JSON lines file')
@@ -0,0 +1,258 @@
+# rollup tables of the songplays fact: play counts pre-aggregated by time
+# bucket and a few dimensions, kept up to date from the songplays each ETL run
+# loads, and a query API answering play counts from the smallest rollup that
+# holds the dimensions, grain and time range asked for
+#
+#     source, sql, params = plan(['level'], grain='day', start=datetime(2018, 11, 1), fact='songplays')
+#     source, rows = plays(cur, ['song_id'], start=week, end=week + timedelta(7), top=10)
+#
+# A rollup holds one row per bucket and dimension values, with the number of
+# plays. Plays only add up, so the rows of a run are aggregated and added to
+# the rows already there, without reading the fact table again. Missing
+# levels, locations, songs and artists are counted under '', so every key is
+# comparable. The SQL runs on both Redshift and Postgres.
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+
+# name: table; grain: time bucket of a row; dimensions: columns of the fact kept
+Rollup = namedtuple('Rollup', ['name', 'grain', 'dimensions'])
+
+# the rollups, smallest first, which is the order tried without measured sizes
+ROLLUPS = [Rollup('plays_hourly_level', 'hour', ['level']),
+           Rollup('plays_daily_user', 'day', ['user_id', 'level', 'location']),
+           Rollup('plays_hourly_song', 'hour', ['song_id', 'artist_id', 'level'])]
+
+# time buckets, finest first; a rollup answers its own grain and every coarser one
+GRAINS = ['hour', 'day', 'week', 'month', 'year']
+
+# dimensions stored as '' when missing in the fact table
+NULLABLE = {'level', 'location', 'song_id', 'artist_id'}
+
+# types of the dimensions; user_id is overridden where the fact stores it as text
+TYPES = {'user_id': 'INTEGER', 'level': 'VARCHAR', 'location': 'VARCHAR', 'song_id': 'VARCHAR',
+         'artist_id': 'VARCHAR', 'session_id': 'INTEGER'}
+
+
+def _key(column):
+    # a dimension as stored in the rollups
+    return "COALESCE({0}, '')".format(column) if column in NULLABLE else column
+
+
+def _moment(moment):
+    # a date as the datetime of its midnight
+    return moment if isinstance(moment, datetime) else datetime(moment.year, moment.month, moment.day)
+
+
+def columns(rollup, types=None):
+    """
+    Function that returns the columns and primary key of a rollup table.
+
+    Args:
+    ------------------------------------
+        rollup:  Rollup
+        types:   dict of dimension -> SQL type overriding TYPES
+
+    Returns:
+        (list of (name, type), primary key column names)
+    """
+    types = dict(TYPES, **(types or {}))
+    dimensions = [(name, types[name] + ' NOT NULL') for name in rollup.dimensions]
+    return [('bucket', 'TIMESTAMP NOT NULL')] + dimensions + [('plays', 'BIGINT NOT NULL')], \
+        ['bucket'] + rollup.dimensions
+
+
+def aggregate(rollup, source):
+    """
+    Function that renders the query aggregating songplays into the rows of a
+    rollup: bucket, dimensions and plays.
+
+    Args:
+    ------------------------------------
+        rollup:  Rollup
+        source:  songplays table, or a relation with its columns, optionally
+                 followed by a WHERE clause
+    """
+    keys = ["date_trunc('{}', start_time)".format(rollup.grain)] + [_key(name) for name in rollup.dimensions]
+    return 'SELECT {}, COUNT(*) as plays FROM {} GROUP BY {}'.format(
+        ', '.join('{} as {}'.format(key, name) for key, name in zip(keys, ['bucket'] + rollup.dimensions)),
+        source, ', '.join(str(n + 1) for n in range(len(keys))))
+
+
+def update_statements(rollup, source):
+    """
+    Function that renders the statements adding new songplays to a rollup:
+    rows already there get the new plays added, the others are inserted.
+    Run them in this order and in one transaction.
+
+    Args:
+    ------------------------------------
+        rollup:  Rollup
+        source:  the new songplays, as for aggregate()
+
+    Returns:
+        (UPDATE, INSERT)
+    """
+    keys = ['bucket'] + rollup.dimensions
+    delta = aggregate(rollup, source)
+    update = 'UPDATE {0} SET plays = {0}.plays + d.plays FROM ({1}) as d WHERE {2}'.format(
+        rollup.name, delta, ' AND '.join('{0}.{1} = d.{1}'.format(rollup.name, key) for key in keys))
+    insert = 'INSERT INTO {0} ({1}, plays) SELECT {2}, d.plays FROM ({3}) as d ' \
+             'WHERE NOT EXISTS (SELECT 1 FROM {0} as r WHERE {4})'.format(
+                 rollup.name, ', '.join(keys), ', '.join('d.' + key for key in keys), delta,
+                 ' AND '.join('r.{0} = d.{0}'.format(key) for key in keys))
+    return update, insert
+
+
+def rebuild_statements(rollup, fact):
+    """
+    Function that renders the statements rebuilding a rollup from the whole
+    fact table, e.g. for a new rollup or after loads that skipped them.
+
+    Returns:
+        (DELETE, INSERT)
+    """
+    return 'DELETE FROM {}'.format(rollup.name), \
+        'INSERT INTO {} ({}, plays) {}'.format(rollup.name, ', '.join(['bucket'] + rollup.dimensions),
+                                               aggregate(rollup, fact))
+
+
+def truncate(moment, grain):
+    """
+    Function that truncates a datetime or date to the start of its bucket,
+    as date_trunc() does; weeks start on Monday.
+    """
+    moment = _moment(moment).replace(minute=0, second=0, microsecond=0)
+    if grain == 'hour':
+        return moment
+    moment = moment.replace(hour=0)
+    if grain == 'day':
+        return moment
+    if grain == 'week':
+        return moment - timedelta(days=moment.weekday())
+    if grain == 'month':
+        return moment.replace(day=1)
+    return moment.replace(month=1, day=1)
+
+
+def answers(rollup, dimensions=(), grain=None, start=None, end=None, filters=None):
+    """
+    Function that tells whether a rollup holds everything a request needs:
+    its dimensions and filtered columns, a grain at least as coarse as the
+    rollup's, and time bounds on the rollup's bucket boundaries.
+    """
+    needed = set(dimensions) | set(filters or {})
+    if not needed <= set(rollup.dimensions):
+        return False
+    if grain is not None and GRAINS.index(grain) < GRAINS.index(rollup.grain):
+        return False
+    return all(bound is None or truncate(bound, rollup.grain) == _moment(bound) for bound in (start, end))
+
+
+def route(dimensions=(), grain=None, start=None, end=None, filters=None, sizes=None, rollups=ROLLUPS):
+    """
+    Function that picks the smallest rollup answering a request.
+
+    Args:
+    ------------------------------------
+        sizes:    dict of rollup name -> rows, e.g. from measure(); without
+                  it the rollups are tried in the order of ROLLUPS
+        rollups:  the rollups to choose from
+
+    Returns:
+        Rollup, or None when only the fact table can answer
+    """
+    candidates = [rollup for rollup in rollups if answers(rollup, dimensions, grain, start, end, filters)]
+    if sizes:
+        candidates.sort(key=lambda rollup: sizes.get(rollup.name, float('inf')))
+    return candidates[0] if candidates else None
+
+
+def plan(dimensions=(), grain=None, start=None, end=None, filters=None, top=None, fact='songplays', sizes=None,
+         rollups=ROLLUPS):
+    """
+    Function that renders the query counting plays by dimensions and time
+    bucket, on the smallest rollup answering it or else on the fact table.
+    Both give the same rows.
+
+    Args:
+    ------------------------------------
+        dimensions:  columns to group by, e.g. ['user_id', 'level']
+        grain:       'hour', 'day', 'week', 'month', 'year', or None for
+                     totals over the time range
+        start, end:  time range [start, end); open when None
+        filters:     dict of column -> value, or list of values
+        top:         only the top rows by plays
+        fact:        the fact table, songplays or fact_songplay
+        sizes:       rows per rollup, see route()
+        rollups:     the rollups to choose from; [] for the fact table
+
+    Returns:
+        (rollup or fact table name, SQL with %s parameters, parameters); the
+        rows are (period if grain, dimensions..., plays)
+    """
+    filters = filters or {}
+    rollup = route(dimensions, grain, start, end, filters, sizes, rollups)
+    if rollup is not None:
+        source, time_column, count = rollup.name, 'bucket', 'CAST(SUM(plays) as BIGINT)'
+        key = str
+    else:
+        source, time_column, count = fact, 'start_time', 'COUNT(*)'
+        key = _key
+
+    selected = (["date_trunc('{}', {})".format(grain, time_column)] if grain else []) + \
+        [key(name) for name in dimensions]
+    names = (['period'] if grain else []) + list(dimensions)
+    where, params = [], []
+    if start is not None:
+        where.append('{} >= %s'.format(time_column))
+        params.append(start)
+    if end is not None:
+        where.append('{} < %s'.format(time_column))
+        params.append(end)
+    for name, value in sorted(filters.items()):
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        where.append('{} IN ({})'.format(key(name), ', '.join(['%s'] * len(values))))
+        params.extend(values)
+
+    query = 'SELECT {} FROM {}'.format(
+        ', '.join(['{} as {}'.format(column, name) for column, name in zip(selected, names)] +
+                  ['{} as plays'.format(count)]), source)
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    if names:
+        query += ' GROUP BY ' + ', '.join(str(n + 1) for n in range(len(names)))
+    order = ', '.join(str(n + 1) for n in range(len(names)))
+    if top:
+        query += ' ORDER BY plays DESC{} LIMIT {:d}'.format(', ' + order if order else '', top)
+    elif order:
+        query += ' ORDER BY ' + order
+    return source, query, params
+
+
+def plays(cur, dimensions=(), grain=None, start=None, end=None, filters=None, top=None, fact='songplays',
+          sizes=None, rollups=ROLLUPS):
+    """
+    Function that counts plays by dimensions and time bucket, see plan().
+
+    Returns:
+        (rollup or fact table name, list of rows)
+    """
+    source, query, params = plan(dimensions, grain, start, end, filters, top, fact, sizes, rollups)
+    cur.execute(query, params)
+    return source, cur.fetchall()
+
+
+def measure(cur, rollups=ROLLUPS):
+    """
+    Function that counts the rows of every rollup, for route().
+
+    Returns:
+        dict of rollup name -> rows
+    """
+    sizes = {}
+    for rollup in rollups:
+        cur.execute('SELECT COUNT(*) FROM {}'.format(rollup.name))
+        sizes[rollup.name] = cur.fetchone()[0]
+    return sizes
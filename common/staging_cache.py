@@ -0,0 +1,327 @@
+# "normalize once" staging cache: the raw song_data and log_data JSON converted
+# to typed Parquet, read by every loader with column projection and predicate
+# pushdown instead of parsing the JSON again
+#
+#     cache/song_data/part-<key>.parquet
+#     cache/log_data/year=2018/month=11/part-<key>.parquet
+#
+# The input files are converted in parts of about part_bytes. A part is named
+# by the content hashes of its files, and the index (_index.json in the
+# dataset directory) maps every file to its part, so a run only converts new
+# files and the parts holding a changed or deleted file. The columns are in
+# the order and of the types of the Redshift staging tables, so the warehouse
+# can COPY the files as they are.
+#
+# Readers get the rows in the order of the JSON files, which are named by
+# date: parts by their first file, and the files of a part by year and month.
+
+import os
+import json
+import hashlib
+import argparse
+from manifest import FileState, content_hash
+from instrumentation import stage
+
+try:
+    import pyarrow as pa
+    import pyarrow.json as pj
+    import pyarrow.parquet as pq
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:  # only needed to build or read the cache
+    pa = None
+
+
+DATASETS = ['song_data', 'log_data']
+
+# (name, type) in the column order of the staging tables
+COLUMNS = {'song_data': [('num_songs', 'int32'), ('artist_id', 'string'), ('artist_latitude', 'float64'),
+                         ('artist_longitude', 'float64'), ('artist_location', 'string'), ('artist_name', 'string'),
+                         ('song_id', 'string'), ('title', 'string'), ('duration', 'float64'), ('year', 'int32')],
+           'log_data': [('artist', 'string'), ('auth', 'string'), ('firstName', 'string'), ('gender', 'string'),
+                        ('itemInSession', 'int32'), ('lastName', 'string'), ('length', 'float64'),
+                        ('level', 'string'), ('location', 'string'), ('method', 'string'), ('page', 'string'),
+                        ('registration', 'float64'), ('sessionId', 'int32'), ('song', 'string'),
+                        ('status', 'int32'), ('ts', 'int64'), ('userAgent', 'string'), ('userId', 'string')]}
+
+# hive-style partition columns of a dataset, derived from ts
+PARTITIONS = {'song_data': [], 'log_data': ['year', 'month']}
+
+INDEX = '_index.json'
+
+
+def schema(dataset):
+    """
+    Function that returns the pyarrow schema of a dataset's files.
+    """
+    if pa is None:
+        raise RuntimeError('pyarrow is required for the staging cache')
+    return pa.schema([(name, getattr(pa, kind)()) for name, kind in COLUMNS[dataset]])
+
+
+def read_index(directory):
+    """
+    Function that reads the index of a cached dataset.
+
+    Returns:
+        (dict of path -> (FileState, part), dict of part -> list of files)
+    """
+    filename = os.path.join(directory, INDEX)
+    if not os.path.exists(filename):
+        return {}, {}
+    with open(filename) as f:
+        index = json.load(f)
+    files = {entry['path']: (FileState(entry['path'], entry['size'], entry['mtime'], entry['sha256']), entry['part'])
+             for entry in index['files']}
+    return files, index['parts']
+
+
+def write_index(directory, files, parts):
+    """
+    Function that replaces the index of a cached dataset atomically.
+    """
+    index = {'files': [dict(state._asdict(), part=part) for path, (state, part) in sorted(files.items())],
+             'parts': parts}
+    tmp = os.path.join(directory, INDEX + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, os.path.join(directory, INDEX))
+
+
+def file_state(path, known):
+    """
+    Function that returns the FileState of an input file, hashing it only
+    when its size or mtime differ from the known state.
+    """
+    stat = os.stat(path)
+    if known is not None and known.size == stat.st_size and known.mtime == stat.st_mtime:
+        return known
+    return FileState(path, stat.st_size, stat.st_mtime, content_hash(path))
+
+
+def group_parts(states, part_bytes):
+    """
+    Function that groups files, in path order, into parts of about part_bytes.
+
+    Returns:
+        list of lists of FileState
+    """
+    parts, current, size = [], [], 0
+    for state in sorted(states, key=lambda state: state.path):
+        if current and size + state.size > part_bytes:
+            parts.append(current)
+            current, size = [], 0
+        current.append(state)
+        size += state.size
+    if current:
+        parts.append(current)
+    return parts
+
+
+def part_key(states):
+    """
+    Function that names a part by the content of its files.
+    """
+    digest = hashlib.sha256()
+    for state in states:
+        digest.update(state.sha256.encode('ascii'))
+    return digest.hexdigest()[:20]
+
+
+def write_parquet(table, filename):
+    """
+    Function that writes a Parquet file atomically.
+    """
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = filename + '.tmp'
+    pq.write_table(table, tmp, compression='snappy')
+    os.replace(tmp, filename)
+
+
+def convert_part(states, dataset, directory, key):
+    """
+    Function that converts the JSON files of a part to Parquet, one file per
+    partition.
+
+    Returns:
+        (list of Parquet files relative to directory, rows)
+    """
+    file_schema = schema(dataset)
+    options = pj.ParseOptions(explicit_schema=file_schema, unexpected_field_behavior='ignore')
+    with stage('parse', bytes_read=sum(state.size for state in states)) as timed:
+        table = pa.concat_tables([pj.read_json(state.path, parse_options=options) for state in states])
+        table = table.select(file_schema.names).cast(file_schema)
+        timed.add(rows_out=table.num_rows)
+
+    outputs = []
+    with stage('write cache', rows_in=table.num_rows):
+        if not PARTITIONS[dataset]:
+            outputs.append('part-{}.parquet'.format(key))
+            write_parquet(table, os.path.join(directory, outputs[-1]))
+        else:
+            start_time = pc.cast(table['ts'], pa.timestamp('ms', tz='UTC'))
+            years, months = pc.year(start_time), pc.month(start_time)
+            keys = pa.table({'year': years, 'month': months}).group_by(['year', 'month']).aggregate([])
+            for year, month in zip(keys['year'].to_pylist(), keys['month'].to_pylist()):
+                mask = pc.and_(pc.equal(years, year), pc.equal(months, month))
+                outputs.append('year={}/month={}/part-{}.parquet'.format(year, month, key))
+                write_parquet(table.filter(mask), os.path.join(directory, outputs[-1]))
+    return outputs, table.num_rows
+
+
+def normalize(source, cache_dir, dataset, part_bytes=64 * 1024 * 1024):
+    """
+    Function that brings the cache of a dataset up to date with its raw JSON.
+
+    Args:
+    ------------------------------------
+        source:      directory of the raw JSON, e.g. data/song_data
+        cache_dir:   directory of the cache
+        dataset:     'song_data' or 'log_data'
+        part_bytes:  JSON bytes converted into one part
+
+    Returns:
+        (number of files converted, number of files in the cache)
+    """
+    if pa is None:
+        raise RuntimeError('pyarrow is required for the staging cache')
+    directory = os.path.join(cache_dir, dataset)
+    os.makedirs(directory, exist_ok=True)
+    files, parts = read_index(directory)
+
+    with stage('discover') as timed:
+        paths = sorted(os.path.abspath(os.path.join(root, name))
+                       for root, dirs, names in os.walk(source) for name in names if name.endswith('.json'))
+        timed.add(rows_out=len(paths))
+    with stage('manifest', rows_in=len(paths)):
+        states = {path: file_state(path, files[path][0] if path in files else None) for path in paths}
+
+    # parts with a changed, deleted or missing file are converted again with the new files
+    stale = set()
+    for path, (state, part) in files.items():
+        if path not in states or states[path].sha256 != state.sha256:
+            stale.add(part)
+    for part, outputs in parts.items():
+        if not all(os.path.exists(os.path.join(directory, output)) for output in outputs):
+            stale.add(part)
+    # touched but unchanged files keep their part, with the new mtime
+    kept = {path: (states[path], part) for path, (state, part) in files.items() if part not in stale}
+    pending = [state for path, state in states.items() if path not in kept]
+
+    new_parts = {part: outputs for part, outputs in parts.items() if part not in stale}
+    for group in group_parts(pending, part_bytes):
+        key = part_key(group)
+        outputs, rows = convert_part(group, dataset, directory, key)
+        new_parts[key] = outputs
+        for state in group:
+            kept[state.path] = (state, key)
+        print('{}: {} files, {} rows converted into part {}'.format(dataset, len(group), rows, key))
+    write_index(directory, kept, new_parts)
+
+    # files of the replaced parts, and of runs interrupted before their index was written
+    referenced = {os.path.join(directory, output) for outputs in new_parts.values() for output in outputs}
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if name.startswith('part-') and path not in referenced:
+                os.remove(path)
+    return len(pending), len(kept)
+
+
+def _partition(output):
+    # (year, month) of a Parquet file as numbers, () outside partitions
+    return tuple(int(directory.split('=', 1)[1]) for directory in output.split('/')[:-1])
+
+
+def ordered_parts(cache_dir, name):
+    """
+    Function that lists the parts of a cached dataset in the path order of
+    their first JSON file, with the Parquet files of each part by year and
+    month, so the rows are read in the order of the JSON files.
+
+    Returns:
+        list of (part, list of Parquet files relative to the dataset directory)
+    """
+    files, parts = read_index(os.path.join(cache_dir, name))
+    first = {}
+    for path, (state, part) in files.items():
+        first[part] = min(path, first.get(part, path))
+    return [(part, sorted(parts[part], key=_partition)) for part in sorted(parts, key=lambda part: first.get(part, ''))]
+
+
+def part_state(cache_dir, name, part):
+    """
+    Function that returns the FileState a manifest records a loaded part
+    under. A part is named by the content of its files, so the key stands
+    for the content hash.
+    """
+    return FileState(os.path.join(os.path.abspath(cache_dir), name, 'part-{}'.format(part)), 0, 0.0, part)
+
+
+def open_dataset(cache_dir, name):
+    """
+    Function that opens a cached dataset for reading with pyarrow.
+
+    Args:
+    ------------------------------------
+        cache_dir:  directory of the cache
+        name:       'song_data' or 'log_data'
+
+    Returns:
+        pyarrow.dataset.Dataset; log_data has the year and month partition
+        columns, so filters on them skip whole directories
+    """
+    if pa is None:
+        raise RuntimeError('pyarrow is required for the staging cache')
+    return ds.dataset(os.path.join(cache_dir, name), format='parquet', partitioning='hive')
+
+
+def iter_frames(cache_dir, name, columns=None, filter=None, batch_rows=100000, parts=None):
+    """
+    Function that reads a cached dataset as pandas DataFrames, reading only
+    the given columns and the row groups and partitions the filter can match.
+    The rows come in the order of ordered_parts(), not in the string order
+    of the directories.
+
+    Args:
+    ------------------------------------
+        cache_dir:   directory of the cache
+        name:        'song_data' or 'log_data'
+        columns:     columns to read; all of them when None
+        filter:      pyarrow.dataset expression, e.g. ds.field('page') == 'NextSong'
+        batch_rows:  maximum rows per DataFrame
+        parts:       keys of the parts to read; all of them when None
+
+    Returns:
+        generator of DataFrames
+    """
+    if pa is None:
+        raise RuntimeError('pyarrow is required for the staging cache')
+    directory = os.path.join(cache_dir, name)
+    files = [os.path.join(directory, output) for part, outputs in ordered_parts(cache_dir, name)
+             if parts is None or part in parts for output in outputs]
+    if not files:
+        return
+    # a list of files keeps its order, where a directory is discovered in string order
+    dataset = ds.dataset(files, format='parquet', partitioning='hive', partition_base_dir=directory)
+    scanner = dataset.scanner(columns=columns, filter=filter, batch_size=batch_rows)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the raw song and log JSON into the Parquet staging cache.')
+    parser.add_argument('--input', required=True, help='directory with song_data and log_data')
+    parser.add_argument('--cache', required=True, help='directory of the cache')
+    parser.add_argument('--datasets', nargs='+', choices=DATASETS, default=DATASETS)
+    parser.add_argument('--part-mb', type=int, default=64, help='JSON converted into one Parquet part')
+    args = parser.parse_args()
+
+    for name in args.datasets:
+        converted, cached = normalize(os.path.join(args.input, name), args.cache, name, args.part_mb * 1024 * 1024)
+        print('{}: {} of {} files converted'.format(name, converted, cached))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# reproducible synthetic song and log datasets in the layout of the bundled
+# sample, at 1x to 1000x its size: song_data/A/B/C/TR*.json with one song per
+# file, log_data/YYYY/MM/YYYY-MM-DD-events.json, and the same events as
+# event_data/YYYY-MM-DD-events.csv for the Cassandra project
+#
+# Songs per artist, plays per song and activity per user follow Zipf-like
+# laws, and session lengths are log-normal, so a few artists, songs, users and
+# sessions dominate as in real listening data. The same seed and scale always
+# give the same files.
+
+import os
+import csv
+import json
+import random
+import string
+import argparse
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+
+# the bundled sample: 71 song files and 30 days of about 270 events
+SONGS_PER_SCALE = 71
+EVENTS_PER_DAY_PER_SCALE = 270
+USERS_PER_SCALE = 96
+DAYS = 30
+FIRST_DAY = datetime(2018, 11, 1, tzinfo=timezone.utc)
+
+LOG_COLUMNS = ['artist', 'auth', 'firstName', 'gender', 'itemInSession', 'lastName', 'length', 'level', 'location',
+               'method', 'page', 'registration', 'sessionId', 'song', 'status', 'ts', 'userAgent', 'userId']
+
+# columns of the per-day event csv files read by consolidate_events.py
+CSV_COLUMNS = ['artist', 'auth', 'firstName', 'gender', 'itemInSession', 'lastName', 'length', 'level', 'location',
+               'method', 'page', 'registration', 'sessionId', 'song', 'status', 'ts', 'userId']
+
+# pages other than NextSong, with their share of the sample's other events
+OTHER_PAGES = [('Home', 0.66), ('Login', 0.075), ('Logout', 0.074), ('Downgrade', 0.05), ('Settings', 0.046),
+               ('Help', 0.039), ('About', 0.03), ('Upgrade', 0.017), ('Save Settings', 0.009)]
+NEXT_SONG_SHARE = 0.85
+
+LOCATIONS = ['Dallas-Fort Worth-Arlington, TX', 'Tampa-St. Petersburg-Clearwater, FL', 'Nashville, TN',
+             'San Francisco-Oakland-Hayward, CA', 'New York-Newark-Jersey City, NY-NJ-PA',
+             'Chicago-Naperville-Elgin, IL-IN-WI',
+             'Lansing-East Lansing, MI', 'Atlanta-Sandy Springs-Roswell, GA', 'Portland-South Portland, ME',
+             'Seattle-Tacoma-Bellevue, WA', 'Phoenix-Mesa-Scottsdale, AZ', 'Detroit-Warren-Dearborn, MI']
+COORDINATES = [(32.7767, -96.797), (27.9506, -82.4572), (36.16778, -86.77836), (37.77916, -122.42005),
+               (40.71455, -74.00712), (41.88415, -87.63241), (42.73254, -84.55553), (33.749, -84.38798),
+               (43.66147, -70.25533), (47.60356, -122.32944), (33.44826, -112.0758), (42.33168, -83.04792)]
+USER_AGENTS = ['Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.2; WOW64; Trident/6.0)',
+               '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.78.2 (KHTML, like Gecko) '
+               'Version/7.0.6 Safari/537.78.2"',
+               '"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+               'Chrome/36.0.1985.143 Safari/537.36"',
+               'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:31.0) Gecko/20100101 Firefox/31.0']
+FIRST_NAMES = ['Jayden', 'Jacob', 'Kate', 'Lily', 'Chloe', 'Tegan', 'Aleena', 'Mohammad', 'Ryan', 'Avery',
+               'Matthew', 'Jordan', 'Layla', 'Sara', 'Emily', 'Wyatt', 'Kevin', 'Ava', 'Noah', 'Olivia']
+LAST_NAMES = ['Bell', 'Klein', 'Harrell', 'Koch', 'Cuevas', 'Levine', 'Kirby', 'Rodriguez', 'Smith', 'Watkins',
+              'Owens', 'Jones', 'Griffin', 'Johnson', 'Scott', 'Rogers', 'Williams', 'Robinson', 'Perez', 'Lee']
+SYLLABLES = ['la', 'mo', 'ri', 'ka', 'ze', 'to', 'ven', 'dar', 'sol', 'mi', 'ra', 'nel', 'bo', 'shi', 'qua',
+             'ter', 'lo', 'fin', 'ga', 'ur', 'pel', 'xo', 'dra', 'sen']
+
+
+def zipf_weights(n, exponent=1.1):
+    """
+    Function that returns the cumulative weights of ranks 1..n under a Zipf
+    law, for random.choices.
+    """
+    total = 0.0
+    weights = []
+    for rank in range(1, n + 1):
+        total += rank ** -exponent
+        weights.append(total)
+    return weights
+
+
+def word(rng, syllables=(2, 4)):
+    """
+    Function that makes up a capitalised word.
+    """
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(*syllables))).capitalize()
+
+
+def identifier(rng, prefix):
+    """
+    Function that makes an id shaped like the sample's, e.g. SOGVQGJ12AB017F169.
+    """
+    return prefix + ''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(16))
+
+
+class Catalog:
+    """
+    The artists, songs and users shared by every generated file, derived
+    from the seed alone so each worker process can rebuild it.
+    """
+
+    def __init__(self, scale, seed):
+        rng = random.Random('catalog-{}'.format(seed))
+        self.songs = []
+        artists = []
+        for n in range(max(1, round(SONGS_PER_SCALE * scale / 3))):
+            latitude, longitude = rng.choice(COORDINATES) if rng.random() < 0.4 else (None, None)
+            artists.append({'artist_id': identifier(rng, 'AR'),
+                            'artist_name': ' '.join(word(rng) for _ in range(rng.randint(1, 3))),
+                            'artist_location': rng.choice(LOCATIONS) if latitude is not None else '',
+                            'artist_latitude': latitude, 'artist_longitude': longitude})
+
+        # a few artists have most of the songs
+        artist_weights = zipf_weights(len(artists))
+        for n in range(max(1, round(SONGS_PER_SCALE * scale))):
+            artist = rng.choices(artists, cum_weights=artist_weights)[0]
+            song = {'num_songs': 1, 'track_id': identifier(rng, 'TR')}
+            song.update(artist)
+            song.update({'song_id': identifier(rng, 'SO'),
+                         'title': ' '.join(word(rng) for _ in range(rng.randint(1, 4))),
+                         'duration': round(rng.lognormvariate(5.4, 0.35), 5),
+                         'year': rng.choice([0, 0, rng.randint(1960, 2010)])})
+            self.songs.append(song)
+        self.song_weights = zipf_weights(len(self.songs))
+
+        self.users = []
+        for n in range(max(1, round(USERS_PER_SCALE * scale))):
+            location = rng.randrange(len(LOCATIONS))
+            self.users.append({'userId': str(n + 1), 'firstName': rng.choice(FIRST_NAMES),
+                               'lastName': rng.choice(LAST_NAMES), 'gender': rng.choice('MF'),
+                               'level': 'paid' if rng.random() < 0.3 else 'free',
+                               'location': LOCATIONS[location], 'userAgent': rng.choice(USER_AGENTS),
+                               'registration': float(1540000000000 + rng.randrange(10 ** 9))})
+        self.user_weights = zipf_weights(len(self.users), 0.9)
+
+
+def write_song(song, output):
+    """
+    Function that writes one song file, named and placed like the sample's.
+    """
+    track = song['track_id']
+    directory = os.path.join(output, 'song_data', track[2], track[3], track[4])
+    os.makedirs(directory, exist_ok=True)
+    record = {key: value for key, value in song.items() if key != 'track_id'}
+    with open(os.path.join(directory, track + '.json'), 'w') as f:
+        json.dump(record, f)
+
+
+def day_events(catalog, day, scale, seed, match_rate):
+    """
+    Function that generates the events of one day, in timestamp order.
+
+    Args:
+    ------------------------------------
+        catalog:     Catalog
+        day:         index of the day from FIRST_DAY
+        scale:       multiple of the sample's size
+        seed:        seed of the dataset
+        match_rate:  share of NextSong events naming a song of the catalog;
+                     the others name songs missing from it, as most of the
+                     sample's events do
+
+    Returns:
+        list of event dicts with the keys of LOG_COLUMNS
+    """
+    rng = random.Random('day-{}-{}'.format(seed, day))
+    start = int((FIRST_DAY + timedelta(days=day)).timestamp() * 1000)
+    target = max(1, round(EVENTS_PER_DAY_PER_SCALE * scale * rng.uniform(0.6, 1.4)))
+    pages = [page for page, share in OTHER_PAGES]
+    page_weights = [share for page, share in OTHER_PAGES]
+
+    events = []
+    session = day * 10 ** 6
+    while len(events) < target:
+        session += 1
+        user = rng.choices(catalog.users, cum_weights=catalog.user_weights)[0]
+        ts = start + rng.randrange(24 * 3600 * 1000)
+        for item in range(max(1, int(rng.lognormvariate(1.6, 1.0)))):
+            if rng.random() < NEXT_SONG_SHARE:
+                if rng.random() < match_rate:
+                    song = rng.choices(catalog.songs, cum_weights=catalog.song_weights)[0]
+                    artist, title, length = song['artist_name'], song['title'], song['duration']
+                else:
+                    artist, title = word(rng), word(rng, (1, 3))
+                    length = round(rng.lognormvariate(5.4, 0.35), 5)
+                page, method = 'NextSong', 'PUT'
+            else:
+                artist = title = length = None
+                page = rng.choices(pages, page_weights)[0]
+                method = 'GET' if page in ('Home', 'Help', 'About', 'Settings', 'Downgrade', 'Upgrade') else 'PUT'
+            events.append({'artist': artist, 'auth': 'Logged In', 'firstName': user['firstName'],
+                           'gender': user['gender'], 'itemInSession': item, 'lastName': user['lastName'],
+                           'length': length, 'level': user['level'], 'location': user['location'],
+                           'method': method, 'page': page, 'registration': user['registration'],
+                           'sessionId': session, 'song': title, 'status': 200, 'ts': ts,
+                           'userAgent': user['userAgent'], 'userId': user['userId']})
+            ts += int((length or rng.uniform(5, 60)) * 1000)
+    events.sort(key=lambda event: event['ts'])
+    return events
+
+
+# Catalog of a worker process, built once by the pool initializer
+worker_catalog = None
+
+
+def set_worker_catalog(scale, seed):
+    """
+    Function that builds the catalog in a worker process.
+    """
+    global worker_catalog
+    worker_catalog = Catalog(scale, seed)
+
+
+def write_day(output, day, scale, seed, match_rate):
+    """
+    Function that writes one day of events as JSON lines and as csv.
+
+    Returns:
+        number of events
+    """
+    events = day_events(worker_catalog, day, scale, seed, match_rate)
+    date = FIRST_DAY + timedelta(days=day)
+
+    directory = os.path.join(output, 'log_data', '{:%Y}'.format(date), '{:%m}'.format(date))
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '{:%Y-%m-%d}-events.json'.format(date)), 'w') as f:
+        for event in events:
+            f.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+    directory = os.path.join(output, 'event_data')
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '{:%Y-%m-%d}-events.csv'.format(date)), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        for event in events:
+            writer.writerow(['' if event[column] is None else event[column] for column in CSV_COLUMNS])
+    return len(events)
+
+
+def generate(output, scale=1, seed=0, match_rate=0.5, workers=None):
+    """
+    Function that writes a dataset, unless the same one is already in output.
+
+    Args:
+    ------------------------------------
+        output:      directory for song_data, log_data and event_data
+        scale:       multiple of the sample's size, 1 to 1000
+        seed:        seed; the same seed and scale give the same files
+        match_rate:  share of NextSong events naming a generated song
+        workers:     processes writing days; defaults to the number of CPUs
+
+    Returns:
+        dict describing the dataset, also written to output/dataset.json
+    """
+    settings = {'scale': scale, 'seed': seed, 'match_rate': match_rate}
+    description = os.path.join(output, 'dataset.json')
+    if os.path.exists(description):
+        with open(description) as f:
+            dataset = json.load(f)
+        if {key: dataset.get(key) for key in settings} == settings:
+            return dataset
+        raise ValueError('{} holds another dataset: {}'.format(output, dataset))
+
+    catalog = Catalog(scale, seed)
+    for song in catalog.songs:
+        write_song(song, output)
+    with ProcessPoolExecutor(workers, initializer=set_worker_catalog, initargs=(scale, seed)) as pool:
+        events = sum(pool.map(write_day, [output] * DAYS, range(DAYS), [scale] * DAYS, [seed] * DAYS,
+                              [match_rate] * DAYS))
+
+    dataset = dict(settings, songs=len(catalog.songs), artists=len({song['artist_id'] for song in catalog.songs}),
+                   users=len(catalog.users), events=events, days=DAYS)
+    with open(description, 'w') as f:
+        json.dump(dataset, f, indent=1)
+    return dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Sparkify dataset.')
+    parser.add_argument('--output', required=True, help='directory for song_data, log_data and event_data')
+    parser.add_argument('--scale', type=float, default=1, help='multiple of the bundled sample, 1 to 1000')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--match-rate', type=float, default=0.5,
+                        help='share of NextSong events naming a generated song')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    if not 0 < args.scale <= 1000:
+        parser.error('--scale must be in (0, 1000]')
+
+    dataset = generate(args.output, args.scale, args.seed, args.match_rate, args.workers)
+    print('{songs} songs by {artists} artists, {users} users, {events} events over {days} days'.format(**dataset))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# the shared modules are imported from common/ as the projects' settings put it on the path
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
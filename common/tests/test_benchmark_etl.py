@@ -0,0 +1,9 @@
+import benchmark_etl
+
+
+def test_validate_share_of_the_load_step():
+    result = {'status': 'ok', 'steps': {'create_tables': 1.0, 'etl': 8.0},
+              'stages': {'etl': {'validate': {'wall_seconds': 0.2}}}}
+    assert benchmark_etl.validate_share('postgres', result) == 0.025
+    assert benchmark_etl.validate_share('cassandra', dict(result, steps={'load': 3.0}, stages={'load': {}})) is None
+    assert benchmark_etl.validate_share('postgres', dict(result, status='failed')) is None
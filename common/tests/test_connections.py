@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import pytest
+
+import connections
+from connections import ConfigError, PostgresConfig, postgres_config
+
+
+class ProgrammingError(Exception):
+    pass
+
+
+def _parse_dsn(dsn):
+    # key=value pairs, as libpq parses the simple connection strings used here
+    try:
+        return dict(pair.split('=', 1) for pair in dsn.split())
+    except ValueError:
+        raise ProgrammingError('missing "=" after "{}"'.format(dsn))
+
+
+@pytest.fixture
+def driver(monkeypatch):
+    monkeypatch.setattr(connections, 'psycopg2', SimpleNamespace(
+        extensions=SimpleNamespace(parse_dsn=_parse_dsn), ProgrammingError=ProgrammingError))
+
+
+def test_dsn_port_is_an_integer(driver):
+    assert postgres_config('missing.cfg', 'CLUSTER', dsn='host=localhost dbname=sparkify port=5439') == \
+        PostgresConfig('localhost', 5439, 'sparkify', None, None)
+    assert postgres_config('missing.cfg', 'CLUSTER', dsn='host=localhost dbname=sparkify').port == 5432
+
+
+def test_dsn_errors_are_config_errors(driver):
+    with pytest.raises(ConfigError, match='--dsn has no value for dbname'):
+        postgres_config('missing.cfg', 'CLUSTER', dsn='host=localhost')
+    with pytest.raises(ConfigError, match='--dsn port must be an integer'):
+        postgres_config('missing.cfg', 'CLUSTER', dsn='host=localhost dbname=sparkify port=x')
+    with pytest.raises(ConfigError, match='--dsn is not a connection string'):
+        postgres_config('missing.cfg', 'CLUSTER', dsn='localhost')
+
+
+def test_config_file_needs_every_key(tmp_path):
+    filename = tmp_path / 'dwh.cfg'
+    filename.write_text('[CLUSTER]\nHOST = h\nDB_PORT = 5439\nDB_NAME = d\nDB_USER = u\n')
+    with pytest.raises(ConfigError, match=r'\[CLUSTER\] has no value for DB_PASSWORD'):
+        postgres_config(str(filename), 'CLUSTER')
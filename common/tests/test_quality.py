@@ -0,0 +1,54 @@
+import sqlite3
+
+import pandas as pd
+
+import quality
+
+
+def _events(**changes):
+    event = {'userId': '8', 'ts': 1541106106796, 'sessionId': 139, 'itemInSession': 1, 'level': 'free',
+             'length': 246.3}
+    return dict(event, **changes)
+
+
+def test_validate_keeps_good_rows():
+    df = pd.DataFrame([_events(), _events(itemInSession=2)])
+    good, bad = quality.validate(df, 'log_data')
+    assert len(good) == 2
+    assert bad is None
+
+
+def test_validate_names_every_broken_rule():
+    df = pd.DataFrame([_events(), _events(userId='', level='gold'), _events(ts=0)]).astype({'userId': 'string'})
+    good, bad = quality.validate(df, 'log_data')
+    assert len(good) == 1
+    assert bad['reason'].tolist() == ['userId not an id; level not one of free, paid', 'ts out of range']
+    assert set(bad['dataset']) == {'log_data'}
+
+
+def test_identifier_agrees_on_strings_and_numbers():
+    rule = quality.identifier('userId')
+    values = ['8', '', '-1', '1.5', None]
+    strings = rule.check(pd.DataFrame({'userId': pd.array(values, dtype='string')}))
+    objects = rule.check(pd.DataFrame({'userId': pd.Series(values, dtype=object)}))
+    assert strings.tolist() == objects.tolist() == [False, True, True, True, True]
+
+
+def test_validate_leaves_out_rules_of_missing_columns():
+    good, bad = quality.validate(pd.DataFrame({'song_id': ['S1', '']}), 'song_data')
+    assert good['song_id'].tolist() == ['S1']
+    assert bad['reason'].tolist() == ['song_id missing']
+
+
+def test_reference_count_skips_null_keys():
+    db = sqlite3.connect(':memory:')
+    db.executescript("""CREATE TABLE songplays (user_id TEXT, song_id TEXT);
+                        CREATE TABLE users (user_id TEXT);
+                        CREATE TABLE songs (song_id TEXT);
+                        INSERT INTO users VALUES ('1'), ('1');
+                        INSERT INTO songs VALUES ('S1');
+                        INSERT INTO songplays VALUES ('1', 'S1'), ('1', NULL), ('2', 'S2'), ('1', 'S2');""")
+    query, names = quality.reference_count('songplays', [quality.Reference('user_id', 'users', 'user_id'),
+                                                         quality.Reference('song_id', 'songs', 'song_id')])
+    assert names == ['user_id not in users', 'song_id not in songs']
+    assert db.execute(query).fetchone() == (1, 2)
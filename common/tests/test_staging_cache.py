@@ -0,0 +1,50 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import staging_cache
+
+
+def _write_log(path, day, events):
+    # one JSON line per event, spread over the day
+    start = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+    with open(path, 'w') as f:
+        for n in range(events):
+            f.write(json.dumps({'artist': 'a', 'itemInSession': n, 'level': 'free', 'page': 'NextSong',
+                                'sessionId': 1, 'song': 's', 'ts': start + n * 1000, 'userId': '1'}) + '\n')
+
+
+@pytest.fixture
+def cache(tmp_path):
+    # daily files of February, October and November, two per part, so the first part spans two months
+    source = tmp_path / 'log_data'
+    source.mkdir()
+    for day in [datetime(2018, 2, 27), datetime(2018, 10, 31), datetime(2018, 11, 1), datetime(2018, 11, 2)]:
+        _write_log(source / '{:%Y-%m-%d}-events.json'.format(day), day, 3)
+    staging_cache.normalize(str(source), str(tmp_path / 'cache'), 'log_data', part_bytes=900)
+    return str(tmp_path / 'cache')
+
+
+def test_rows_are_read_in_the_order_of_the_json_files(cache):
+    parts = staging_cache.ordered_parts(cache, 'log_data')
+    assert len(parts) > 1
+    ts = [t for df in staging_cache.iter_frames(cache, 'log_data', ['ts'], batch_rows=2) for t in df['ts']]
+    assert len(ts) == 12
+    assert ts == sorted(ts)
+
+
+def test_only_the_given_parts_are_read(cache):
+    parts = staging_cache.ordered_parts(cache, 'log_data')
+    last, outputs = parts[-1]
+    rows = sum(len(df) for df in staging_cache.iter_frames(cache, 'log_data', parts=[last]))
+    assert 0 < rows < 12
+
+
+def test_part_state_is_named_by_the_part(cache):
+    part, outputs = staging_cache.ordered_parts(cache, 'log_data')[0]
+    state = staging_cache.part_state(cache, 'log_data', part)
+    assert state.sha256 == part
+    assert state == staging_cache.part_state(cache, 'log_data', part)